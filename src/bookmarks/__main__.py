@@ -0,0 +1,66 @@
+import argparse
+import time
+from typing import List, Optional
+
+import bookmarks.config as config
+from bookmarks.log import setup_logging
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='bookmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='run the API server')
+    serve_parser.add_argument('--bind', help='HOST:PORT to listen on (default: SERVER_BIND)')
+    serve_parser.add_argument('--workers', type=int, help='number of worker processes (default: SERVER_WORKERS)')
+    serve_parser.add_argument('--threads', type=int, help='threads per worker (default: SERVER_THREADS)')
+    serve_parser.add_argument('--asgi', action='store_true', help='serve the async (ASGI) app, requires uvicorn')
+
+    commands.add_parser('check-links', help='check links of the bookmarks that are due for a check')
+
+    reconcile_parser = commands.add_parser('reconcile-stats',
+                                           help='rebuild the collection stats from the bookmarks tables')
+    reconcile_parser.add_argument('--interval', type=float,
+                                  help='keep running, every INTERVAL seconds (default: run once)')
+
+    commands.add_parser('sweep-archive', help='remove archived pages that no snapshot references')
+
+    add_user_parser = commands.add_parser('add-user', help='create a user and print their API token')
+    add_user_parser.add_argument('name', help='unique user name')
+
+    args = parser.parse_args(argv)
+
+    # Settings and log files are set up here, by the entry point, not at import.
+    config.load()
+    # The server's workers write the same files as the master, so those are not rotated by the process.
+    setup_logging(rotate=args.command != 'serve')
+
+    # Commands import their modules lazily: each needs only its own part of the package.
+    if args.command == 'serve':
+        from bookmarks.server import serve
+        serve(args.bind, args.workers, args.threads, args.asgi)
+    elif args.command == 'check-links':
+        from bookmarks.link_checker import check_links
+        check_links()
+    elif args.command == 'reconcile-stats':
+        from bookmarks._db_init import create_database
+        from bookmarks.stats_reconciler import reconcile_stats
+        # Creates the summary tables in DBs that predate them.
+        create_database()
+        while True:
+            reconcile_stats()
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+    elif args.command == 'sweep-archive':
+        from bookmarks.archive import sweep_blobs
+        sweep_blobs()
+    elif args.command == 'add-user':
+        from bookmarks._db_init import create_database
+        from bookmarks.auth import create_user
+        create_database()
+        print(create_user(args.name))
+
+
+if __name__ == '__main__':
+    main()
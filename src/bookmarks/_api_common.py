@@ -0,0 +1,29 @@
+import dataclasses
+import json
+from typing import Optional
+
+from bookmarks.api_response import ApiResponse
+from bookmarks.bookmark import Bookmark
+
+
+# Shared by the WSGI (api) and ASGI (asgi) handlers.
+
+
+@dataclasses.dataclass
+class BookmarkParseResult:
+    bookmark: Optional[Bookmark]
+    error_response: Optional[ApiResponse]
+
+
+def parse_bookmark(data: bytes) -> BookmarkParseResult:
+    try:
+        bookmark_dict = json.loads(data)
+    except json.JSONDecodeError as e:
+        return BookmarkParseResult(None, ApiResponse.error(f'JSON decoding error: {"".join(e.args)}'))
+    
+    try:
+        bookmark = Bookmark.deserialize_ignore_id(bookmark_dict)
+    except ValueError as e:
+        return BookmarkParseResult(None, ApiResponse.error(f'Invalid bookmark data: {"".join(e.args)}'))
+
+    return BookmarkParseResult(bookmark, None)
@@ -0,0 +1,186 @@
+"""
+Content-addressed blob store for page snapshots.
+Kept free of Flask and SQLAlchemy imports: the snapshot job runs in
+freshly spawned worker processes.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import functools
+import gzip
+import hashlib
+import http.client
+import os
+import pathlib
+import socket
+import tempfile
+import urllib.request
+from typing import BinaryIO, Dict, Iterator, Optional, Sequence, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from bookmarks._http import Network, allowed_addresses
+
+
+_EXTENSIONS: Dict[str, str] = {
+    'gzip': 'gz',
+    'zstd': 'zst',
+}
+
+_DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+
+def available_encodings() -> Dict[str, str]:
+    if zstandard is None:
+        return {'gzip': _EXTENSIONS['gzip']}
+    return dict(_EXTENSIONS)
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError(f'Unsupported snapshot encoding: {encoding}')
+
+
+def open_decompressed(path: pathlib.Path, encoding: str) -> BinaryIO:
+    if encoding == 'gzip':
+        return gzip.open(path, 'rb')
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    raise ValueError(f'Unsupported snapshot encoding: {encoding}')
+
+
+class BlobStore:
+    """
+    Blobs are addressed by the SHA-256 of their uncompressed content and stored as
+    <root>/<2 hex digits>/<hash>.<ext>, so equal pages share one compressed file.
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = pathlib.Path(root)
+
+    def path(self, blob_hash: str, encoding: str) -> pathlib.Path:
+        return self.root.joinpath(blob_hash[:2], f'{blob_hash}.{_EXTENSIONS[encoding]}')
+
+    def put(self, data: bytes, encoding: str) -> str:
+        blob_hash = hashlib.sha256(data).hexdigest()
+        path = self.path(blob_hash, encoding)
+        if path.exists():
+            # A fresh mtime keeps the blob from being swept before its new snapshot is indexed.
+            try:
+                os.utime(path)
+                return blob_hash
+            except FileNotFoundError:
+                pass  # Swept just now: store it again.
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(_compress(data, encoding))
+            # Atomic, so concurrent writers of the same blob are harmless.
+            os.replace(tmp_name, path)
+        except BaseException:
+            pathlib.Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return blob_hash
+
+    def blobs(self) -> Iterator[Tuple[str, str, pathlib.Path]]:
+        """(hash, encoding, path) of every stored blob."""
+        encodings = {ext: encoding for encoding, ext in _EXTENSIONS.items()}
+        for path in self.root.glob('??/*.*'):
+            blob_hash, _, ext = path.name.partition('.')
+            if ext in encodings and not path.name.startswith('.tmp-'):
+                yield blob_hash, encodings[ext], path
+
+
+def _create_checked_connection(address: Tuple[str, int],
+                               timeout: Optional[float] = None,
+                               source_address: Optional[Tuple[str, int]] = None,
+                               *,
+                               allowed_networks: Sequence[Network]) -> socket.socket:
+    """socket.create_connection() that refuses non-public addresses, as bookmarks._http.HttpClient does."""
+    host, port = address
+    last_error: Optional[OSError] = None
+    for *_, sockaddr in allowed_addresses(host, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM),
+                                          allowed_networks):
+        try:
+            return socket.create_connection((sockaddr[0], port), timeout, source_address)
+        except OSError as e:
+            last_error = e
+    raise last_error
+
+
+class _CheckedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, allowed_networks: Sequence[Network], **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = functools.partial(_create_checked_connection, allowed_networks=allowed_networks)
+
+
+class _CheckedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, allowed_networks: Sequence[Network], **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = functools.partial(_create_checked_connection, allowed_networks=allowed_networks)
+
+
+class _CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, allowed_networks: Sequence[Network]):
+        super().__init__()
+        self._allowed_networks = allowed_networks
+
+    def http_open(self, request):
+        return self.do_open(functools.partial(_CheckedHTTPConnection, allowed_networks=self._allowed_networks),
+                            request)
+
+
+class _CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, allowed_networks: Sequence[Network]):
+        super().__init__()
+        self._allowed_networks = allowed_networks
+
+    def https_open(self, request):
+        return self.do_open(functools.partial(_CheckedHTTPSConnection, allowed_networks=self._allowed_networks),
+                            request, context=self._context)
+
+
+def _build_opener(allowed_networks: Sequence[Network]) -> urllib.request.OpenerDirector:
+    # Every redirect hop opens a new connection, so it is checked too. No proxies: they would be
+    # connected to instead of the checked host.
+    return urllib.request.build_opener(urllib.request.ProxyHandler({}),
+                                       _CheckedHTTPHandler(allowed_networks),
+                                       _CheckedHTTPSHandler(allowed_networks))
+
+
+@dataclasses.dataclass
+class SnapshotBlob:
+    blob_hash: str
+    encoding: str
+    content_type: str
+    size: int
+
+
+def snapshot_job(url: str,
+                 archive_dir: pathlib.Path,
+                 encoding: str,
+                 max_bytes: int,
+                 timeout: float,
+                 allowed_networks: Sequence[Network] = ()) -> Optional[SnapshotBlob]:
+    """
+    Fetch a page and store it in the blob store. Returns None for pages over max_bytes.
+    Raises ForbiddenDestination for hosts without a public address (see bookmarks._http).
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': 'WebBookmarks', 'Accept-Encoding': 'identity'})
+    with _build_opener(allowed_networks).open(request, timeout=timeout) as response:
+        data = response.read(max_bytes + 1)
+        content_type = response.headers.get('Content-Type', _DEFAULT_CONTENT_TYPE)
+    if len(data) > max_bytes:
+        return None
+
+    blob_hash = BlobStore(archive_dir).put(data, encoding)
+    return SnapshotBlob(blob_hash, encoding, content_type, len(data))
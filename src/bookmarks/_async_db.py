@@ -0,0 +1,88 @@
+from contextlib import asynccontextmanager
+import os
+import threading
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from bookmarks import config
+from bookmarks._db import shard_for_owner
+
+
+# Async drivers for the backends whose connect strings name no driver.
+_ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'postgresql': 'asyncpg',
+    'mysql': 'aiomysql',
+}
+
+
+def async_connect_string(connect_string: str) -> str:
+    url = make_url(connect_string)
+    if url.drivername in _ASYNC_DRIVERS:
+        url = url.set(drivername=f'{url.drivername}+{_ASYNC_DRIVERS[url.drivername]}')
+    return url.render_as_string(hide_password=False)
+
+
+# Created on first use, like the engines in bookmarks._db.
+_lock = threading.Lock()
+_async_engine: Optional[AsyncEngine] = None
+_async_session: Optional[sessionmaker] = None
+# Same shards, in the same order, as bookmarks._db.get_shard_engines().
+_async_shard_engines: List[AsyncEngine] = []
+_async_shard_sessions: List[sessionmaker] = []
+
+
+def _create_async_engines() -> None:
+    global _async_engine, _async_session, _async_shard_engines, _async_shard_sessions
+    with _lock:
+        if _async_engine is not None:
+            return
+        engine = create_async_engine(config.DB_ASYNC_CONNECT_STRING or async_connect_string(config.DB_CONNECT_STRING))
+        _async_shard_engines = [
+            create_async_engine(async_connect_string(s)) for s in config.DB_SHARD_CONNECT_STRINGS
+        ] or [engine]
+        _async_shard_sessions = [
+            sessionmaker(bind=shard_engine, class_=AsyncSession, expire_on_commit=False)
+            for shard_engine in _async_shard_engines
+        ]
+        _async_session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        _async_engine = engine
+
+
+async def dispose_async_engines() -> None:
+    if _async_engine is None:
+        return
+    for e in {_async_engine, *_async_shard_engines}:
+        await e.dispose()
+
+
+def _dispose_inherited_pool() -> None:
+    if _async_engine is None:
+        return
+    for e in {_async_engine, *_async_shard_engines}:
+        e.sync_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_inherited_pool)
+
+
+@asynccontextmanager
+async def AsyncScopedSession(owner_id: Optional[int] = None,
+                             shard: Optional[int] = None) -> AsyncIterator[AsyncSession]:
+    """Async counterpart of bookmarks._db.ScopedSession."""
+    if owner_id is not None:
+        shard = shard_for_owner(owner_id)
+    if _async_engine is None:
+        _create_async_engines()
+    session = _async_session() if shard is None else _async_shard_sessions[shard]()
+    try:
+        yield session
+        await session.commit()
+    except:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
@@ -1,21 +1,83 @@
 from contextlib import contextmanager
-from typing import Iterator
+import os
+import threading
+from typing import Iterator, List, Optional
+import zlib
 
 import sqlalchemy.orm
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 from bookmarks import config
 
 
-engine = create_engine(config.DB_CONNECT_STRING)
-Session = sessionmaker()
-Session.configure(bind=engine)
+# Engines are created on first use, not at import: importing the package opens no pools
+# and reads no settings, and a process forked before that has nothing to reset.
+_lock = threading.Lock()
+# The main DB holds users, and also all bookmarks unless they are sharded.
+_engine: Optional[Engine] = None
+_session: Optional[sessionmaker] = None
+_shard_engines: List[Engine] = []
+_shard_sessions: List[sessionmaker] = []
+
+
+def _create_engines() -> None:
+    global _engine, _session, _shard_engines, _shard_sessions
+    with _lock:
+        if _engine is not None:
+            return
+        engine = create_engine(config.DB_CONNECT_STRING)
+        _shard_engines = [create_engine(s) for s in config.DB_SHARD_CONNECT_STRINGS] or [engine]
+        _shard_sessions = [sessionmaker(bind=shard_engine) for shard_engine in _shard_engines]
+        _session = sessionmaker(bind=engine)
+        # Assigned last: other threads only look at the rest once this is set.
+        _engine = engine
+
+
+def get_engine() -> Engine:
+    if _engine is None:
+        _create_engines()
+    return _engine
+
+
+def get_shard_engines() -> List[Engine]:
+    if _engine is None:
+        _create_engines()
+    return _shard_engines
+
+
+def shard_count() -> int:
+    return len(get_shard_engines())
+
+
+def shard_for_owner(owner_id: int) -> int:
+    # crc32 is stable across processes and Python versions, unlike hash().
+    return zlib.crc32(str(owner_id).encode('ascii')) % shard_count()
+
+
+def _dispose_inherited_pool() -> None:
+    # Connections opened by the parent must not be shared with the child; close=False leaves them to the parent.
+    if _engine is None:
+        return
+    for e in {_engine, *_shard_engines}:
+        e.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_inherited_pool)
 
 
 @contextmanager
-def ScopedSession() -> Iterator[sqlalchemy.orm.Session]:
-    session = Session()
+def ScopedSession(owner_id: Optional[int] = None, shard: Optional[int] = None) -> Iterator[sqlalchemy.orm.Session]:
+    """
+    Session on the main DB, or on the shard holding the bookmarks
+    of owner_id, or on the given shard.
+    """
+    if owner_id is not None:
+        shard = shard_for_owner(owner_id)
+    if _engine is None:
+        _create_engines()
+    session = _session() if shard is None else _shard_sessions[shard]()
     try:
         yield session
         session.commit()
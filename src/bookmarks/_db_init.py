@@ -1,6 +1,75 @@
-from bookmarks._db_base import Base
-from bookmarks._db import engine
+import logging
+from typing import List
+
+from sqlalchemy import Table, inspect, literal, text
+from sqlalchemy.engine import Engine
+
+from bookmarks.log import get_logger
+# Importing the schema registers every model in Base.metadata.
+from bookmarks.schema import Base, Favicon, User, get_engine, get_shard_engines
+
+
+L = get_logger('db_init', logging.INFO)
+
+# Shared by all owners, so kept in the main DB only; the other tables are per shard.
+_GLOBAL_TABLES = frozenset((User.__table__, Favicon.__table__))
+
+
+def _tables_of(e: Engine) -> List[Table]:
+    tables = []
+    if e is get_engine():
+        tables += [table for table in Base.metadata.sorted_tables if table in _GLOBAL_TABLES]
+    if e in get_shard_engines():
+        tables += [table for table in Base.metadata.sorted_tables if table not in _GLOBAL_TABLES]
+    return tables
+
+
+def _add_missing_columns(e: Engine, tables: List[Table]) -> None:
+    """
+    create_all only creates missing tables, so columns added to an existing table by a later
+    version are added here. They are nullable or have a constant default, so existing rows stay valid.
+    """
+    inspector = inspect(e)
+    existing_tables = set(inspector.get_table_names())
+    preparer = e.dialect.identifier_preparer
+    with e.begin() as connection:
+        for table in tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f'ALTER TABLE {preparer.format_table(table)} ' \
+                      f'ADD COLUMN {preparer.format_column(column)} {column.type.compile(e.dialect)}'
+                if column.default is not None and column.default.is_scalar:
+                    default = literal(column.default.arg, column.type) \
+                        .compile(dialect=e.dialect, compile_kwargs={'literal_binds': True})
+                    ddl += f' DEFAULT {default}'
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                elif not column.nullable:
+                    raise RuntimeError(f'Cannot add the required column {table.name}.{column.name} to existing rows')
+                connection.execute(text(ddl))
+                L.info(f'Added column {table.name}.{column.name}')
+
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    L.info(f'Added index {index.name}')
 
 
 def create_database() -> None:
-    Base.metadata.create_all(engine)
+    for e in {get_engine(), *get_shard_engines()}:
+        tables = _tables_of(e)
+        Base.metadata.create_all(e, tables=tables)
+        _add_missing_columns(e, tables)
+
+
+def warm_up_database() -> None:
+    """Check that the DB is reachable, then close the connection so that it is not inherited by forked workers."""
+    for e in {get_engine(), *get_shard_engines()}:
+        with e.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        e.dispose()
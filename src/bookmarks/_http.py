@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import dataclasses
+import errno
+import ipaddress
+import socket
+import ssl
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote, urljoin, urlsplit, SplitResult
+
+
+_REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+_NO_BODY_STATUSES = frozenset((204, 304))
+_READ_CHUNK_SIZE = 64 * 1024
+# Errors of this machine, not of the remote host: out of file descriptors, buffers or memory.
+_LOCAL_ERRNOS = frozenset((errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM))
+
+# Characters left as they are in the request target: reserved and unreserved ones and '%' of existing escapes.
+_PATH_SAFE = "/%:@!$&'()*+,;=-._~"
+_QUERY_SAFE = _PATH_SAFE + '?'
+
+# (scheme, ASCII host name, port)
+_HostKey = Tuple[str, str, int]
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# Receives the response headers and body chunks as they arrive; returning False stops reading the body.
+BodyConsumer = Callable[[Dict[str, str], bytes], bool]
+
+
+class HttpError(Exception):
+    pass
+
+
+class ForbiddenDestination(HttpError):
+    """The host resolves to no public address, e.g. to a loopback, private or link-local one."""
+
+
+@dataclasses.dataclass
+class HttpResponse:
+    status: int
+    url: str
+    headers: Dict[str, str]
+    body: bytes
+
+
+@dataclasses.dataclass
+class _HostLimit:
+    semaphore: asyncio.Semaphore
+    # Requests holding or waiting for the semaphore; the limit is dropped when there are none.
+    users: int = 0
+
+
+@dataclasses.dataclass(eq=False)
+class _Connection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    # Loop time when the connection was returned to the idle pool.
+    idle_since: float = 0.0
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def is_http_url(url: str) -> bool:
+    return urlsplit(url).scheme in ('http', 'https')
+
+
+def is_local_error(e: BaseException) -> bool:
+    """True if the request failed for lack of local resources, which says nothing about the URL."""
+    return isinstance(e, OSError) and e.errno in _LOCAL_ERRNOS
+
+
+def is_allowed_address(address: str, allowed_networks: Sequence[Network] = ()) -> bool:
+    """
+    Bookmarked URLs are supplied by the users, so they are only fetched from public addresses:
+    otherwise any user could read internal services (e.g. cloud metadata) through the snapshots.
+    allowed_networks are exempt, e.g. for an intranet deployment or a local test server.
+    """
+    ip = ipaddress.ip_address(address.partition('%')[0])  # Without the IPv6 zone index.
+    if ip.is_global and not ip.is_multicast:
+        return True
+    return any(ip in network for network in allowed_networks)
+
+
+def allowed_addresses(host: str,
+                      infos: Sequence[Tuple],
+                      allowed_networks: Sequence[Network]) -> List[Tuple]:
+    """The getaddrinfo() results that may be connected to; raises ForbiddenDestination if there are none."""
+    allowed = [info for info in infos if is_allowed_address(info[4][0], allowed_networks)]
+    if not allowed:
+        raise ForbiddenDestination(f'{host} does not resolve to a public address')
+    return allowed
+
+
+def _host_key(url: SplitResult) -> _HostKey:
+    if url.scheme not in ('http', 'https') or not url.hostname:
+        raise HttpError(f'Unsupported URL: {url.geturl()}')
+    try:
+        # Internationalized domain names are sent in their ASCII (punycode) form.
+        host = url.hostname.encode('idna').decode('ascii')
+        port = url.port
+    except (UnicodeError, ValueError):
+        raise HttpError(f'Invalid host in URL: {url.geturl()}')
+    default_port = 443 if url.scheme == 'https' else 80
+    return url.scheme, host.lower(), port or default_port
+
+
+def _host_header(key: _HostKey) -> str:
+    scheme, host, port = key
+    if ':' in host:
+        host = f'[{host}]'  # IPv6 address
+    return host if port == (443 if scheme == 'https' else 80) else f'{host}:{port}'
+
+
+def _request_target(url: SplitResult) -> str:
+    """Path and query, percent-encoded as UTF-8 where they have other than URL characters (e.g. Cyrillic or spaces)."""
+    target = quote(url.path, safe=_PATH_SAFE) or '/'
+    if url.query:
+        target += '?' + quote(url.query, safe=_QUERY_SAFE)
+    return target
+
+
+class HttpClient:
+    """
+    Minimal asyncio HTTP/1.1 client for the background jobs.
+    Bounds both the total number of in-flight requests and the number of requests per host.
+    Idle keep-alive connections are kept for reuse, at most max_idle_per_host per host and
+    max_idle in total (the least recently used go first), and closed after keep_alive_timeout
+    seconds, so that a run over many distinct hosts does not pile up open sockets.
+    Only public addresses are connected to, apart from allowed_networks; redirects
+    are checked the same way, since every hop connects anew.
+    """
+
+    def __init__(self,
+                 max_connections: int = 100,
+                 max_per_host: int = 4,
+                 timeout: float = 10.0,
+                 max_redirects: int = 5,
+                 user_agent: str = 'WebBookmarks',
+                 max_idle: Optional[int] = None,
+                 max_idle_per_host: Optional[int] = None,
+                 keep_alive_timeout: float = 15.0,
+                 allowed_networks: Sequence[Network] = ()):
+        self._global_limit = asyncio.Semaphore(max_connections)
+        self._max_per_host = max_per_host
+        self._host_limits: Dict[_HostKey, _HostLimit] = {}
+        self._idle: Dict[_HostKey, List[_Connection]] = {}
+        # Every idle connection, least recently used first.
+        self._idle_lru: collections.OrderedDict[_Connection, _HostKey] = collections.OrderedDict()
+        self._max_idle = max_connections if max_idle is None else max_idle
+        self._max_idle_per_host = max_per_host if max_idle_per_host is None else max_idle_per_host
+        self._keep_alive_timeout = keep_alive_timeout
+        self._allowed_networks = tuple(allowed_networks)
+        self._expiry_timer: Optional[asyncio.TimerHandle] = None
+        self._timeout = timeout
+        self._max_redirects = max_redirects
+        self._user_agent = user_agent
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    async def __aenter__(self) -> HttpClient:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._expiry_timer is not None:
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
+        for conn in self._idle_lru:
+            conn.close()
+        self._idle.clear()
+        self._idle_lru.clear()
+
+    def idle_connections(self) -> int:
+        return len(self._idle_lru)
+
+    async def request(self,
+                      method: str,
+                      url: str,
+                      max_body: int = 0,
+                      consumer: Optional[BodyConsumer] = None) -> HttpResponse:
+        """
+        Perform a request, following redirects. At most max_body bytes of the
+        response body are read; the rest is discarded along with the connection.
+        If a consumer is given, the body is passed to it chunk by chunk instead
+        of being collected into HttpResponse.body.
+        """
+        for _ in range(self._max_redirects + 1):
+            response = await self._request_once(method, url, max_body, consumer)
+            location = response.headers.get('location')
+            if response.status not in _REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+            if response.status == 303 and method != 'HEAD':
+                method = 'GET'
+        raise HttpError(f'Too many redirects: {url}')
+
+    async def _request_once(self,
+                            method: str,
+                            url: str,
+                            max_body: int,
+                            consumer: Optional[BodyConsumer]) -> HttpResponse:
+        parsed = urlsplit(url)
+        key = _host_key(parsed)
+        host_limit = self._host_limits.get(key)
+        if host_limit is None:
+            host_limit = self._host_limits[key] = _HostLimit(asyncio.Semaphore(self._max_per_host))
+        host_limit.users += 1
+        try:
+            # The host slot first: a request waiting for a busy host does not hold a global slot.
+            async with host_limit.semaphore, self._global_limit:
+                conn = self._pop_idle(key)
+                if conn is not None:
+                    try:
+                        return await self._exchange(key, conn, method, parsed, max_body, consumer)
+                    except (ConnectionError, asyncio.IncompleteReadError, HttpError):
+                        # The server may have dropped an idle keep-alive connection; retry on a fresh one.
+                        pass
+                conn = await asyncio.wait_for(self._connect(key), self._timeout)
+                return await self._exchange(key, conn, method, parsed, max_body, consumer)
+        finally:
+            host_limit.users -= 1
+            if not host_limit.users:
+                del self._host_limits[key]
+
+    def _pop_idle(self, key: _HostKey) -> Optional[_Connection]:
+        self._close_expired()
+        while key in self._idle:
+            conn = self._idle[key][-1]
+            self._forget_idle(key, conn)
+            if not conn.writer.is_closing() and not conn.reader.at_eof():
+                return conn
+            conn.close()
+        return None
+
+    def _put_idle(self, key: _HostKey, conn: _Connection) -> None:
+        connections = self._idle.setdefault(key, [])
+        if len(connections) >= self._max_idle_per_host or self._max_idle <= 0:
+            if not connections:
+                del self._idle[key]
+            conn.close()
+            return
+        loop = asyncio.get_running_loop()
+        conn.idle_since = loop.time()
+        connections.append(conn)
+        self._idle_lru[conn] = key
+        while len(self._idle_lru) > self._max_idle:
+            oldest, oldest_key = next(iter(self._idle_lru.items()))
+            self._forget_idle(oldest_key, oldest)
+            oldest.close()
+        if self._expiry_timer is None:
+            self._expiry_timer = loop.call_later(self._keep_alive_timeout, self._on_expiry_timer)
+
+    def _forget_idle(self, key: _HostKey, conn: _Connection) -> None:
+        del self._idle_lru[conn]
+        connections = self._idle[key]
+        connections.remove(conn)
+        if not connections:
+            del self._idle[key]
+
+    def _close_expired(self) -> None:
+        deadline = asyncio.get_running_loop().time() - self._keep_alive_timeout
+        while self._idle_lru:
+            oldest, key = next(iter(self._idle_lru.items()))
+            if oldest.idle_since > deadline:
+                break
+            self._forget_idle(key, oldest)
+            oldest.close()
+
+    def _on_expiry_timer(self) -> None:
+        # Also runs while the client is unused, e.g. in an enricher waiting for jobs.
+        self._expiry_timer = None
+        self._close_expired()
+        if self._idle_lru:
+            oldest = next(iter(self._idle_lru))
+            delay = oldest.idle_since + self._keep_alive_timeout - asyncio.get_running_loop().time()
+            self._expiry_timer = asyncio.get_running_loop().call_later(max(delay, 0.0), self._on_expiry_timer)
+
+    async def _connect(self, key: _HostKey) -> _Connection:
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        last_error: Optional[OSError] = None
+        # Connected by address, so that the name cannot resolve differently from the checked address.
+        for *_, sockaddr in allowed_addresses(host, infos, self._allowed_networks):
+            try:
+                reader, writer = await asyncio.open_connection(sockaddr[0], port, ssl=ssl_context,
+                                                               server_hostname=host if ssl_context else None)
+                return _Connection(reader, writer)
+            except OSError as e:
+                last_error = e
+        raise last_error
+
+    async def _exchange(self,
+                        key: _HostKey,
+                        conn: _Connection,
+                        method: str,
+                        url: SplitResult,
+                        max_body: int,
+                        consumer: Optional[BodyConsumer]) -> HttpResponse:
+        try:
+            response, reusable = await asyncio.wait_for(self._roundtrip(key, conn, method, url, max_body, consumer),
+                                                        self._timeout)
+        except BaseException:
+            conn.close()
+            raise
+        if reusable:
+            self._put_idle(key, conn)
+        else:
+            conn.close()
+        return response
+
+    async def _roundtrip(self,
+                         key: _HostKey,
+                         conn: _Connection,
+                         method: str,
+                         url: SplitResult,
+                         max_body: int,
+                         consumer: Optional[BodyConsumer]) -> Tuple[HttpResponse, bool]:
+        conn.writer.write((
+            f'{method} {_request_target(url)} HTTP/1.1\r\n'
+            f'Host: {_host_header(key)}\r\n'
+            f'User-Agent: {self._user_agent}\r\n'
+            'Accept: */*\r\n'
+            'Accept-Encoding: identity\r\n'
+            'Connection: keep-alive\r\n'
+            '\r\n'
+        ).encode('latin-1'))
+        await conn.writer.drain()
+
+        status_line = await conn.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by the server')
+        try:
+            version, status_str = status_line.decode('latin-1').split(None, 2)[:2]
+            status = int(status_str)
+        except ValueError:
+            raise HttpError(f'Malformed status line: {status_line!r}')
+
+        headers = await self._read_headers(conn.reader)
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in _NO_BODY_STATUSES or 100 <= status < 200:
+            return HttpResponse(status, url.geturl(), headers, b''), keep_alive
+
+        if status in _REDIRECT_STATUSES and 'location' in headers:
+            consumer = None  # Redirect bodies are of no interest to the consumer.
+
+        body = bytearray()
+        received = 0
+        complete = False
+        async for chunk, is_last in self._iter_body(conn.reader, headers):
+            room = max_body - received
+            chunk, truncated = chunk[:room], len(chunk) > room
+            received += len(chunk)
+            if consumer is None:
+                body += chunk
+            elif chunk and not consumer(headers, chunk):
+                break
+            if is_last and not truncated:
+                complete = True
+            if received >= max_body:
+                break
+        return HttpResponse(status, url.geturl(), headers, bytes(body)), keep_alive and complete
+
+    @staticmethod
+    async def _read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise asyncio.IncompleteReadError(b'', None)
+            if line in (b'\r\n', b'\n'):
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    @staticmethod
+    async def _iter_body(reader: asyncio.StreamReader,
+                         headers: Dict[str, str]) -> AsyncIterator[Tuple[bytes, bool]]:
+        """
+        Yield (chunk, is_last) pairs. is_last is True only if the body
+        is known to end with this chunk, i.e. the connection may be reused.
+        """
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                size_line = await reader.readline()
+                try:
+                    size = int(size_line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise HttpError(f'Malformed chunk size: {size_line!r}')
+                if size == 0:
+                    await HttpClient._read_headers(reader)  # trailers
+                    yield b'', True
+                    return
+                chunk = await reader.readexactly(size)
+                await reader.readexactly(2)
+                yield chunk, False
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            if remaining == 0:
+                yield b'', True
+            while remaining > 0:
+                chunk = await reader.read(min(remaining, _READ_CHUNK_SIZE))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                remaining -= len(chunk)
+                yield chunk, remaining == 0
+        else:
+            while True:
+                chunk = await reader.read(_READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk, False
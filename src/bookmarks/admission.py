@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import collections
+import threading
+import time
+from typing import Deque, Dict
+
+import bookmarks.config as config
+
+
+_READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+class _Ticket:
+    """Place of a waiting request in the queue; set once a slot is handed over to it."""
+
+    def __init__(self):
+        self.granted = False
+        self.event = threading.Event()
+
+
+class ConcurrencyLimiter:
+    """
+    Admits at most `limit` concurrent requests. Excess requests wait in FIFO order,
+    but no more than `max_queue` of them and no longer than `queue_timeout` seconds;
+    the rest are rejected right away so that they can be shed cheaply.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue: Deque[_Ticket] = collections.deque()
+
+        self._admitted = 0
+        self._queued = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def acquire(self) -> bool:
+        with self._lock:
+            # A free slot with nobody queued: release() hands slots to queued requests directly,
+            # so a newcomer never takes one that a queued request is entitled to.
+            if self._active < self.limit and not self._queue:
+                self._active += 1
+                self._admitted += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                self._rejected_queue_full += 1
+                return False
+
+            ticket = _Ticket()
+            self._queue.append(ticket)
+            self._queued += 1
+        start = time.monotonic()
+        ticket.event.wait(self.queue_timeout)
+
+        with self._lock:
+            # Checked under the lock: the slot may have been handed over right after the wait timed out.
+            if not ticket.granted:
+                self._queue.remove(ticket)
+                self._rejected_timeout += 1
+                return False
+            self._admitted += 1
+            wait = time.monotonic() - start
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._queue:
+                # The slot passes to the head of the queue without becoming free in between.
+                ticket = self._queue.popleft()
+                ticket.granted = True
+                ticket.event.set()
+            else:
+                self._active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'max_queue': self.max_queue,
+                'queue_timeout': self.queue_timeout,
+                'active': self._active,
+                'waiting': len(self._queue),
+                'admitted': self._admitted,
+                'queued': self._queued,
+                'rejected_queue_full': self._rejected_queue_full,
+                'rejected_timeout': self._rejected_timeout,
+                'avg_queue_wait': self._total_wait / self._queued if self._queued else 0.0,
+                'max_queue_wait': self._max_wait,
+            }
+
+
+class AdmissionControl:
+    """Separate concurrency budgets for reads and writes, so a burst of one cannot starve the other."""
+
+    def __init__(self, reads: ConcurrencyLimiter, writes: ConcurrencyLimiter, retry_after: int):
+        self.reads = reads
+        self.writes = writes
+        self.retry_after = retry_after
+
+    @staticmethod
+    def from_config() -> AdmissionControl:
+        return AdmissionControl(
+            reads=ConcurrencyLimiter('reads', config.API_MAX_READS, config.API_MAX_QUEUED_READS,
+                                     config.API_QUEUE_TIMEOUT),
+            writes=ConcurrencyLimiter('writes', config.API_MAX_WRITES, config.API_MAX_QUEUED_WRITES,
+                                      config.API_QUEUE_TIMEOUT),
+            retry_after=config.API_RETRY_AFTER,
+        )
+
+    def limiter_for(self, method: str) -> ConcurrencyLimiter:
+        return self.reads if method in _READ_METHODS else self.writes
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            self.reads.name: self.reads.stats(),
+            self.writes.name: self.writes.stats(),
+        }
@@ -1,43 +1,119 @@
-import dataclasses
 from http import HTTPStatus
-import json
 import logging
-from typing import Dict, List, Optional
+import threading
+from typing import Any, Dict, List, Optional, Union
 
 import flask
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
-from bookmarks._db_init import create_database
-from bookmarks.api_response import ApiResponse, public_api, private_api
+from bookmarks._api_common import parse_bookmark
+from bookmarks.admission import AdmissionControl
+from bookmarks.api_response import ApiResponse, cached_api, public_api, private_api
+from bookmarks.auth import admin_api, owner_api
+from bookmarks.collection_stats import (
+    Statement, Upsert, activity_query, record_created, record_deleted, record_updated, summarize, today,
+    top_domains_query, total_query,
+)
 import bookmarks.config as config
-from bookmarks.log import get_logger, redirect_basic_logging
-from bookmarks.schema import Bookmark, ScopedSession
+from bookmarks.log import get_logger, redirect_basic_logging, setup_logging
+from bookmarks.response_cache import get_response_cache, invalidate_owner
+from bookmarks.schema import Bookmark, ScopedSession, Snapshot
 
+# The background jobs (bookmarks.enrichment, bookmarks.archive) and the schema setup are imported
+# by the handlers that use them: most processes importing this module never need them.
 
-api_route = config.api_route
 
 L = get_logger('api', logging.DEBUG)
-redirect_basic_logging(L, logging.INFO)
 
-app = flask.Flask(__name__)
-app.secret_key = config.SECRET_KEY
+# Routes are relative to API_PREFIX, which is only read when the app is built by get_app().
+api = flask.Blueprint('api', __name__)
 
+_app: Optional[flask.Flask] = None
+_app_lock = threading.Lock()
 
-@app.before_first_request
-def init_app():
+_admission: Optional[AdmissionControl] = None
+_admission_lock = threading.Lock()
+
+
+def get_app() -> flask.Flask:
+    """The Flask app serving the API routes under API_PREFIX, built on first use."""
+    global _app
+    with _app_lock:
+        if _app is None:
+            app = flask.Flask(__name__)
+            app.register_blueprint(api, url_prefix=config.API_PREFIX)
+            _app = app
+        return _app
+
+
+def __getattr__(name: str) -> Any:
+    # `from bookmarks.api import app` keeps working, without building the app at import.
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_admission() -> AdmissionControl:
+    global _admission
+    with _admission_lock:
+        if _admission is None:
+            _admission = AdmissionControl.from_config()
+        return _admission
+
+
+def _execute(session: Session, statements: List[Statement]) -> None:
+    for statement in statements:
+        if isinstance(statement, Upsert):
+            _upsert(session, statement)
+        else:
+            session.execute(statement)
+
+
+def _upsert(session: Session, upsert: Upsert) -> None:
+    if session.execute(upsert.update).rowcount:
+        return
+    try:
+        with session.begin_nested():
+            session.execute(upsert.insert)
+    except IntegrityError:
+        # A concurrent write inserted the row after our update.
+        session.execute(upsert.update)
+
+
+def create_app() -> flask.Flask:
+    """
+    Prepare the app for serving: load the settings, open the log files, create the schema
+    and check the DB connection. Importing this module does none of that.
+    Meant to be called once per deployment, e.g. in the server master before forking workers.
+    """
+    from bookmarks._db_init import create_database, warm_up_database
+
+    config.load()
+    setup_logging()
+    redirect_basic_logging(L, logging.INFO)
+    app = get_app()
+    app.secret_key = config.SECRET_KEY
     create_database()
+    warm_up_database()
+    return app
 
 
 # GET bookmark
-@app.route(api_route('/bookmarks/<string:bookmark_id_str>'), methods=['GET'])
-@public_api(app)
-def bookmarks_get(bookmark_id_str: str) -> ApiResponse:
+@api.route('/bookmarks/<string:bookmark_id_str>', methods=['GET'])
+@public_api(get_admission)
+@owner_api
+@cached_api()
+def bookmarks_get(bookmark_id_str: str, owner_id: int) -> ApiResponse:
     try:
         bookmark_id = int(bookmark_id_str)
     except ValueError:
         return ApiResponse.error('Invalid bookmark id (should be integer)')
     
-    with ScopedSession() as session:
-        bookmark: Optional[Bookmark] = session.query(Bookmark).get(bookmark_id)
+    with ScopedSession(owner_id) as session:
+        bookmark: Optional[Bookmark] = session.query(Bookmark) \
+            .filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id) \
+            .one_or_none()
         if bookmark is None:
             return ApiResponse.error('Bookmark not found', HTTPStatus.NOT_FOUND)
         else:
@@ -45,89 +121,198 @@ def bookmarks_get(bookmark_id_str: str) -> ApiResponse:
 
 
 # GET bookmarks list
-@app.route(api_route('/bookmarks'), methods=['GET'])
-@public_api(app)
-def bookmarks_list() -> ApiResponse:
-    with ScopedSession() as session:
-        total_count = session.query(Bookmark).count()
-        
-        bookmarks = session.query(Bookmark).all()
-        bookmarks_serialized = [bookmark.serialize() for bookmark in sorted(bookmarks, key=lambda b: b.id)]
+@api.route('/bookmarks', methods=['GET'])
+@public_api(get_admission)
+@owner_api
+@cached_api()
+def bookmarks_list(owner_id: int) -> ApiResponse:
+    with ScopedSession(owner_id) as session:
+        owned = session.query(Bookmark).filter(Bookmark.owner_id == owner_id)
+        bookmarks = owned.order_by(Bookmark.id).all()
+        bookmarks_serialized = [bookmark.serialize() for bookmark in bookmarks]
         return ApiResponse.success(bookmarks_serialized)
 
 
-@dataclasses.dataclass
-class _BookmarkParseResult:
-    bookmark: Optional[Bookmark]
-    error_response: Optional[ApiResponse]
-
-
-def _parse_bookmark(data: bytes) -> _BookmarkParseResult:
-    try:
-        bookmark_dict = json.loads(data)
-    except json.JSONDecodeError as e:
-        return _BookmarkParseResult(None, ApiResponse.error(f'JSON decoding error: {"".join(e.args)}'))
-    
-    try:
-        bookmark = Bookmark.deserialize_ignore_id(bookmark_dict)
-    except ValueError as e:
-        return _BookmarkParseResult(None, ApiResponse.error(f'Invalid bookmark data: {"".join(e.args)}'))
-
-    return _BookmarkParseResult(bookmark, None)
-
-
 # Create new bookmark
-@app.route(api_route('/bookmarks'), methods=['POST'])
-@public_api(app)
-def bookmarks_post() -> ApiResponse:
-    res = _parse_bookmark(flask.request.data)
+@api.route('/bookmarks', methods=['POST'])
+@public_api(get_admission)
+@owner_api
+def bookmarks_post(owner_id: int) -> ApiResponse:
+    res = parse_bookmark(flask.request.data)
     if res.error_response is not None:
         return res.error_response
     
     new_bookmark: Bookmark = res.bookmark
+    new_bookmark.owner_id = owner_id
     
-    with ScopedSession() as session:
+    with ScopedSession(owner_id) as session:
         session.add(new_bookmark)
         session.flush()
-        return ApiResponse.success(new_bookmark.serialize(), HTTPStatus.CREATED)
+        bookmark_serialized = new_bookmark.serialize()
+        _execute(session, record_created(session.bind.dialect.name, owner_id, new_bookmark.url))
+    # Invalidated once committed: a reader in between would otherwise cache the old data under the new version.
+    invalidate_owner(owner_id)
+    
+    # Only queued here: the page is fetched in the background once the bookmark is committed.
+    if config.ENRICH_ON_POST and not bookmark_serialized['title']:
+        from bookmarks.enrichment import get_enricher
+        get_enricher().submit(owner_id, bookmark_serialized['id'], bookmark_serialized['url'])
+    if config.ARCHIVE_ENABLED:
+        from bookmarks.archive import get_archiver
+        get_archiver().submit(owner_id, bookmark_serialized['id'], bookmark_serialized['url'])
+    
+    return ApiResponse.success(bookmark_serialized, HTTPStatus.CREATED)
 
 
 # Update an existing bookmark
-@app.route(api_route('/bookmarks/<string:bookmark_id_str>'), methods=['PUT'])
-@public_api(app)
-def bookmarks_put(bookmark_id_str: str) -> ApiResponse:
+@api.route('/bookmarks/<string:bookmark_id_str>', methods=['PUT'])
+@public_api(get_admission)
+@owner_api
+def bookmarks_put(bookmark_id_str: str, owner_id: int) -> ApiResponse:
     try:
         bookmark_id = int(bookmark_id_str)
     except ValueError:
         return ApiResponse.error('Invalid bookmark id (should be integer)')
 
-    res = _parse_bookmark(flask.request.data)
+    res = parse_bookmark(flask.request.data)
     if res.error_response is not None:
         return res.error_response
     
     new_bookmark: Bookmark = res.bookmark
     new_bookmark.id = bookmark_id
+    new_bookmark.owner_id = owner_id
     
-    with ScopedSession() as session:
-        old_bookmark = session.query(Bookmark).get(bookmark_id)
+    with ScopedSession(owner_id) as session:
+        old_bookmark = session.query(Bookmark) \
+            .filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id) \
+            .one_or_none()
+        # Someone else's bookmark is treated as a missing one.
         if old_bookmark is None:
             return ApiResponse.error(f'Adding new bookmarks with an arbitrary IDs is not allowed', HTTPStatus.FORBIDDEN)
+        old_url = old_bookmark.url
         
         new_bookmark = session.merge(new_bookmark)
         session.flush()
-        
-        return ApiResponse.success(new_bookmark.serialize())
+        bookmark_serialized = new_bookmark.serialize()
+        _execute(session, record_updated(session.bind.dialect.name, owner_id, old_url, new_bookmark.url))
+    invalidate_owner(owner_id)
+    
+    return ApiResponse.success(bookmark_serialized)
 
 
 # Delete an existing bookmark
-@app.route(api_route('/bookmarks/<string:bookmark_id_str>'), methods=['DELETE'])
-@public_api(app)
-def bookmarks_delete(bookmark_id_str: str) -> ApiResponse:
+@api.route('/bookmarks/<string:bookmark_id_str>', methods=['DELETE'])
+@public_api(get_admission)
+@owner_api
+def bookmarks_delete(bookmark_id_str: str, owner_id: int) -> ApiResponse:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+    
+    with ScopedSession(owner_id) as session:
+        owned = session.query(Bookmark).filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id)
+        url: Optional[str] = owned.with_entities(Bookmark.url).scalar()
+        existed = url is not None
+        if existed:
+            # Only the index entries: blobs are shared between bookmarks with equal pages.
+            session.query(Snapshot).filter(Snapshot.bookmark_id == bookmark_id).delete()
+            owned.delete()
+            _execute(session, record_deleted(session.bind.dialect.name, owner_id, url))
+    if existed:
+        invalidate_owner(owner_id)
+    return ApiResponse.success({})
+
+
+# Collection statistics, read from the summary tables that the writes above keep up to date
+@api.route('/bookmarks/stats', methods=['GET'])
+@public_api(get_admission)
+@owner_api
+def bookmarks_stats(owner_id: int) -> ApiResponse:
+    day = today()
+    with ScopedSession(owner_id) as session:
+        total = session.execute(total_query(owner_id)).scalar()
+        top_domains = session.execute(top_domains_query(owner_id, config.STATS_TOP_DOMAINS)).all()
+        activity = session.execute(activity_query(owner_id, day)).all()
+    return ApiResponse.success(summarize(total, top_domains, activity, day))
+
+
+# Get the latest archived copy of the bookmarked page
+@api.route('/bookmarks/<string:bookmark_id_str>/snapshot', methods=['GET'])
+@public_api(get_admission)
+@owner_api
+def bookmarks_snapshot_get(bookmark_id_str: str, owner_id: int) -> Union[ApiResponse, flask.Response]:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+    
+    with ScopedSession(owner_id) as session:
+        snapshot: Optional[Snapshot] = session.query(Snapshot) \
+            .join(Bookmark, Bookmark.id == Snapshot.bookmark_id) \
+            .filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id) \
+            .order_by(Snapshot.created_at.desc(), Snapshot.id.desc()) \
+            .first()
+        if snapshot is None:
+            return ApiResponse.error('Snapshot not found', HTTPStatus.NOT_FOUND)
+        blob_hash, encoding, content_type = snapshot.blob_hash, snapshot.encoding, snapshot.content_type
+    
+    from bookmarks._archive_store import open_decompressed
+    from bookmarks.archive import blob_store
+    path = blob_store().path(blob_hash, encoding)
+    if not path.exists():
+        return ApiResponse.error('Snapshot not found', HTTPStatus.NOT_FOUND)
+    # Each representation has its own ETag: the compressed and the decompressed bytes differ.
+    if flask.request.accept_encodings[encoding]:
+        # The stored blob is sent as is: sendfile-capable servers don't copy it through Python, ranges are supported.
+        resp = flask.send_file(path, mimetype=content_type, etag=f'{blob_hash}-{encoding}', conditional=True)
+        resp.headers['Content-Encoding'] = encoding
+    else:
+        resp = flask.send_file(open_decompressed(path, encoding), mimetype=content_type, etag=f'{blob_hash}-identity')
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+# Archive the bookmarked page now
+@api.route('/bookmarks/<string:bookmark_id_str>/snapshot', methods=['POST'])
+@public_api(get_admission)
+@owner_api
+def bookmarks_snapshot_post(bookmark_id_str: str, owner_id: int) -> ApiResponse:
     try:
         bookmark_id = int(bookmark_id_str)
     except ValueError:
         return ApiResponse.error('Invalid bookmark id (should be integer)')
     
-    with ScopedSession() as session:
-        session.query(Bookmark).filter(Bookmark.id == bookmark_id).delete()
-        return ApiResponse.success({})
+    if not config.ARCHIVE_ENABLED:
+        return ApiResponse.error('Page archiving is disabled', HTTPStatus.FORBIDDEN)
+    
+    with ScopedSession(owner_id) as session:
+        bookmark: Optional[Bookmark] = session.query(Bookmark) \
+            .filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id) \
+            .one_or_none()
+        if bookmark is None:
+            return ApiResponse.error('Bookmark not found', HTTPStatus.NOT_FOUND)
+        url = bookmark.url
+    
+    from bookmarks.archive import get_archiver
+    get_archiver().submit(owner_id, bookmark_id, url)
+    return ApiResponse.success({}, HTTPStatus.ACCEPTED)
+
+
+# Admission control counters, for tuning the API_MAX_* settings
+@api.route('/admission/stats', methods=['GET'])
+@private_api()
+@admin_api
+def admission_stats() -> ApiResponse:
+    return ApiResponse.success(get_admission().stats())
+
+
+# Response cache counters (hits and misses are per worker process)
+@api.route('/cache/stats', methods=['GET'])
+@private_api()
+@admin_api
+def cache_stats() -> ApiResponse:
+    cache = get_response_cache()
+    if cache is None:
+        return ApiResponse.error('Response cache is disabled', HTTPStatus.NOT_FOUND)
+    return ApiResponse.success(cache.stats())
@@ -4,9 +4,16 @@ import dataclasses
 import functools
 from http import HTTPStatus
 import json
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import flask
+from werkzeug.exceptions import HTTPException
+
+from bookmarks.admission import AdmissionControl
+from bookmarks.response_cache import get_response_cache
+
+
+CONTENT_TYPE = 'application/json; charset=utf-8'
 
 
 @dataclasses.dataclass
@@ -15,29 +22,28 @@ class ApiResponse:
     status: str
     error_message: Optional[str]
     http_status: HTTPStatus
+    headers: Dict[str, str] = dataclasses.field(default_factory=dict)
     
     @staticmethod
-    def error(error_message: str, http_status: HTTPStatus = HTTPStatus.BAD_REQUEST) -> ApiResponse:
-        return ApiResponse(data={}, status='error', error_message=error_message, http_status=http_status)
+    def error(error_message: str,
+              http_status: HTTPStatus = HTTPStatus.BAD_REQUEST,
+              headers: Optional[Dict[str, str]] = None) -> ApiResponse:
+        return ApiResponse(data={}, status='error', error_message=error_message, http_status=http_status,
+                           headers=headers or {})
 
     @staticmethod
     def success(data: Any, http_status: HTTPStatus = HTTPStatus.OK) -> ApiResponse:
         return ApiResponse(data=data, status='success', error_message=None, http_status=http_status)
 
-    def _make_api_response(self, app: flask.Flask, is_public_api: bool) -> flask.Response:
-        resp = app.make_response(json.dumps({
+    def to_json(self) -> str:
+        return json.dumps({
                 'data': self.data,
                 'status': self.status,
                 'error_message': self.error_message or '',
-            }, ensure_ascii=False))
-        
-        resp.status_code = self.http_status.value
-        
-        resp.mimetype = 'application/json; charset=utf-8'
-        if is_public_api:
-            resp.headers['Access-Control-Allow-Origin'] = '*'
-            
-        return resp
+            }, ensure_ascii=False)
+
+    def _make_api_response(self, app: flask.Flask, is_public_api: bool) -> flask.Response:
+        return _make_json_response(app, self.to_json(), self.http_status, self.headers, is_public_api)
 
     def make_public_response(self, app: flask.Flask) -> flask.Response:
         return self._make_api_response(app, is_public_api=True)
@@ -46,27 +52,93 @@ class ApiResponse:
         return self._make_api_response(app, is_public_api=False)
 
 
-def public_api(app: flask.Flask):
+def _make_json_response(app: flask.Flask,
+                        body: str,
+                        http_status: HTTPStatus,
+                        headers: Dict[str, str],
+                        is_public_api: bool) -> flask.Response:
+    resp = app.make_response(body)
+    
+    resp.status_code = http_status.value
+    
+    resp.mimetype = CONTENT_TYPE
+    resp.headers.update(headers)
+    if is_public_api:
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        
+    return resp
+
+
+def public_api(get_admission: Optional[Callable[[], AdmissionControl]] = None):
+    """
+    Responses are made by the app serving the request, so routes can be declared before it exists.
+    get_admission is called per request, so the admission control may be set up after the routes.
+    """
     def wrapped_decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            admission = get_admission() if get_admission is not None else None
+            limiter = admission.limiter_for(flask.request.method) if admission is not None else None
+            if limiter is not None and not limiter.acquire():
+                # Shed load before touching the DB.
+                ret = ApiResponse.error('Server is overloaded, try again later', HTTPStatus.SERVICE_UNAVAILABLE,
+                                        headers={'Retry-After': str(admission.retry_after)})
+                return ret.make_public_response(flask.current_app)
             try:
-                ret: ApiResponse = func(*args, **kwargs)
+                ret: Union[ApiResponse, flask.Response] = func(*args, **kwargs)
+            except HTTPException as e:
+                # Raised by Werkzeug helpers, e.g. 416 by send_file for an unsatisfiable Range header.
+                ret = flask.current_app.make_response(e.get_response())
             except:
                 ret = ApiResponse.error('Internal server error', HTTPStatus.INTERNAL_SERVER_ERROR)
-            return ret.make_public_response(app)
+            finally:
+                if limiter is not None:
+                    limiter.release()
+            if isinstance(ret, flask.Response):
+                # Raw responses (e.g. files) are passed through as is.
+                ret.headers['Access-Control-Allow-Origin'] = '*'
+                return ret
+            return ret.make_public_response(flask.current_app)
+        return wrapper
+    return wrapped_decorator
+
+
+def cached_api():
+    """
+    Serve successful responses of a read-only handler from the shared response cache.
+    Goes below owner_api: entries are keyed by the handler name, the owner, the
+    route arguments and the owner's data version.
+    """
+    def wrapped_decorator(func):
+        @functools.wraps(func)
+        def wrapper(*, owner_id: int, **kwargs):
+            cache = get_response_cache()
+            if cache is None:
+                return func(owner_id=owner_id, **kwargs)
+            
+            key = cache.key(func.__name__, owner_id, kwargs)
+            body = cache.get(key)
+            if body is None:
+                ret: Union[ApiResponse, flask.Response] = func(owner_id=owner_id, **kwargs)
+                if not isinstance(ret, ApiResponse) or ret.http_status != HTTPStatus.OK or ret.headers:
+                    return ret
+                body = ret.to_json()
+                cache.put(key, body)
+            return _make_json_response(flask.current_app, body, HTTPStatus.OK, {}, is_public_api=False)
         return wrapper
     return wrapped_decorator
 
 
-def private_api(app: flask.Flask):
+def private_api():
     def wrapped_decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             try:
-                ret: ApiResponse = func(*args, **kwargs)
+                ret: Union[ApiResponse, flask.Response] = func(*args, **kwargs)
             except:
                 ret = ApiResponse.error('Internal server error', HTTPStatus.INTERNAL_SERVER_ERROR)
-            return ret.make_private_response(app)
+            if isinstance(ret, flask.Response):
+                return ret
+            return ret.make_private_response(flask.current_app)
         return wrapper
     return wrapped_decorator
@@ -0,0 +1,139 @@
+import concurrent.futures
+import datetime
+import logging
+import multiprocessing
+import threading
+import time
+from typing import Optional, Set, Tuple
+
+import bookmarks.config as config
+from bookmarks._archive_store import BlobStore, SnapshotBlob, available_encodings, snapshot_job
+from bookmarks._http import is_http_url
+from bookmarks.log import get_logger
+from bookmarks.schema import Bookmark, ScopedSession, Snapshot, shard_count
+
+
+L = get_logger('archive', logging.INFO)
+
+
+class Archiver:
+    """
+    Snapshots bookmarked pages into the blob store. Fetching, hashing and
+    compression run on a process pool, so API workers only pay for a submit;
+    the index row is written once the snapshot is stored.
+    """
+
+    def __init__(self, workers: Optional[int] = None, encoding: Optional[str] = None):
+        self._workers = workers or config.ARCHIVE_WORKERS
+        self._encoding = encoding or config.ARCHIVE_ENCODING
+        if self._encoding not in available_encodings():
+            raise ValueError(f'Unsupported snapshot encoding: {self._encoding}')
+
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._pending: Set[concurrent.futures.Future] = set()
+        self._lock = threading.Condition()
+
+    def submit(self, owner_id: int, bookmark_id: int, url: str) -> None:
+        if not is_http_url(url):
+            return
+        with self._lock:
+            if self._executor is None:
+                # Workers are spawned rather than forked from a multithreaded server process.
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self._workers, mp_context=multiprocessing.get_context('spawn'))
+            future = self._executor.submit(snapshot_job, url, config.ARCHIVE_DIR, self._encoding,
+                                           config.ARCHIVE_MAX_PAGE_BYTES, config.ARCHIVE_TIMEOUT,
+                                           config.FETCH_ALLOWED_NETWORKS)
+            self._pending.add(future)
+        future.add_done_callback(lambda f: self._on_done(owner_id, bookmark_id, url, f))
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every snapshot submitted so far is stored and indexed."""
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._pending, timeout)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _on_done(self, owner_id: int, bookmark_id: int, url: str, future: concurrent.futures.Future) -> None:
+        try:
+            blob: Optional[SnapshotBlob] = future.result()
+            if blob is None:
+                L.info(f'Page of bookmark {bookmark_id} is too large to archive: {url}')
+            else:
+                self._record(owner_id, bookmark_id, blob)
+        except Exception as e:
+            L.warning(f'Archiving bookmark {bookmark_id} ({url}) failed: {e!r}')
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+                self._lock.notify_all()
+
+    @staticmethod
+    def _record(owner_id: int, bookmark_id: int, blob: SnapshotBlob) -> None:
+        with ScopedSession(owner_id) as session:
+            # Locked until the insert commits, so that the bookmark cannot be deleted in between.
+            exists = session.query(Bookmark.id) \
+                .filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id) \
+                .with_for_update() \
+                .scalar() is not None
+            if not exists:
+                # The blob is left to sweep_blobs(): other snapshots may share it.
+                L.info(f'Bookmark {bookmark_id} was deleted while its page was archived')
+                return
+            session.add(Snapshot(
+                bookmark_id=bookmark_id,
+                blob_hash=blob.blob_hash,
+                encoding=blob.encoding,
+                content_type=blob.content_type,
+                size=blob.size,
+                created_at=datetime.datetime.utcnow(),
+            ))
+
+
+def blob_store() -> BlobStore:
+    return BlobStore(config.ARCHIVE_DIR)
+
+
+def sweep_blobs(grace: Optional[float] = None) -> int:
+    """
+    Remove the blobs that no snapshot references any more, e.g. after their bookmarks were deleted.
+    Blobs modified in the last `grace` seconds are kept: their snapshots may not be indexed yet.
+    Returns the number of removed blobs.
+    """
+    grace = grace if grace is not None else config.ARCHIVE_SWEEP_GRACE
+    # Listed before the snapshots are read: a blob stored in between is recent and kept.
+    blobs = list(blob_store().blobs())
+    referenced: Set[Tuple[str, str]] = set()
+    for shard in range(shard_count()):
+        with ScopedSession(shard=shard) as session:
+            referenced.update(session.query(Snapshot.blob_hash, Snapshot.encoding).distinct())
+
+    cutoff = time.time() - grace
+    removed = 0
+    for blob_hash, encoding, path in blobs:
+        if (blob_hash, encoding) in referenced:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    L.info(f'Removed {removed} unreferenced blobs of {len(blobs)}')
+    return removed
+
+
+_archiver: Optional[Archiver] = None
+_archiver_lock = threading.Lock()
+
+
+def get_archiver() -> Archiver:
+    global _archiver
+    with _archiver_lock:
+        if _archiver is None:
+            _archiver = Archiver()
+        return _archiver
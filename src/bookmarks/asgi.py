@@ -0,0 +1,540 @@
+import asyncio
+import dataclasses
+import functools
+from http import HTTPStatus
+import logging
+import pathlib
+import re
+from typing import Awaitable, Callable, Dict, List, Match, Optional, Pattern, Set, Tuple, Union
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from werkzeug.exceptions import HTTPException, MethodNotAllowed, NotFound, RequestedRangeNotSatisfiable
+from werkzeug.http import parse_etags, parse_range_header
+
+from bookmarks._api_common import parse_bookmark
+from bookmarks._async_db import AsyncScopedSession, dispose_async_engines
+from bookmarks.api_response import ApiResponse, CONTENT_TYPE
+from bookmarks.auth import authenticate_async
+from bookmarks.collection_stats import (
+    Statement, Upsert, activity_query, record_created, record_deleted, record_updated, summarize, today,
+    top_domains_query, total_query,
+)
+import bookmarks.config as config
+from bookmarks.log import get_logger, setup_logging
+from bookmarks.response_cache import get_response_cache, invalidate_owner
+from bookmarks.schema import Bookmark, Snapshot
+
+# As in bookmarks.api, the background jobs and the schema setup are imported where they are used.
+
+
+L = get_logger('asgi', logging.DEBUG)
+
+_FILE_CHUNK_SIZE = 64 * 1024
+_ROUTE_PARAM_RE = re.compile(r'<string:(\w+)>')
+
+
+@dataclasses.dataclass
+class Request:
+    method: str
+    path: str
+    headers: Dict[str, str]
+    body: bytes
+
+
+@dataclasses.dataclass
+class FileResponse:
+    """Raw (non-JSON) response with a stored snapshot blob."""
+    path: pathlib.Path
+    content_type: str
+    etag: str
+    encoding: str
+    send_compressed: bool
+    # Conditional and range headers of the request, evaluated like Flask's send_file does.
+    request_headers: Dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    """Successful JSON response served from the response cache, already serialized."""
+    body: str
+
+
+Handler = Callable[..., Awaitable[Union[ApiResponse, FileResponse, CachedResponse]]]
+
+# Relative routes and their handlers per method; compiled under API_PREFIX on the first request.
+_routes: Dict[str, Dict[str, Handler]] = {}
+_compiled_routes: Optional[List[Tuple[Pattern, Dict[str, Handler]]]] = None
+
+
+def route(relative_route: str, methods: List[str]):
+    """Same route syntax as Flask's, limited to <string:name> parameters."""
+    def decorator(handler: Handler) -> Handler:
+        handlers = _routes.setdefault(relative_route, {})
+        for method in methods:
+            handlers[method] = handler
+        return handler
+    return decorator
+
+
+def cached(handler: Handler) -> Handler:
+    """
+    Same as bookmarks.api_response.cached_api and with the same keys, so that the entries are
+    shared with the Flask workers. The cache backends are blocking, so they are called in a thread.
+    """
+    @functools.wraps(handler)
+    async def wrapper(request: Request, *, owner_id: int, **kwargs) -> Union[ApiResponse, FileResponse, CachedResponse]:
+        cache = await asyncio.to_thread(get_response_cache)
+        if cache is None:
+            return await handler(request, owner_id=owner_id, **kwargs)
+
+        key = await asyncio.to_thread(cache.key, handler.__name__, owner_id, kwargs)
+        body = await asyncio.to_thread(cache.get, key)
+        if body is None:
+            ret = await handler(request, owner_id=owner_id, **kwargs)
+            if not isinstance(ret, ApiResponse) or ret.http_status != HTTPStatus.OK or ret.headers:
+                return ret
+            body = ret.to_json()
+            await asyncio.to_thread(cache.put, key, body)
+        return CachedResponse(body)
+    return wrapper
+
+
+def _get_routes() -> List[Tuple[Pattern, Dict[str, Handler]]]:
+    global _compiled_routes
+    if _compiled_routes is None:
+        _compiled_routes = []
+        for relative_route, handlers in _routes.items():
+            pattern = _ROUTE_PARAM_RE.sub(r'(?P<\1>[^/]+)', re.escape(config.api_route(relative_route)))
+            _compiled_routes.append((re.compile(f'^{pattern}$'), handlers))
+    return _compiled_routes
+
+
+def create_app():
+    """Same as bookmarks.api.create_app: prepare the DB once, before the server starts its workers."""
+    from bookmarks._db_init import create_database, warm_up_database
+
+    config.load()
+    setup_logging()
+    create_database()
+    warm_up_database()
+    return app
+
+
+async def app(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    request = await _read_request(scope, receive)
+    # Flask answers HEAD with the GET handler, without the body.
+    head = request.method == 'HEAD'
+    matches = _match(request.path)
+    if not matches:
+        await _send_http_exception(send, NotFound(), head)
+        return
+    if request.method == 'OPTIONS':
+        # Like Flask's automatic OPTIONS response: no handler, no authentication.
+        await _send_http_exception(send, None, head, allowed_methods=_allowed_methods(matches))
+        return
+    handler, kwargs = _resolve(matches, 'GET' if head else request.method)
+    if handler is None:
+        await _send_http_exception(send, MethodNotAllowed(valid_methods=_allowed_methods(matches)), head)
+        return
+
+    try:
+        auth = await authenticate_async(request.headers.get('authorization'))
+        if auth.error_response is not None:
+            ret = auth.error_response
+        else:
+            ret = await handler(request, owner_id=auth.owner_id, **kwargs)
+    except Exception:
+        L.exception(f'{request.method} {request.path} failed')
+        ret = ApiResponse.error('Internal server error', HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    if isinstance(ret, FileResponse):
+        await _send_file(scope, send, ret, head)
+    elif isinstance(ret, CachedResponse):
+        await _send_json(send, ret.body, HTTPStatus.OK, {}, head)
+    else:
+        await _send_api_response(send, ret, head)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await dispose_async_engines()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _read_request(scope, receive) -> Request:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            break
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    return Request(scope['method'], scope['path'], headers, bytes(body))
+
+
+def _match(path: str) -> List[Tuple[Match, Dict[str, Handler]]]:
+    # Like Werkzeug, the most specific route comes first: '/bookmarks/stats' before '/bookmarks/<id>'.
+    matches = [(match, handlers) for pattern, handlers in _get_routes() for match in [pattern.match(path)] if match]
+    return sorted(matches, key=lambda m: len(m[0].groupdict()))
+
+
+def _resolve(matches: List[Tuple[Match, Dict[str, Handler]]], method: str) -> Tuple[Optional[Handler], Dict[str, str]]:
+    # A route without a handler for the method falls through to the next one, as in Werkzeug.
+    for match, handlers in matches:
+        if method in handlers:
+            return handlers[method], match.groupdict()
+    return None, {}
+
+
+def _allowed_methods(matches: List[Tuple[Match, Dict[str, Handler]]]) -> List[str]:
+    methods: Set[str] = {'OPTIONS'}
+    for _, handlers in matches:
+        methods.update(handlers)
+    if 'GET' in methods:
+        methods.add('HEAD')
+    return sorted(methods)
+
+
+async def _send_http_exception(send,
+                               exception: Optional[HTTPException],
+                               head: bool,
+                               allowed_methods: Optional[List[str]] = None) -> None:
+    """Werkzeug's HTML error page, as Flask sends it outside of the API handlers; None is the empty OPTIONS response."""
+    if exception is None:
+        status, body, header_items = HTTPStatus.OK.value, b'', [('Content-Type', 'text/html; charset=utf-8')]
+    else:
+        status, body, header_items = exception.code, exception.get_body().encode('utf-8'), exception.get_headers()
+    if allowed_methods is not None:
+        header_items.append(('Allow', ', '.join(allowed_methods)))
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in header_items]
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+async def _send_api_response(send, response: ApiResponse, head: bool = False) -> None:
+    await _send_json(send, response.to_json(), response.http_status, response.headers, head)
+
+
+async def _send_json(send, json_body: str, status: HTTPStatus, extra_headers: Dict[str, str], head: bool) -> None:
+    body = json_body.encode('utf-8')
+    headers = [
+        (b'content-type', CONTENT_TYPE.encode('latin-1')),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ]
+    headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in extra_headers.items()]
+    headers.append((b'access-control-allow-origin', b'*'))
+
+    await send({'type': 'http.response.start', 'status': status.value, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+
+def _requested_range(response: FileResponse, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, stop) of the requested byte range of the stored file, or None for the whole file.
+    Raises RequestedRangeNotSatisfiable like Werkzeug: multiple ranges are not supported either.
+    """
+    range_header = response.request_headers.get('range')
+    if range_header is None or size == 0:
+        return None
+    if_range = response.request_headers.get('if-range')
+    if if_range is not None and if_range.strip() != f'"{response.etag}"':
+        return None
+    parsed = parse_range_header(range_header)
+    range_tuple = parsed.range_for_length(size) if parsed is not None else None
+    if range_tuple is None:
+        raise RequestedRangeNotSatisfiable(length=size)
+    return range_tuple
+
+
+async def _send_file(scope, send, response: FileResponse, head: bool = False) -> None:
+    headers = [
+        (b'content-type', response.content_type.encode('latin-1')),
+        (b'etag', f'"{response.etag}"'.encode('latin-1')),
+        (b'vary', b'Accept-Encoding'),
+        (b'access-control-allow-origin', b'*'),
+    ]
+
+    byte_range = None
+    if response.send_compressed:
+        # Only the stored file has a known length, so only it supports ranges (as with Flask's send_file).
+        size = response.path.stat().st_size
+        try:
+            byte_range = _requested_range(response, size)
+        except RequestedRangeNotSatisfiable as e:
+            await _send_http_exception(send, e, head)
+            return
+        headers.append((b'content-encoding', response.encoding.encode('latin-1')))
+        headers.append((b'accept-ranges', b'bytes'))
+        if byte_range is not None:
+            start, stop = byte_range
+            headers.append((b'content-range', f'bytes {start}-{stop - 1}/{size}'.encode('latin-1')))
+            headers.append((b'content-length', str(stop - start).encode('latin-1')))
+        else:
+            headers.append((b'content-length', str(size).encode('latin-1')))
+
+    if byte_range is None and parse_etags(response.request_headers.get('if-none-match')).contains_weak(response.etag):
+        not_modified = [header for header in headers if header[0] in (b'etag', b'vary', b'access-control-allow-origin')]
+        await send({'type': 'http.response.start', 'status': HTTPStatus.NOT_MODIFIED.value, 'headers': not_modified})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    status = HTTPStatus.OK if byte_range is None else HTTPStatus.PARTIAL_CONTENT
+    await send({'type': 'http.response.start', 'status': status.value, 'headers': headers})
+    if head:
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    if response.send_compressed and byte_range is None and 'http.response.pathsend' in scope.get('extensions', {}):
+        # The server sends the file itself, without copying it through Python.
+        await send({'type': 'http.response.pathsend', 'path': str(response.path)})
+        return
+
+    if response.send_compressed:
+        f = open(response.path, 'rb')
+    else:
+        from bookmarks._archive_store import open_decompressed
+        f = open_decompressed(response.path, response.encoding)
+    with f:
+        remaining = None
+        if byte_range is not None:
+            f.seek(byte_range[0])
+            remaining = byte_range[1] - byte_range[0]
+        while True:
+            size = _FILE_CHUNK_SIZE if remaining is None else min(_FILE_CHUNK_SIZE, remaining)
+            chunk = await asyncio.to_thread(f.read, size) if size else b''
+            if remaining is not None:
+                remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(chunk)})
+            if not chunk:
+                break
+
+
+def _accepts_encoding(request: Request, encoding: str) -> bool:
+    for item in request.headers.get('accept-encoding', '').split(','):
+        name, _, params = item.partition(';')
+        if name.strip().lower() not in (encoding, '*'):
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+async def _get_owned(session: AsyncSession, owner_id: int, bookmark_id: int) -> Optional[Bookmark]:
+    return (await session.execute(
+        select(Bookmark).where(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id)
+    )).scalars().first()
+
+
+async def _execute(session: AsyncSession, statements: List[Statement]) -> None:
+    for statement in statements:
+        if isinstance(statement, Upsert):
+            await _upsert(session, statement)
+        else:
+            await session.execute(statement)
+
+
+async def _upsert(session: AsyncSession, upsert: Upsert) -> None:
+    # Same as bookmarks.api._upsert.
+    if (await session.execute(upsert.update)).rowcount:
+        return
+    try:
+        async with session.begin_nested():
+            await session.execute(upsert.insert)
+    except IntegrityError:
+        await session.execute(upsert.update)
+
+
+# GET bookmark
+@route('/bookmarks/<string:bookmark_id_str>', methods=['GET'])
+@cached
+async def bookmarks_get(request: Request, bookmark_id_str: str, owner_id: int) -> ApiResponse:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+
+    async with AsyncScopedSession(owner_id) as session:
+        bookmark: Optional[Bookmark] = await _get_owned(session, owner_id, bookmark_id)
+        if bookmark is None:
+            return ApiResponse.error('Bookmark not found', HTTPStatus.NOT_FOUND)
+        else:
+            return ApiResponse.success(bookmark.serialize())
+
+
+# GET bookmarks list
+@route('/bookmarks', methods=['GET'])
+@cached
+async def bookmarks_list(request: Request, owner_id: int) -> ApiResponse:
+    async with AsyncScopedSession(owner_id) as session:
+        bookmarks = (await session.execute(
+            select(Bookmark).where(Bookmark.owner_id == owner_id).order_by(Bookmark.id)
+        )).scalars().all()
+        return ApiResponse.success([bookmark.serialize() for bookmark in bookmarks])
+
+
+# Create new bookmark
+@route('/bookmarks', methods=['POST'])
+async def bookmarks_post(request: Request, owner_id: int) -> ApiResponse:
+    res = parse_bookmark(request.body)
+    if res.error_response is not None:
+        return res.error_response
+
+    new_bookmark: Bookmark = res.bookmark
+    new_bookmark.owner_id = owner_id
+
+    async with AsyncScopedSession(owner_id) as session:
+        session.add(new_bookmark)
+        await session.flush()
+        bookmark_serialized = new_bookmark.serialize()
+        await _execute(session, record_created(session.bind.dialect.name, owner_id, new_bookmark.url))
+    await asyncio.to_thread(invalidate_owner, owner_id)
+
+    if config.ENRICH_ON_POST and not bookmark_serialized['title']:
+        from bookmarks.enrichment import get_enricher
+        get_enricher().submit(owner_id, bookmark_serialized['id'], bookmark_serialized['url'])
+    if config.ARCHIVE_ENABLED:
+        from bookmarks.archive import get_archiver
+        get_archiver().submit(owner_id, bookmark_serialized['id'], bookmark_serialized['url'])
+
+    return ApiResponse.success(bookmark_serialized, HTTPStatus.CREATED)
+
+
+# Update an existing bookmark
+@route('/bookmarks/<string:bookmark_id_str>', methods=['PUT'])
+async def bookmarks_put(request: Request, bookmark_id_str: str, owner_id: int) -> ApiResponse:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+
+    res = parse_bookmark(request.body)
+    if res.error_response is not None:
+        return res.error_response
+
+    new_bookmark: Bookmark = res.bookmark
+    new_bookmark.id = bookmark_id
+    new_bookmark.owner_id = owner_id
+
+    async with AsyncScopedSession(owner_id) as session:
+        old_bookmark = await _get_owned(session, owner_id, bookmark_id)
+        if old_bookmark is None:
+            return ApiResponse.error(f'Adding new bookmarks with an arbitrary IDs is not allowed', HTTPStatus.FORBIDDEN)
+        old_url = old_bookmark.url
+
+        new_bookmark = await session.merge(new_bookmark)
+        await session.flush()
+        bookmark_serialized = new_bookmark.serialize()
+        await _execute(session, record_updated(session.bind.dialect.name, owner_id, old_url, new_bookmark.url))
+    await asyncio.to_thread(invalidate_owner, owner_id)
+
+    return ApiResponse.success(bookmark_serialized)
+
+
+# Delete an existing bookmark
+@route('/bookmarks/<string:bookmark_id_str>', methods=['DELETE'])
+async def bookmarks_delete(request: Request, bookmark_id_str: str, owner_id: int) -> ApiResponse:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+
+    async with AsyncScopedSession(owner_id) as session:
+        owned = (Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id)
+        url: Optional[str] = (await session.execute(select(Bookmark.url).where(*owned))).scalar()
+        existed = url is not None
+        if existed:
+            await session.execute(delete(Snapshot).where(Snapshot.bookmark_id == bookmark_id))
+            await session.execute(delete(Bookmark).where(*owned))
+            await _execute(session, record_deleted(session.bind.dialect.name, owner_id, url))
+    if existed:
+        await asyncio.to_thread(invalidate_owner, owner_id)
+    return ApiResponse.success({})
+
+
+# Collection statistics
+@route('/bookmarks/stats', methods=['GET'])
+async def bookmarks_stats(request: Request, owner_id: int) -> ApiResponse:
+    day = today()
+    async with AsyncScopedSession(owner_id) as session:
+        total = (await session.execute(total_query(owner_id))).scalar()
+        top_domains = (await session.execute(top_domains_query(owner_id, config.STATS_TOP_DOMAINS))).all()
+        activity = (await session.execute(activity_query(owner_id, day))).all()
+    return ApiResponse.success(summarize(total, top_domains, activity, day))
+
+
+# Get the latest archived copy of the bookmarked page
+@route('/bookmarks/<string:bookmark_id_str>/snapshot', methods=['GET'])
+async def bookmarks_snapshot_get(request: Request, bookmark_id_str: str,
+                                 owner_id: int) -> Union[ApiResponse, FileResponse]:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+
+    async with AsyncScopedSession(owner_id) as session:
+        snapshot: Optional[Snapshot] = (await session.execute(
+            select(Snapshot)
+            .join(Bookmark, Bookmark.id == Snapshot.bookmark_id)
+            .where(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id)
+            .order_by(Snapshot.created_at.desc(), Snapshot.id.desc())
+            .limit(1)
+        )).scalars().first()
+        if snapshot is None:
+            return ApiResponse.error('Snapshot not found', HTTPStatus.NOT_FOUND)
+
+    from bookmarks.archive import blob_store
+    path = blob_store().path(snapshot.blob_hash, snapshot.encoding)
+    if not path.exists():
+        return ApiResponse.error('Snapshot not found', HTTPStatus.NOT_FOUND)
+    send_compressed = _accepts_encoding(request, snapshot.encoding)
+    return FileResponse(
+        path=path,
+        content_type=snapshot.content_type,
+        # Each representation has its own ETag: the compressed and the decompressed bytes differ.
+        etag=f'{snapshot.blob_hash}-{snapshot.encoding if send_compressed else "identity"}',
+        encoding=snapshot.encoding,
+        send_compressed=send_compressed,
+        request_headers=request.headers,
+    )
+
+
+# Archive the bookmarked page now
+@route('/bookmarks/<string:bookmark_id_str>/snapshot', methods=['POST'])
+async def bookmarks_snapshot_post(request: Request, bookmark_id_str: str, owner_id: int) -> ApiResponse:
+    try:
+        bookmark_id = int(bookmark_id_str)
+    except ValueError:
+        return ApiResponse.error('Invalid bookmark id (should be integer)')
+
+    if not config.ARCHIVE_ENABLED:
+        return ApiResponse.error('Page archiving is disabled', HTTPStatus.FORBIDDEN)
+
+    async with AsyncScopedSession(owner_id) as session:
+        bookmark: Optional[Bookmark] = await _get_owned(session, owner_id, bookmark_id)
+        if bookmark is None:
+            return ApiResponse.error('Bookmark not found', HTTPStatus.NOT_FOUND)
+        url = bookmark.url
+
+    from bookmarks.archive import get_archiver
+    get_archiver().submit(owner_id, bookmark_id, url)
+    return ApiResponse.success({}, HTTPStatus.ACCEPTED)
@@ -0,0 +1,103 @@
+import dataclasses
+import functools
+import hmac
+from http import HTTPStatus
+from typing import Optional
+
+import flask
+from sqlalchemy import select
+
+from bookmarks.api_response import ApiResponse
+import bookmarks.config as config
+from bookmarks.schema import ScopedSession, User
+from bookmarks.user import DEFAULT_OWNER_ID
+
+
+@dataclasses.dataclass
+class AuthResult:
+    owner_id: Optional[int]
+    error_response: Optional[ApiResponse]
+
+
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def _unauthorized(error_message: str) -> AuthResult:
+    return AuthResult(None, ApiResponse.error(error_message, HTTPStatus.UNAUTHORIZED,
+                                              headers={'WWW-Authenticate': 'Bearer'}))
+
+
+def authenticate(authorization: Optional[str]) -> AuthResult:
+    """Resolve the Authorization header to the owner id of the request."""
+    if not config.MULTI_USER:
+        return AuthResult(DEFAULT_OWNER_ID, None)
+
+    token = _bearer_token(authorization)
+    if token is None:
+        return _unauthorized('Authentication required')
+    with ScopedSession() as session:
+        owner_id = session.query(User.id).filter(User.token_hash == User.hash_token(token)).scalar()
+    if owner_id is None:
+        return _unauthorized('Invalid token')
+    return AuthResult(owner_id, None)
+
+
+async def authenticate_async(authorization: Optional[str]) -> AuthResult:
+    if not config.MULTI_USER:
+        return AuthResult(DEFAULT_OWNER_ID, None)
+
+    # Imported here: the async engine needs an async DB driver, which the WSGI app does not.
+    from bookmarks._async_db import AsyncScopedSession
+
+    token = _bearer_token(authorization)
+    if token is None:
+        return _unauthorized('Authentication required')
+    async with AsyncScopedSession() as session:
+        owner_id = (await session.execute(
+            select(User.id).where(User.token_hash == User.hash_token(token))
+        )).scalar()
+    if owner_id is None:
+        return _unauthorized('Invalid token')
+    return AuthResult(owner_id, None)
+
+
+def owner_api(func):
+    """Authenticate a Flask request and pass the owner id to the handler as the owner_id argument."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        auth = authenticate(flask.request.headers.get('Authorization'))
+        if auth.error_response is not None:
+            return auth.error_response
+        return func(*args, owner_id=auth.owner_id, **kwargs)
+    return wrapper
+
+
+def admin_api(func):
+    """
+    For the service endpoints (counters for tuning): with MULTI_USER they need the Bearer ADMIN_TOKEN,
+    and are disabled if it is not set. A single-user instance has no authentication at all.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if config.ADMIN_TOKEN:
+            token = _bearer_token(flask.request.headers.get('Authorization'))
+            if token is None:
+                return _unauthorized('Authentication required').error_response
+            if not hmac.compare_digest(token.encode('utf-8'), config.ADMIN_TOKEN.encode('utf-8')):
+                return _unauthorized('Invalid token').error_response
+        elif config.MULTI_USER:
+            return ApiResponse.error('Set ADMIN_TOKEN to enable this endpoint', HTTPStatus.FORBIDDEN)
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def create_user(name: str) -> str:
+    """Create a user and return their API token. The token cannot be recovered later."""
+    token = User.generate_token()
+    with ScopedSession() as session:
+        session.add(User(name=name, token_hash=User.hash_token(token)))
+    return token
@@ -2,20 +2,37 @@ from __future__ import annotations
 
 from typing import Optional, Set
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, Index, Integer, String
 from sqlalchemy.orm import Session
 
 from bookmarks._db_base import Base
+from bookmarks.user import DEFAULT_OWNER_ID
 
 
 class Bookmark(Base):
     __tablename__ = 'bookmarks'
+    __table_args__ = (
+        # Every API query is scoped by owner: lookups, lists and id-ordered scans use this index.
+        Index('ix_bookmarks_owner_id_id', 'owner_id', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, nullable=False, index=True)
+    # Not a foreign key: users live in the main DB, bookmarks may be sharded across other DBs.
+    owner_id = Column(Integer, nullable=False, default=DEFAULT_OWNER_ID)
     url = Column(String, nullable=False)
     title = Column(String, nullable=False)
     comment = Column(String, nullable=False, index=True)
 
+    # Link health, maintained by bookmarks.link_checker. Not part of the API representation.
+    link_status = Column(Integer, nullable=True)
+    final_url = Column(String, nullable=True)
+    last_checked = Column(DateTime, nullable=True, index=True)
+
+    # Page metadata, filled in by bookmarks.enrichment. Not part of the API representation.
+    description = Column(String, nullable=True)
+    # Hash of a row in favicons. Not a foreign key: favicons live in the main DB, like users.
+    favicon_hash = Column(String, nullable=True)
+
     _FIELDS = set(('id', 'url', 'title', 'comment'))
     _ID_FIELD = 'id'
     _REQUIRED_FIELDS = _FIELDS - set((_ID_FIELD,))
@@ -0,0 +1,180 @@
+"""
+Summary tables behind GET /bookmarks/stats. The write endpoints update them in the
+same transaction as the bookmark itself, so reading the stats never aggregates the
+bookmarks table; bookmarks.stats_reconciler rebuilds them periodically to correct drift.
+
+The update functions return Core statements, so that the sync and the async API
+execute the same ones. Increments use the dialect's upsert where SQLAlchemy has one
+(SQLite, PostgreSQL, MySQL) and a portable Upsert pair of statements elsewhere.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import datetime
+from typing import Any, Dict, List, Optional, Sequence, Union
+from urllib.parse import urlsplit
+
+from sqlalchemy import Column, Date, Index, Integer, String, Table, delete, insert, select, update
+from sqlalchemy.sql import Executable
+
+from bookmarks._db_base import Base
+
+
+# Windows of the recent activity numbers, in days (today included).
+ACTIVITY_WINDOWS = (1, 7, 30)
+
+
+class OwnerStats(Base):
+    __tablename__ = 'owner_stats'
+
+    owner_id = Column(Integer, primary_key=True, nullable=False)
+    bookmarks = Column(Integer, nullable=False, default=0)
+
+
+class DomainCount(Base):
+    __tablename__ = 'domain_counts'
+    __table_args__ = (
+        # Top domains of an owner.
+        Index('ix_domain_counts_owner_id_count', 'owner_id', 'count'),
+    )
+
+    owner_id = Column(Integer, primary_key=True, nullable=False)
+    domain = Column(String, primary_key=True, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyActivity(Base):
+    """Writes per owner and UTC day. Days older than the longest window are dropped by reconciliation."""
+
+    __tablename__ = 'daily_activity'
+
+    owner_id = Column(Integer, primary_key=True, nullable=False)
+    day = Column(Date, primary_key=True, nullable=False)
+    created = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    deleted = Column(Integer, nullable=False, default=0)
+
+
+def domain_of(url: str) -> str:
+    """Host name of the URL; empty for strings that are not URLs."""
+    try:
+        return urlsplit(url).hostname or ''
+    except ValueError:
+        return ''
+
+
+def today() -> datetime.date:
+    return datetime.datetime.utcnow().date()
+
+
+@dataclasses.dataclass
+class Upsert:
+    """
+    Portable increment for dialects without an upsert: the executor runs the update and,
+    if it matched no row, the insert in a savepoint; if a concurrent write inserted the
+    row in between, the insert fails and the update is run again.
+    """
+    update: Executable
+    insert: Executable
+
+
+Statement = Union[Executable, Upsert]
+
+
+def _upsert_insert(dialect: str):
+    """The dialect's insert construct with an upsert clause, or None."""
+    # Imported on demand: only the dialect in use is needed.
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _increment(dialect: str, table: Table, keys: Dict[str, Any], **deltas: int) -> Statement:
+    """Add the deltas to the row with the given primary key, creating the row if needed."""
+    increments = {name: table.c[name] + delta for name, delta in deltas.items()}
+    dialect_insert = _upsert_insert(dialect)
+    if dialect_insert is None:
+        where = [table.c[name] == value for name, value in keys.items()]
+        return Upsert(update(table).where(*where).values(**increments), insert(table).values(**keys, **deltas))
+
+    statement = dialect_insert(table).values(**keys, **deltas)
+    if dialect == 'mysql':
+        return statement.on_duplicate_key_update(**increments)
+    return statement.on_conflict_do_update(index_elements=list(keys), set_=increments)
+
+
+def _decrement_domain(owner_id: int, domain: str) -> List[Executable]:
+    # Plain updates: the rows exist unless the stats predate the bookmark, which reconciliation fixes.
+    owned = (DomainCount.owner_id == owner_id, DomainCount.domain == domain)
+    return [
+        update(DomainCount).where(*owned).values(count=DomainCount.count - 1),
+        delete(DomainCount).where(*owned, DomainCount.count <= 0),
+    ]
+
+
+def record_created(dialect: str, owner_id: int, url: str) -> List[Statement]:
+    return [
+        _increment(dialect, OwnerStats.__table__, {'owner_id': owner_id}, bookmarks=1),
+        _increment(dialect, DomainCount.__table__, {'owner_id': owner_id, 'domain': domain_of(url)}, count=1),
+        _increment(dialect, DailyActivity.__table__, {'owner_id': owner_id, 'day': today()}, created=1),
+    ]
+
+
+def record_updated(dialect: str, owner_id: int, old_url: str, new_url: str) -> List[Statement]:
+    statements = [_increment(dialect, DailyActivity.__table__, {'owner_id': owner_id, 'day': today()}, updated=1)]
+    old_domain, new_domain = domain_of(old_url), domain_of(new_url)
+    if old_domain != new_domain:
+        statements.append(
+            _increment(dialect, DomainCount.__table__, {'owner_id': owner_id, 'domain': new_domain}, count=1))
+        statements += _decrement_domain(owner_id, old_domain)
+    return statements
+
+
+def record_deleted(dialect: str, owner_id: int, url: str) -> List[Statement]:
+    return [
+        update(OwnerStats).where(OwnerStats.owner_id == owner_id).values(bookmarks=OwnerStats.bookmarks - 1),
+        *_decrement_domain(owner_id, domain_of(url)),
+        _increment(dialect, DailyActivity.__table__, {'owner_id': owner_id, 'day': today()}, deleted=1),
+    ]
+
+
+def total_query(owner_id: int) -> Executable:
+    return select(OwnerStats.bookmarks).where(OwnerStats.owner_id == owner_id)
+
+
+def top_domains_query(owner_id: int, limit: int) -> Executable:
+    return select(DomainCount.domain, DomainCount.count) \
+        .where(DomainCount.owner_id == owner_id) \
+        .order_by(DomainCount.count.desc(), DomainCount.domain) \
+        .limit(limit)
+
+
+def activity_query(owner_id: int, day: datetime.date) -> Executable:
+    since = day - datetime.timedelta(days=max(ACTIVITY_WINDOWS) - 1)
+    return select(DailyActivity.day, DailyActivity.created, DailyActivity.updated, DailyActivity.deleted) \
+        .where(DailyActivity.owner_id == owner_id, DailyActivity.day >= since)
+
+
+def summarize(total: Optional[int], top_domains: Sequence, activity: Sequence, day: datetime.date) -> dict:
+    """The API representation of the stats, from the rows of the three queries above."""
+    windows = {}
+    for days in ACTIVITY_WINDOWS:
+        since = day - datetime.timedelta(days=days - 1)
+        rows = [row for row in activity if row.day >= since]
+        windows[f'{days}d'] = {
+            'created': sum(row.created for row in rows),
+            'updated': sum(row.updated for row in rows),
+            'deleted': sum(row.deleted for row in rows),
+        }
+    return {
+        'total': total or 0,
+        'domains': [{'domain': row.domain, 'count': row.count} for row in top_domains],
+        'activity': windows,
+    }
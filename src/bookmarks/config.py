@@ -1,23 +1,124 @@
+"""
+Settings are read from the environment (or .env) on first access rather than at import,
+so importing the package needs no configuration and has no side effects. load() reads
+and validates all of them at once; app factories and CLI commands call it at startup.
+Assigned values (e.g. in tests) take precedence over the environment.
+"""
+
+import ipaddress
 import pathlib
+from typing import Any, Callable, Dict, List
+
+from decouple import Csv, config
+
+
+_SETTINGS: Dict[str, Callable[[], Any]] = {
+    'API_PREFIX': lambda: config('API_PREFIX', default='/api/v1'),
+
+    'DB_CONNECT_STRING': lambda: config('DB_CONNECT_STRING'),
+    # Used by the ASGI app; derived from DB_CONNECT_STRING if empty.
+    'DB_ASYNC_CONNECT_STRING': lambda: config('DB_ASYNC_CONNECT_STRING', default=''),
+    # Comma-separated; if set, bookmarks are spread over these DBs by a hash of the owner id.
+    'DB_SHARD_CONNECT_STRINGS': lambda: config('DB_SHARD_CONNECT_STRINGS', default='', cast=Csv()),
+
+    # If False, there is a single owner and the API needs no authentication.
+    'MULTI_USER': lambda: config('MULTI_USER', default=False, cast=bool),
+    # Bearer token of the service endpoints (/admission/stats, /cache/stats); with MULTI_USER they are off without it.
+    'ADMIN_TOKEN': lambda: config('ADMIN_TOKEN', default=''),
+
+    'WORKING_DIR': lambda: pathlib.Path(config('WORKING_DIR')),
+    'LOGS_DIR': lambda: _get('WORKING_DIR').joinpath(pathlib.Path(config('LOGS_DIR'))),
+
+    'SECRET_KEY': lambda: config('SECRET_KEY'),
+
+    'TIMEZONE': lambda: config('TIMEZONE'),
+
+    'SERVER_BIND': lambda: config('SERVER_BIND', default='127.0.0.1:8000'),
+    # 0: derived from the number of CPU cores.
+    'SERVER_WORKERS': lambda: config('SERVER_WORKERS', default=0, cast=int),
+    'SERVER_THREADS': lambda: config('SERVER_THREADS', default=4, cast=int),
+
+    # Admission control: concurrent requests per kind, how many may queue and for how long (seconds).
+    'API_MAX_READS': lambda: config('API_MAX_READS', default=32, cast=int),
+    'API_MAX_WRITES': lambda: config('API_MAX_WRITES', default=8, cast=int),
+    'API_MAX_QUEUED_READS': lambda: config('API_MAX_QUEUED_READS', default=64, cast=int),
+    'API_MAX_QUEUED_WRITES': lambda: config('API_MAX_QUEUED_WRITES', default=16, cast=int),
+    'API_QUEUE_TIMEOUT': lambda: config('API_QUEUE_TIMEOUT', default=1.0, cast=float),
+    'API_RETRY_AFTER': lambda: config('API_RETRY_AFTER', default=1, cast=int),
+
+    # Comma-separated networks (e.g. 10.0.0.0/8) that bookmarked URLs may be fetched from besides public addresses.
+    'FETCH_ALLOWED_NETWORKS': lambda: tuple(ipaddress.ip_network(network)
+                                            for network in config('FETCH_ALLOWED_NETWORKS', default='', cast=Csv())),
+
+    'LINK_CHECK_CONCURRENCY': lambda: config('LINK_CHECK_CONCURRENCY', default=200, cast=int),
+    'LINK_CHECK_PER_HOST': lambda: config('LINK_CHECK_PER_HOST', default=4, cast=int),
+    'LINK_CHECK_TIMEOUT': lambda: config('LINK_CHECK_TIMEOUT', default=10.0, cast=float),
+    'LINK_CHECK_BATCH_SIZE': lambda: config('LINK_CHECK_BATCH_SIZE', default=1000, cast=int),
+    'LINK_CHECK_RECHECK_HOURS': lambda: config('LINK_CHECK_RECHECK_HOURS', default=168.0, cast=float),
+
+    'ENRICH_ON_POST': lambda: config('ENRICH_ON_POST', default=True, cast=bool),
+    'ENRICH_CONCURRENCY': lambda: config('ENRICH_CONCURRENCY', default=8, cast=int),
+    'ENRICH_TIMEOUT': lambda: config('ENRICH_TIMEOUT', default=10.0, cast=float),
+    'ENRICH_QUEUE_SIZE': lambda: config('ENRICH_QUEUE_SIZE', default=10000, cast=int),
+    'ENRICH_MAX_PAGE_BYTES': lambda: config('ENRICH_MAX_PAGE_BYTES', default=256*1024, cast=int),
+    'ENRICH_MAX_FAVICON_BYTES': lambda: config('ENRICH_MAX_FAVICON_BYTES', default=64*1024, cast=int),
+    'ENRICH_CACHE_TTL': lambda: config('ENRICH_CACHE_TTL', default=3600.0, cast=float),
+    # Failed fetches (e.g. a site without a favicon) are remembered for a shorter time.
+    'ENRICH_NEGATIVE_CACHE_TTL': lambda: config('ENRICH_NEGATIVE_CACHE_TTL', default=300.0, cast=float),
+    'ENRICH_CACHE_SIZE': lambda: config('ENRICH_CACHE_SIZE', default=10000, cast=int),
+
+    'ARCHIVE_ENABLED': lambda: config('ARCHIVE_ENABLED', default=False, cast=bool),
+    'ARCHIVE_DIR': lambda: _get('WORKING_DIR').joinpath(pathlib.Path(config('ARCHIVE_DIR', default='archive'))),
+    'ARCHIVE_ENCODING': lambda: config('ARCHIVE_ENCODING', default='gzip'),
+    'ARCHIVE_WORKERS': lambda: config('ARCHIVE_WORKERS', default=2, cast=int),
+    'ARCHIVE_TIMEOUT': lambda: config('ARCHIVE_TIMEOUT', default=30.0, cast=float),
+    'ARCHIVE_MAX_PAGE_BYTES': lambda: config('ARCHIVE_MAX_PAGE_BYTES', default=10*1024*1024, cast=int),
+    # Unreferenced blobs younger than this (seconds) are kept by sweep-archive.
+    'ARCHIVE_SWEEP_GRACE': lambda: config('ARCHIVE_SWEEP_GRACE', default=3600.0, cast=float),
+
+    # Number of domains in GET /bookmarks/stats, the most bookmarked first.
+    'STATS_TOP_DOMAINS': lambda: config('STATS_TOP_DOMAINS', default=20, cast=int),
+
+    # Shared cache of GET responses: none, sqlite (a file on local disk) or redis.
+    'CACHE_BACKEND': lambda: config('CACHE_BACKEND', default='none'),
+    'CACHE_PATH': lambda: _get('WORKING_DIR').joinpath(pathlib.Path(config('CACHE_PATH', default='cache.sqlite3'))),
+    'CACHE_MAX_BYTES': lambda: config('CACHE_MAX_BYTES', default=64*1024*1024, cast=int),
+    'CACHE_REDIS_URL': lambda: config('CACHE_REDIS_URL', default='redis://localhost:6379/0'),
+    'CACHE_REDIS_TTL': lambda: config('CACHE_REDIS_TTL', default=86400.0, cast=float),
+}
+
+
+def _get(name: str) -> Any:
+    try:
+        return globals()[name]
+    except KeyError:
+        pass
+    try:
+        read_setting = _SETTINGS[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    value = globals()[name] = read_setting()
+    return value
 
-from decouple import config
 
-API_PREFIX: str = config('API_PREFIX', default='/api/v1')
+def __getattr__(name: str) -> Any:
+    return _get(name)
 
-DB_CONNECT_STRING: str = config('DB_CONNECT_STRING')
 
-WORKING_DIR: pathlib.Path = pathlib.Path(config('WORKING_DIR'))
-LOGS_DIR: pathlib.Path = WORKING_DIR.joinpath(pathlib.Path(config('LOGS_DIR')))
+def __dir__() -> List[str]:
+    return sorted({*globals(), *_SETTINGS})
 
-SECRET_KEY: str = config('SECRET_KEY')
 
-TIMEZONE: str = config('TIMEZONE')
+def load() -> None:
+    """Read all settings now, so that a missing or malformed one fails at startup."""
+    for name in _SETTINGS:
+        _get(name)
 
 
 def get_log_path(filename: str) -> pathlib.Path:
-    return LOGS_DIR.joinpath(filename)
+    return _get('LOGS_DIR').joinpath(filename)
 
 
 # relative_route must start with a /.
 def api_route(relative_route: str) -> str:
-    return API_PREFIX + relative_route
\ No newline at end of file
+    return _get('API_PREFIX') + relative_route
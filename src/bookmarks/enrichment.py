@@ -0,0 +1,362 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import collections
+import dataclasses
+import hashlib
+import html.parser
+import logging
+import re
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+from urllib.parse import urljoin
+
+from sqlalchemy.exc import IntegrityError
+
+import bookmarks.config as config
+from bookmarks._http import HttpClient, HttpError, is_http_url, is_local_error
+from bookmarks.log import get_logger
+from bookmarks.response_cache import invalidate_owner
+from bookmarks.schema import Bookmark, Favicon, ScopedSession
+
+
+L = get_logger('enrichment', logging.INFO)
+
+_DEFAULT_FAVICON_PATH = '/favicon.ico'
+_DEFAULT_FAVICON_TYPE = 'image/x-icon'
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+_CHARSET_SNIFF_BYTES = 2048
+_FETCH_ERRORS = (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpError)
+
+# Cached in place of a failed fetch, whose result is None.
+_FAILED = object()
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+@dataclasses.dataclass
+class FaviconData:
+    hash: str
+    content_type: str
+    data: bytes
+
+    @staticmethod
+    def from_bytes(data: bytes, content_type: str) -> FaviconData:
+        return FaviconData(hashlib.sha256(data).hexdigest(), content_type, data)
+
+
+@dataclasses.dataclass
+class PageMetadata:
+    title: Optional[str] = None
+    description: Optional[str] = None
+    favicon: Optional[FaviconData] = None
+
+
+class MetadataParser(html.parser.HTMLParser):
+    """
+    Collects the title, description and icon link from the document head.
+    Can be fed incrementally; `done` becomes True once the head is over.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.icon_href: Optional[str] = None
+        self._in_title = False
+        self._title_parts = []
+        self._meta: Dict[str, str] = {}
+
+    @property
+    def title(self) -> Optional[str]:
+        title = ' '.join(''.join(self._title_parts).split())
+        return title or self._meta.get('og:title') or None
+
+    @property
+    def description(self) -> Optional[str]:
+        return self._meta.get('description') or self._meta.get('og:description') or None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = {name: value or '' for name, value in attrs}
+        if tag == 'title':
+            self._in_title = True
+        elif tag == 'meta':
+            key = (attrs.get('property') or attrs.get('name') or '').lower()
+            if key in ('description', 'og:title', 'og:description'):
+                self._meta.setdefault(key, ' '.join(attrs.get('content', '').split()))
+        elif tag == 'link':
+            if 'icon' in attrs.get('rel', '').lower().split() and attrs.get('href') and self.icon_href is None:
+                self.icon_href = attrs['href']
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'title':
+            self._in_title = False
+        elif tag == 'head':
+            self.done = True
+
+    def handle_data(self, data):
+        if self._in_title and not self.done:
+            self._title_parts.append(data)
+
+
+class _PageReader:
+    """
+    Body consumer that decodes the page and feeds it to a MetadataParser as it arrives.
+    The first bytes are buffered until the charset is known; close() flushes them.
+    """
+
+    def __init__(self):
+        self.parser = MetadataParser()
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+        self._headers: Dict[str, str] = {}
+        self._pending = b''
+
+    def __call__(self, headers: Dict[str, str], chunk: bytes) -> bool:
+        if self._decoder is None:
+            self._headers = headers
+            self._pending += chunk
+            if _header_charset(headers) is None and len(self._pending) < _CHARSET_SNIFF_BYTES:
+                return True
+            chunk, self._pending = self._pending, b''
+            self._start_decoding(chunk)
+        self.parser.feed(self._decoder.decode(chunk))
+        return not self.parser.done
+
+    def close(self) -> None:
+        if self._decoder is None:
+            self._start_decoding(self._pending)
+            self.parser.feed(self._decoder.decode(self._pending))
+        self.parser.feed(self._decoder.decode(b'', final=True))
+        self.parser.close()
+
+    def _start_decoding(self, head: bytes) -> None:
+        charset = _header_charset(self._headers)
+        if charset is None:
+            match = _META_CHARSET_RE.search(head[:_CHARSET_SNIFF_BYTES])
+            if match is not None:
+                charset = _lookup_charset(match.group(1).decode('ascii'))
+        self._decoder = codecs.getincrementaldecoder(charset or 'utf-8')(errors='replace')
+
+
+def _lookup_charset(name: str) -> Optional[str]:
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def _header_charset(headers: Dict[str, str]) -> Optional[str]:
+    for param in headers.get('content-type', '').split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            return _lookup_charset(value.strip().strip('"\''))
+    return None
+
+
+class TtlCache(Generic[K, V]):
+    """LRU cache whose entries also expire after ttl seconds. Not thread-safe."""
+
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._clock = clock
+        self._entries: collections.OrderedDict[K, Tuple[float, V]] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (self._clock() + (ttl if ttl is not None else self._ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+
+class Enricher:
+    """
+    Fills in metadata of freshly added bookmarks off the request path.
+    Jobs are queued with submit() from any thread and processed by an event
+    loop running in a daemon thread, which is started on the first submit().
+    Results are cached per URL, failures for a shorter time, and concurrent
+    jobs for one URL share a single fetch.
+    """
+
+    def __init__(self,
+                 concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 queue_size: Optional[int] = None,
+                 max_page_bytes: Optional[int] = None,
+                 max_favicon_bytes: Optional[int] = None,
+                 cache_ttl: Optional[float] = None,
+                 negative_cache_ttl: Optional[float] = None,
+                 cache_size: Optional[int] = None):
+        self._concurrency = concurrency or config.ENRICH_CONCURRENCY
+        self._timeout = timeout or config.ENRICH_TIMEOUT
+        self._queue_size = queue_size or config.ENRICH_QUEUE_SIZE
+        self._max_page_bytes = max_page_bytes or config.ENRICH_MAX_PAGE_BYTES
+        self._max_favicon_bytes = max_favicon_bytes or config.ENRICH_MAX_FAVICON_BYTES
+        self._cache: TtlCache[Tuple[str, str], object] = TtlCache(
+            cache_ttl or config.ENRICH_CACHE_TTL,
+            cache_size or config.ENRICH_CACHE_SIZE)
+        self._negative_cache_ttl = negative_cache_ttl or config.ENRICH_NEGATIVE_CACHE_TTL
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._allowed_networks = config.FETCH_ALLOWED_NETWORKS
+
+        self._start_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+
+    def submit(self, owner_id: int, bookmark_id: int, url: str) -> None:
+        """Schedule enrichment of a bookmark. Never blocks on network or DB."""
+        if not is_http_url(url):
+            return
+        self._ensure_started()
+        self._loop.call_soon_threadsafe(self._enqueue, owner_id, bookmark_id, url)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> None:
+        """Block until every job submitted so far is processed."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._queue.join(), self._loop).result(timeout)
+
+    def _ensure_started(self) -> None:
+        # Does not wait for the thread: callbacks scheduled before the loop runs are run once it starts,
+        # so the caller (possibly another event loop) is never blocked.
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._queue = asyncio.Queue(maxsize=self._queue_size)
+                threading.Thread(target=loop.run_until_complete, args=(self._main(),),
+                                 name='enricher', daemon=True).start()
+                self._loop = loop
+
+    def _enqueue(self, owner_id: int, bookmark_id: int, url: str) -> None:
+        try:
+            self._queue.put_nowait((owner_id, bookmark_id, url))
+        except asyncio.QueueFull:
+            L.warning(f'Enrichment queue is full, bookmark {bookmark_id} skipped')
+
+    async def _main(self) -> None:
+        async with HttpClient(max_connections=self._concurrency, timeout=self._timeout,
+                              allowed_networks=self._allowed_networks) as client:
+            workers = [asyncio.create_task(self._worker(client)) for _ in range(self._concurrency)]
+            await asyncio.gather(*workers)
+
+    async def _worker(self, client: HttpClient) -> None:
+        while True:
+            owner_id, bookmark_id, url = await self._queue.get()
+            try:
+                metadata = await self._cached(('page', url), lambda: self._fetch_page(client, url))
+                if metadata is not None:
+                    await asyncio.to_thread(self._store, owner_id, bookmark_id, metadata)
+            except Exception:
+                L.exception(f'Enrichment of bookmark {bookmark_id} failed')
+            finally:
+                self._queue.task_done()
+
+    async def _cached(self, key: Tuple[str, str], fetch: Callable[[], Awaitable[V]]) -> Optional[V]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            return None if cached is _FAILED else cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        result = None
+        local_error = False
+        try:
+            result = await fetch()
+        except _FETCH_ERRORS as e:
+            # Out of file descriptors and the like: the URL may be fine, so the failure is not cached.
+            local_error = is_local_error(e)
+            L.log(logging.WARNING if local_error else logging.INFO, f'Could not fetch {key[1]}: {e!r}')
+        finally:
+            del self._in_flight[key]
+            future.set_result(result)
+        if result is not None:
+            self._cache.put(key, result)
+        elif not local_error:
+            self._cache.put(key, _FAILED, self._negative_cache_ttl)
+        return result
+
+    async def _fetch_page(self, client: HttpClient, url: str) -> Optional[PageMetadata]:
+        reader = _PageReader()
+        response = await client.request('GET', url, max_body=self._max_page_bytes, consumer=reader)
+        reader.close()
+        if not 200 <= response.status < 300:
+            # Possibly temporary (e.g. 503), so cached as a failure, for the shorter time.
+            return None
+
+        icon_url = urljoin(response.url, reader.parser.icon_href or _DEFAULT_FAVICON_PATH)
+        favicon = await self._cached(('favicon', icon_url), lambda: self._fetch_favicon(client, icon_url))
+        return PageMetadata(reader.parser.title, reader.parser.description, favicon or None)
+
+    async def _fetch_favicon(self, client: HttpClient, url: str) -> Optional[FaviconData]:
+        if not is_http_url(url):
+            return None
+        # Read one byte past the limit to tell a complete icon from a truncated one.
+        response = await client.request('GET', url, max_body=self._max_favicon_bytes + 1)
+        content_type = response.headers.get('content-type', _DEFAULT_FAVICON_TYPE).split(';')[0].strip()
+        if (response.status != 200
+                or not 0 < len(response.body) <= self._max_favicon_bytes
+                or content_type.startswith('text/')):
+            return None
+        return FaviconData.from_bytes(response.body, content_type)
+
+    @staticmethod
+    def _store(owner_id: int, bookmark_id: int, metadata: PageMetadata) -> None:
+        if metadata.favicon is not None:
+            try:
+                # In the main DB: shared by the owners of all shards.
+                with ScopedSession() as session:
+                    if session.query(Favicon).get(metadata.favicon.hash) is None:
+                        session.add(Favicon(**dataclasses.asdict(metadata.favicon)))
+            except IntegrityError:
+                pass  # Stored concurrently by another job.
+
+        with ScopedSession(owner_id) as session:
+            bookmark: Optional[Bookmark] = session.query(Bookmark) \
+                .filter(Bookmark.owner_id == owner_id, Bookmark.id == bookmark_id) \
+                .one_or_none()
+            if bookmark is None:
+                return
+            if not bookmark.title and metadata.title:
+                bookmark.title = metadata.title
+            if bookmark.description is None:
+                bookmark.description = metadata.description
+            if metadata.favicon is not None:
+                bookmark.favicon_hash = metadata.favicon.hash
+        # The title is part of the cached API responses.
+        invalidate_owner(owner_id)
+
+
+_enricher: Optional[Enricher] = None
+_enricher_lock = threading.Lock()
+
+
+def get_enricher() -> Enricher:
+    global _enricher
+    with _enricher_lock:
+        if _enricher is None:
+            _enricher = Enricher()
+        return _enricher
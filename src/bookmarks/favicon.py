@@ -0,0 +1,16 @@
+from sqlalchemy import Column, LargeBinary, String
+
+from bookmarks._db_base import Base
+
+
+class Favicon(Base):
+    """
+    Favicons are shared by all bookmarks of a site, so they are stored in the main DB
+    once per distinct content and referenced by its SHA-256 hex digest.
+    """
+
+    __tablename__ = 'favicons'
+
+    hash = Column(String, primary_key=True, nullable=False)
+    content_type = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)
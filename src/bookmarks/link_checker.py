@@ -0,0 +1,271 @@
+import asyncio
+import collections
+import dataclasses
+import datetime
+import logging
+from typing import Counter, Deque, Dict, Generic, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
+
+from sqlalchemy import or_
+
+import bookmarks.config as config
+from bookmarks._http import HttpClient, HttpError, is_http_url, is_local_error
+from bookmarks.log import get_logger
+from bookmarks.schema import Bookmark, ScopedSession, shard_count
+
+
+L = get_logger('link_checker', logging.INFO)
+
+# Stored as Bookmark.link_status when the host could not be reached at all.
+UNREACHABLE_STATUS = 0
+
+# Servers that reject HEAD often answer GET just fine.
+_FALLBACK_TO_GET_STATUSES = frozenset((403, 405, 501))
+
+# URLs loaded ahead of the checks, per worker: the more, the better the workers spread over hosts.
+_PENDING_PER_WORKER = 100
+
+T = TypeVar('T')
+
+
+@dataclasses.dataclass
+class LinkCheckResult:
+    shard: int
+    bookmark_id: int
+    link_status: Optional[int]
+    final_url: Optional[str]
+    last_checked: datetime.datetime
+    # The check failed on this machine (e.g. out of file descriptors): nothing is stored,
+    # so the bookmark is checked again by the next run.
+    failed_locally: bool = False
+
+
+@dataclasses.dataclass
+class LinkCheckStats:
+    checked: int = 0
+    alive: int = 0
+    broken: int = 0
+    unreachable: int = 0
+    skipped: int = 0
+    failed_locally: int = 0
+
+    def add(self, result: LinkCheckResult) -> None:
+        if result.failed_locally:
+            self.failed_locally += 1
+            return
+        self.checked += 1
+        if result.link_status is None:
+            self.skipped += 1
+        elif result.link_status == UNREACHABLE_STATUS:
+            self.unreachable += 1
+        elif result.link_status < 400:
+            self.alive += 1
+        else:
+            self.broken += 1
+
+
+class _HostQueues(Generic[T]):
+    """
+    Items queued per host. get() hands out items of the hosts with fewer than per_host
+    items in flight, taking the hosts in turn: a long run of bookmarks of one host
+    does not leave every worker waiting for that host's slots.
+    """
+
+    def __init__(self, per_host: int, max_pending: int):
+        self._per_host = per_host
+        self._max_pending = max_pending
+        self._queues: Dict[str, Deque[T]] = {}
+        self._in_flight: Counter[str] = collections.Counter()
+        # Hosts with queued items and a free slot, each at most once.
+        self._ready: Deque[str] = collections.deque()
+        self._pending = 0
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    async def put(self, host: str, item: T) -> None:
+        """Waits while max_pending items are queued."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._pending < self._max_pending)
+            queue = self._queues.setdefault(host, collections.deque())
+            queue.append(item)
+            self._pending += 1
+            if len(queue) == 1 and self._in_flight[host] < self._per_host:
+                self._ready.append(host)
+            self._changed.notify_all()
+
+    async def close(self) -> None:
+        """No more items: get() returns None once the queued ones are handed out."""
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    async def get(self) -> Optional[Tuple[str, T]]:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._ready or (self._closed and not self._pending))
+            if not self._ready:
+                return None
+            host = self._ready.popleft()
+            queue = self._queues[host]
+            item = queue.popleft()
+            self._pending -= 1
+            self._in_flight[host] += 1
+            if not queue:
+                del self._queues[host]
+            elif self._in_flight[host] < self._per_host:
+                self._ready.append(host)
+            self._changed.notify_all()
+            return host, item
+
+    async def task_done(self, host: str) -> None:
+        async with self._changed:
+            self._in_flight[host] -= 1
+            if host in self._queues and self._in_flight[host] == self._per_host - 1:
+                self._ready.append(host)
+            if not self._in_flight[host]:
+                del self._in_flight[host]
+            self._changed.notify_all()
+
+
+def _host_of(url: str) -> str:
+    try:
+        return (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+class LinkChecker:
+    """
+    Walks the bookmarks table of every shard in id order and checks every bookmark that
+    has never been checked or was last checked more than recheck_after ago.
+    URLs are checked concurrently, spread over the hosts; results are written back in batches.
+    """
+
+    def __init__(self,
+                 concurrency: Optional[int] = None,
+                 per_host: Optional[int] = None,
+                 timeout: Optional[float] = None,
+                 batch_size: Optional[int] = None,
+                 recheck_after: Optional[datetime.timedelta] = None):
+        self.concurrency = concurrency or config.LINK_CHECK_CONCURRENCY
+        self.per_host = per_host or config.LINK_CHECK_PER_HOST
+        self.timeout = timeout or config.LINK_CHECK_TIMEOUT
+        self.batch_size = batch_size or config.LINK_CHECK_BATCH_SIZE
+        if recheck_after is None:
+            recheck_after = datetime.timedelta(hours=config.LINK_CHECK_RECHECK_HOURS)
+        self.recheck_after = recheck_after
+
+    async def run(self) -> LinkCheckStats:
+        cutoff = datetime.datetime.utcnow() - self.recheck_after
+        stats = LinkCheckStats()
+
+        todo: _HostQueues[Tuple[int, int, str]] = _HostQueues(
+            self.per_host, max(self.batch_size, self.concurrency * _PENDING_PER_WORKER))
+        done: asyncio.Queue = asyncio.Queue(maxsize=self.batch_size)
+
+        async with HttpClient(max_connections=self.concurrency,
+                              max_per_host=self.per_host,
+                              timeout=self.timeout,
+                              allowed_networks=config.FETCH_ALLOWED_NETWORKS) as client:
+            workers = [asyncio.create_task(self._worker(client, todo, done)) for _ in range(self.concurrency)]
+            writer = asyncio.create_task(self._writer(done, stats))
+            feeder = asyncio.create_task(self._feed(todo, cutoff))
+            checks = asyncio.gather(feeder, *workers)
+            try:
+                await asyncio.wait((checks, writer), return_when=asyncio.FIRST_COMPLETED)
+                if not checks.done():
+                    writer.result()  # The writer only stops early on an error.
+                checks.result()
+                await done.put(None)
+                await writer
+            finally:
+                for task in [*workers, writer, feeder]:
+                    task.cancel()
+                await asyncio.gather(*workers, writer, feeder, return_exceptions=True)
+
+        L.info(f'Link check finished: {stats}')
+        return stats
+
+    async def _feed(self, todo: _HostQueues, cutoff: datetime.datetime) -> None:
+        for shard in range(shard_count()):
+            after_id = 0
+            while True:
+                batch = await asyncio.to_thread(self._load_batch, shard, after_id, cutoff)
+                if not batch:
+                    break
+                for bookmark_id, url in batch:
+                    await todo.put(_host_of(url), (shard, bookmark_id, url))
+                after_id = batch[-1][0]
+        await todo.close()
+
+    async def _worker(self, client: HttpClient, todo: _HostQueues, done: asyncio.Queue) -> None:
+        while True:
+            entry = await todo.get()
+            if entry is None:
+                return
+            host, (shard, bookmark_id, url) = entry
+            try:
+                await done.put(await self._check(client, shard, bookmark_id, url))
+            finally:
+                await todo.task_done(host)
+
+    async def _writer(self, done: asyncio.Queue, stats: LinkCheckStats) -> None:
+        pending: List[LinkCheckResult] = []
+        while True:
+            result: Optional[LinkCheckResult] = await done.get()
+            if result is not None:
+                stats.add(result)
+                if not result.failed_locally:
+                    pending.append(result)
+            if pending and (result is None or len(pending) >= self.batch_size):
+                await asyncio.to_thread(self._store_results, pending)
+                pending = []
+            if result is None:
+                return
+
+    async def _check(self, client: HttpClient, shard: int, bookmark_id: int, url: str) -> LinkCheckResult:
+        now = datetime.datetime.utcnow()
+        if not is_http_url(url):
+            return LinkCheckResult(shard, bookmark_id, None, None, now)
+        try:
+            response = await client.request('HEAD', url)
+            if response.status in _FALLBACK_TO_GET_STATUSES:
+                response = await client.request('GET', url)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, HttpError) as e:
+            if is_local_error(e):
+                L.warning(f'Bookmark {bookmark_id}: {url} not checked: {e!r}')
+                return LinkCheckResult(shard, bookmark_id, None, None, now, failed_locally=True)
+            L.debug(f'Bookmark {bookmark_id}: {url} is unreachable: {e!r}')
+            return LinkCheckResult(shard, bookmark_id, UNREACHABLE_STATUS, None, now)
+        return LinkCheckResult(shard, bookmark_id, response.status, response.url, now)
+
+    def _load_batch(self, shard: int, after_id: int, cutoff: datetime.datetime) -> List[Tuple[int, str]]:
+        with ScopedSession(shard=shard) as session:
+            rows = session.query(Bookmark.id, Bookmark.url) \
+                .filter(Bookmark.id > after_id) \
+                .filter(or_(Bookmark.last_checked.is_(None), Bookmark.last_checked < cutoff)) \
+                .order_by(Bookmark.id) \
+                .limit(self.batch_size) \
+                .all()
+            return [(row.id, row.url) for row in rows]
+
+    @staticmethod
+    def _store_results(results: List[LinkCheckResult]) -> None:
+        by_shard: Dict[int, List[LinkCheckResult]] = collections.defaultdict(list)
+        for result in results:
+            by_shard[result.shard].append(result)
+
+        for shard, shard_results in by_shard.items():
+            with ScopedSession(shard=shard) as session:
+                session.bulk_update_mappings(Bookmark, [
+                    {
+                        'id': result.bookmark_id,
+                        'link_status': result.link_status,
+                        'final_url': result.final_url,
+                        'last_checked': result.last_checked,
+                    }
+                    for result in shard_results
+                ])
+
+
+def check_links(**kwargs) -> LinkCheckStats:
+    return asyncio.run(LinkChecker(**kwargs).run())
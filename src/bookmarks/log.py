@@ -1,8 +1,10 @@
 import logging
+import os
 import pathlib
 import sys
-from logging.handlers import RotatingFileHandler
-from typing import Dict, IO, Optional, Union
+import threading
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
+from typing import Dict, IO, Optional, Tuple, Union
 
 from bookmarks import config
 
@@ -12,6 +14,12 @@ _FILE_EXT = '.log'
 
 
 _loggers: Dict[str, logging.Logger] = {}
+# (max_bytes, backup_count) of every logger's file, opened by setup_logging().
+_file_options: Dict[str, Tuple[int, int]] = {}
+_files_opened = False
+# Rotating is left to an external tool (e.g. logrotate) when several processes write the same files.
+_rotate = True
+_lock = threading.Lock()
 
 
 def _get_console_handler(stream: IO[str] = sys.stderr) -> logging.Handler:
@@ -23,7 +31,11 @@ def _get_console_handler(stream: IO[str] = sys.stderr) -> logging.Handler:
 def _get_file_handler(filename: Union[pathlib.Path, str],
                       max_bytes: int = 1024*1024,
                       backup_count: int = 5) -> logging.Handler:
-    handler = RotatingFileHandler(filename, mode='a', maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler: logging.Handler
+    if _rotate:
+        handler = RotatingFileHandler(filename, mode='a', maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    else:
+        handler = WatchedFileHandler(filename, mode='a', encoding='utf-8')
     handler.setFormatter(_FORMATTER)
     return handler
 
@@ -46,31 +58,80 @@ def _create_logs_dir() -> None:
     config.LOGS_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def _add_file_handler(name: str) -> None:
+    path = config.get_log_path(_add_log_extension(name))
+    _loggers[name].addHandler(_get_file_handler(path, *_file_options[name]))
+
+
 def get_logger(name: str,
                level: int,
                stream: IO[str] = sys.stderr,
                max_bytes: int = 1024*1024,
                backup_count: int = 5) -> logging.Logger:
-    old_logger = _loggers.get(name, None)
-    if old_logger is not None:
-        return old_logger
-    
-    _create_logs_dir()
-    
-    path = config.get_log_path(_add_log_extension(name))
-    
-    console_handler = _get_console_handler(stream)
-    file_handler = _get_file_handler(path, max_bytes, backup_count)
-
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
-    logger.propagate = False
-
-    _loggers[name] = logger
-    
-    return logger
+    """
+    Cheap enough for module level: the logger only writes to the console
+    until setup_logging() opens its file.
+    """
+    with _lock:
+        old_logger = _loggers.get(name, None)
+        if old_logger is not None:
+            return old_logger
+        
+        console_handler = _get_console_handler(stream)
+
+        logger = logging.getLogger(name)
+        logger.setLevel(level)
+        logger.addHandler(console_handler)
+        logger.propagate = False
+
+        _loggers[name] = logger
+        _file_options[name] = (max_bytes, backup_count)
+        if _files_opened:
+            _add_file_handler(name)
+        
+        return logger
+
+
+def setup_logging(rotate: bool = True) -> None:
+    """
+    Create the logs directory, open the log files of all loggers (including
+    ones created later) and reset root logging to the console. Idempotent.
+    Pass rotate=False if forked processes will write the files too: they are
+    then reopened after an external rotation instead of rotated here.
+    """
+    global _files_opened, _rotate
+    with _lock:
+        if _files_opened:
+            return
+        _rotate = rotate
+        _create_logs_dir()
+        for name in _loggers:
+            _add_file_handler(name)
+        _setup_basic_logging(logging.WARNING)
+        _files_opened = True
+
+
+def _stop_rotating_inherited_files() -> None:
+    # Rotating from several processes loses records: each one renames the file the
+    # others still write to. The child leaves rotating to the process that opened the files.
+    global _rotate, _lock
+    _lock = threading.Lock()
+    _rotate = False
+    replaced: Dict[logging.Handler, logging.Handler] = {}
+    for logger in (logging.root, *_loggers.values()):
+        for i, handler in enumerate(logger.handlers):
+            if not isinstance(handler, RotatingFileHandler):
+                continue
+            if handler not in replaced:
+                new_handler = WatchedFileHandler(handler.baseFilename, mode='a', encoding='utf-8')
+                new_handler.setFormatter(handler.formatter)
+                new_handler.setLevel(handler.level)
+                handler.close()
+                replaced[handler] = new_handler
+            logger.handlers[i] = replaced[handler]
+
+
+os.register_at_fork(after_in_child=_stop_rotating_inherited_files)
 
 
 def redirect_basic_logging(to_logger: logging.Logger, level: Optional[int] = None) -> None:
@@ -81,6 +142,3 @@ def redirect_basic_logging(to_logger: logging.Logger, level: Optional[int] = Non
     if level is None:
         level = to_logger.level
     logging.root.setLevel(level)
-
-
-_setup_basic_logging(logging.WARNING)
@@ -0,0 +1,345 @@
+"""
+Cache of serialized API responses shared by all worker processes.
+
+Entries are keyed by endpoint, owner, parameters and the owner's data version.
+Writes bump the version instead of deleting entries: every key built before the
+write becomes unreachable at once, and the stale entries age out through the
+size-bounded eviction.
+"""
+
+from __future__ import annotations
+
+import abc
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional
+
+import bookmarks.config as config
+from bookmarks.log import get_logger
+
+
+L = get_logger('response_cache', logging.INFO)
+
+# Eviction frees this fraction of max_bytes below the limit, so that it does not run on every store.
+_EVICTION_SLACK = 0.1
+_EVICTION_BATCH = 64
+# A hit refreshes the entry's place in the eviction order at most this often (seconds).
+_TOUCH_INTERVAL = 60.0
+_BUSY_TIMEOUT = 5.0
+
+
+class CacheBackend(abc.ABC):
+    """Shared key-value store of response bodies plus a version counter per scope."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abc.abstractmethod
+    def put(self, key: str, body: bytes) -> int:
+        """Store the body and return the number of entries evicted to make room for it."""
+
+    @abc.abstractmethod
+    def version(self, scope: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    def bump_version(self, scope: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        ...
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    SQLite file on local disk in WAL mode: hits are plain reads, which in any process do not block
+    each other or the writer. Holds at most max_bytes of bodies; the least recently used entries are
+    evicted first, with use times kept to within touch_interval seconds.
+    """
+
+    def __init__(self, path: pathlib.Path, max_bytes: int, touch_interval: float = _TOUCH_INTERVAL):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(entries)')}
+        if columns and 'last_used' not in columns:
+            # Written by a version without LRU eviction; the entries are disposable, so start over.
+            connection.executescript('''
+                BEGIN IMMEDIATE;
+                DROP TABLE IF EXISTS entries;
+                DROP TABLE IF EXISTS total_size;
+                COMMIT;
+            ''')
+        with connection:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL UNIQUE,
+                    body BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_entries_last_used ON entries (last_used);
+                CREATE TABLE IF NOT EXISTS total_size (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    bytes INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO total_size VALUES (0, 0);
+                CREATE TABLE IF NOT EXISTS versions (
+                    scope TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                );
+            ''')
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, and new ones in a forked child.
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        connection = self._connection()
+        row = connection.execute('SELECT body, last_used FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        body, last_used = row
+        now = time.time()
+        if now - last_used >= self.touch_interval:
+            self._touch(connection, key, now)
+        return body
+
+    def _touch(self, connection: sqlite3.Connection, key: str, now: float) -> None:
+        # Moves the entry to the end of the eviction order. Best effort: rather than wait
+        # for the write lock, leave it to one of the next hits.
+        connection.execute('PRAGMA busy_timeout = 0')
+        try:
+            connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (now, key))
+        except sqlite3.OperationalError as e:
+            L.debug('Not touching a cache entry: %s', e)
+        finally:
+            connection.execute(f'PRAGMA busy_timeout = {int(_BUSY_TIMEOUT * 1000)}')
+
+    def put(self, key: str, body: bytes) -> int:
+        if len(body) > self.max_bytes:
+            return 0
+
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            old = connection.execute('SELECT length(body) FROM entries WHERE key = ?', (key,)).fetchone()
+            delta = len(body) - (old[0] if old is not None else 0)
+            connection.execute('''
+                INSERT INTO entries (key, body, last_used) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET body = excluded.body, last_used = excluded.last_used
+            ''', (key, body, time.time()))
+            connection.execute('UPDATE total_size SET bytes = bytes + ?', (delta,))
+            total, = connection.execute('SELECT bytes FROM total_size').fetchone()
+
+            evicted = 0
+            if total > self.max_bytes:
+                target = self.max_bytes * (1 - _EVICTION_SLACK)
+                while total > target:
+                    least_used = connection.execute(
+                        'SELECT id, length(body) FROM entries ORDER BY last_used, id LIMIT ?', (_EVICTION_BATCH,)
+                    ).fetchall()
+                    for entry_id, size in least_used:
+                        if total <= target:
+                            break
+                        connection.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+                        total -= size
+                        evicted += 1
+                connection.execute('UPDATE total_size SET bytes = ?', (total,))
+            connection.execute('COMMIT')
+            return evicted
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def version(self, scope: str) -> int:
+        row = self._connection().execute('SELECT version FROM versions WHERE scope = ?', (scope,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def bump_version(self, scope: str) -> None:
+        self._connection().execute('''
+            INSERT INTO versions (scope, version) VALUES (?, 1)
+            ON CONFLICT (scope) DO UPDATE SET version = version + 1
+        ''', (scope,))
+
+    def stats(self) -> Dict[str, Any]:
+        connection = self._connection()
+        entries, = connection.execute('SELECT count(*) FROM entries').fetchone()
+        size, = connection.execute('SELECT bytes FROM total_size').fetchone()
+        return {'backend': 'sqlite', 'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Any server speaking the Redis protocol (Redis, Valkey, KeyDB or a local stand-in).
+    Size-bounded eviction is left to the server: set maxmemory with an allkeys-lru policy.
+    Entries also expire after ttl seconds, so that the ones made unreachable by a version bump
+    do not pile up on a server without maxmemory. Versions never expire.
+    """
+
+    def __init__(self, url: str = '', prefix: str = 'bookmarks:cache:', client=None, ttl: Optional[float] = None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('The redis cache backend requires redis, install it with `pip install redis`')
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self._prefix = prefix
+        self._ttl_ms = int(ttl * 1000) if ttl else None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self._prefix + 'entry:' + key)
+
+    def put(self, key: str, body: bytes) -> int:
+        self._client.set(self._prefix + 'entry:' + key, body, px=self._ttl_ms)
+        return 0
+
+    def version(self, scope: str) -> int:
+        return int(self._client.get(self._prefix + 'version:' + scope) or 0)
+
+    def bump_version(self, scope: str) -> None:
+        self._client.incr(self._prefix + 'version:' + scope)
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self._client.info('memory')
+        return {'backend': 'redis', 'bytes': memory.get('used_memory'), 'max_bytes': memory.get('maxmemory')}
+
+
+class ResponseCache:
+    """
+    Response bodies per owner. Backend errors are logged and treated as misses,
+    so the cache never fails a request. Hit/miss counters are per process.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._errors = 0
+
+    @staticmethod
+    def _scope(owner_id: int) -> str:
+        return f'owner:{owner_id}'
+
+    def key(self, endpoint: str, owner_id: int, params: Mapping[str, Any]) -> Optional[str]:
+        """
+        Must be built before the response is computed: a write that lands in between
+        bumps the version, so that the response is stored under an outdated key.
+        """
+        try:
+            version = self.backend.version(self._scope(owner_id))
+        except Exception as e:
+            self._on_error('version lookup', e)
+            return None
+        encoded_params = '&'.join(f'{name}={value}' for name, value in sorted(params.items()))
+        return f'{endpoint}:{owner_id}:{version}:{encoded_params}'
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        try:
+            body = self.backend.get(key)
+        except Exception as e:
+            self._on_error('get', e)
+            body = None
+        with self._lock:
+            if body is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return body.decode('utf-8') if body is not None else None
+
+    def put(self, key: Optional[str], body: str) -> None:
+        if key is None:
+            return
+        try:
+            evicted = self.backend.put(key, body.encode('utf-8'))
+        except Exception as e:
+            self._on_error('put', e)
+            return
+        with self._lock:
+            self._stores += 1
+            self._evictions += evicted
+
+    def invalidate(self, owner_id: int) -> None:
+        """Called after a write to the owner's bookmarks is committed."""
+        try:
+            self.backend.bump_version(self._scope(owner_id))
+        except Exception as e:
+            self._on_error('invalidation', e)
+            return
+        with self._lock:
+            self._invalidations += 1
+
+    def _on_error(self, operation: str, e: Exception) -> None:
+        L.warning(f'Response cache {operation} failed: {e!r}')
+        with self._lock:
+            self._errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            backend_stats = self.backend.stats()
+        except Exception as e:
+            self._on_error('stats', e)
+            backend_stats = {}
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                **backend_stats,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'stores': self._stores,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'errors': self._errors,
+            }
+
+
+def _create_backend() -> CacheBackend:
+    if config.CACHE_BACKEND == 'sqlite':
+        return SqliteCacheBackend(config.CACHE_PATH, config.CACHE_MAX_BYTES)
+    if config.CACHE_BACKEND == 'redis':
+        return RedisCacheBackend(config.CACHE_REDIS_URL, ttl=config.CACHE_REDIS_TTL)
+    raise ValueError(f'Unsupported cache backend: {config.CACHE_BACKEND}')
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """None if caching is disabled (CACHE_BACKEND=none)."""
+    global _response_cache
+    if config.CACHE_BACKEND == 'none':
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(_create_backend())
+        return _response_cache
+
+
+def invalidate_owner(owner_id: int) -> None:
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate(owner_id)
@@ -1,4 +1,8 @@
-from bookmarks._db import ScopedSession, Session, engine
+from bookmarks._db import ScopedSession, get_engine, get_shard_engines, shard_count, shard_for_owner
 from bookmarks._db_base import Base
 from bookmarks.bookmark import Bookmark
+from bookmarks.collection_stats import DailyActivity, DomainCount, OwnerStats
+from bookmarks.favicon import Favicon
+from bookmarks.snapshot import Snapshot
+from bookmarks.user import User
 
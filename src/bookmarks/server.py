@@ -0,0 +1,50 @@
+import os
+from typing import Optional
+
+import bookmarks.config as config
+
+
+def default_workers() -> int:
+    return 2 * (os.cpu_count() or 1) + 1
+
+
+def serve(bind: Optional[str] = None,
+          workers: Optional[int] = None,
+          threads: Optional[int] = None,
+          asgi: bool = False) -> None:
+    """
+    Run the API under gunicorn: the app is created (schema check, DB warm-up) once
+    in the master and inherited by the preforked workers, each serving requests with
+    a pool of threads, or with an event loop for the ASGI app (requires uvicorn).
+    Workers drop the inherited DB pools right after the fork (see _db and _async_db).
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise RuntimeError('Serving requires gunicorn, install it with `pip install gunicorn`')
+
+    if asgi:
+        from bookmarks.asgi import create_app
+        worker_class = 'uvicorn.workers.UvicornWorker'
+    else:
+        from bookmarks.api import create_app
+        worker_class = 'gthread'
+
+    options = {
+        'bind': bind or config.SERVER_BIND,
+        'workers': workers or config.SERVER_WORKERS or default_workers(),
+        'threads': threads or config.SERVER_THREADS,
+        'worker_class': worker_class,
+        'preload_app': True,
+    }
+    app = create_app()
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    _Application().run()
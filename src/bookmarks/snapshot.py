@@ -0,0 +1,17 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+from bookmarks._db_base import Base
+
+
+class Snapshot(Base):
+    """Index entry linking a bookmark to an archived copy of its page in the blob store."""
+
+    __tablename__ = 'snapshots'
+
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    bookmark_id = Column(Integer, ForeignKey('bookmarks.id'), nullable=False, index=True)
+    blob_hash = Column(String, nullable=False)
+    encoding = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
@@ -0,0 +1,98 @@
+import collections
+import dataclasses
+import datetime
+import logging
+from typing import Counter, List, Tuple
+
+from bookmarks.collection_stats import ACTIVITY_WINDOWS, DailyActivity, DomainCount, OwnerStats, domain_of, today
+from bookmarks.log import get_logger
+from bookmarks.schema import Bookmark, ScopedSession, shard_count
+
+
+L = get_logger('stats_reconciler', logging.INFO)
+
+_SCAN_BATCH_SIZE = 1000
+# Owners recounted per transaction: bounds how long the writes of these owners wait for the reconciler.
+_OWNER_BATCH_SIZE = 100
+
+
+@dataclasses.dataclass
+class ReconcileStats:
+    owners: int = 0
+    # Owners whose total or domain counts had drifted from the bookmarks table.
+    corrected: int = 0
+
+
+def _owners(shard: int) -> List[int]:
+    """Owners with bookmarks or stats rows in the shard; read without taking any write lock."""
+    with ScopedSession(shard=shard) as session:
+        owners = set()
+        for column in (Bookmark.owner_id, OwnerStats.owner_id, DomainCount.owner_id):
+            owners.update(owner_id for owner_id, in session.query(column).distinct())
+    return sorted(owners)
+
+
+def _reconcile_owners(shard: int, owner_ids: List[int], stats: ReconcileStats) -> None:
+    """
+    Recount a batch of owners in one short transaction. Their stats rows are locked first,
+    so a concurrent write by one of them waits and then applies its increment to the new
+    numbers instead of being overwritten; the other owners are not blocked.
+    """
+    with ScopedSession(shard=shard) as session:
+        old_totals: Counter[int] = collections.Counter(dict(
+            session.query(OwnerStats.owner_id, OwnerStats.bookmarks)
+            .filter(OwnerStats.owner_id.in_(owner_ids))
+            .with_for_update()
+        ))
+        old_domains: Counter[Tuple[int, str]] = collections.Counter({
+            (owner_id, domain): count
+            for owner_id, domain, count in session.query(DomainCount.owner_id, DomainCount.domain, DomainCount.count)
+            .filter(DomainCount.owner_id.in_(owner_ids))
+            .with_for_update()
+        })
+
+        session.query(OwnerStats).filter(OwnerStats.owner_id.in_(owner_ids)).delete(synchronize_session=False)
+        session.query(DomainCount).filter(DomainCount.owner_id.in_(owner_ids)).delete(synchronize_session=False)
+
+        totals: Counter[int] = collections.Counter()
+        domains: Counter[Tuple[int, str]] = collections.Counter()
+        owned = session.query(Bookmark.owner_id, Bookmark.url).filter(Bookmark.owner_id.in_(owner_ids))
+        for owner_id, url in owned.yield_per(_SCAN_BATCH_SIZE):
+            totals[owner_id] += 1
+            domains[owner_id, domain_of(url)] += 1
+
+        session.bulk_insert_mappings(OwnerStats, [
+            {'owner_id': owner_id, 'bookmarks': count} for owner_id, count in totals.items()
+        ])
+        session.bulk_insert_mappings(DomainCount, [
+            {'owner_id': owner_id, 'domain': domain, 'count': count} for (owner_id, domain), count in domains.items()
+        ])
+
+    # Missing keys count as 0, so owners without bookmarks and without stats rows match.
+    drifted = {owner_id for owner_id in old_totals.keys() | totals.keys() if old_totals[owner_id] != totals[owner_id]}
+    drifted |= {owner_id for owner_id, domain in old_domains.keys() | domains.keys()
+                if old_domains[owner_id, domain] != domains[owner_id, domain]}
+    stats.owners += len(totals)
+    stats.corrected += len(drifted)
+
+
+def _reconcile_shard(shard: int, stats: ReconcileStats) -> None:
+    owners = _owners(shard)
+    for i in range(0, len(owners), _OWNER_BATCH_SIZE):
+        _reconcile_owners(shard, owners[i:i + _OWNER_BATCH_SIZE], stats)
+
+    cutoff = today() - datetime.timedelta(days=max(ACTIVITY_WINDOWS) - 1)
+    with ScopedSession(shard=shard) as session:
+        session.query(DailyActivity).filter(DailyActivity.day < cutoff).delete(synchronize_session=False)
+
+
+def reconcile_stats() -> ReconcileStats:
+    """Rebuild the owner totals and domain counts of every shard from its bookmarks table."""
+    stats = ReconcileStats()
+    for shard in range(shard_count()):
+        _reconcile_shard(shard, stats)
+    if stats.corrected:
+        L.warning(f'Stats reconciliation corrected drifted counts: {stats}')
+    else:
+        L.info(f'Stats reconciliation finished: {stats}')
+    return stats
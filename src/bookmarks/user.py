@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import hashlib
+import secrets
+
+from sqlalchemy import Column, Integer, String
+
+from bookmarks._db_base import Base
+
+
+# Owner of all bookmarks when MULTI_USER is off; also the first user created.
+DEFAULT_OWNER_ID = 1
+
+
+class User(Base):
+    """Bookmark owner. Only a hash of the API token is stored."""
+
+    __tablename__ = 'users'
+
+    id = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+    name = Column(String, nullable=False, unique=True)
+    token_hash = Column(String, nullable=False, unique=True)
+
+    @staticmethod
+    def generate_token() -> str:
+        return secrets.token_urlsafe(32)
+
+    @staticmethod
+    def hash_token(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
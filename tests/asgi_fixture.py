@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import json as json_module
+from urllib.parse import urlsplit
+
+import pytest
+from werkzeug.datastructures import Headers
+
+
+class AsgiTestResponse:
+    def __init__(self, status_code: int, headers: Headers, data: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+
+class AsgiTestClient:
+    """
+    Minimal synchronous client for the ASGI app, mimicking the parts of
+    Flask's test client the tests use. All requests run on one event loop.
+    """
+
+    def __init__(self, app):
+        self._app = app
+        self.loop = asyncio.new_event_loop()
+
+    def open(self, method, url, json=None, data=b'', headers=None):
+        if json is not None:
+            data = json_module.dumps(json).encode('utf-8')
+        return self.loop.run_until_complete(self._request(method, url, data, headers or {}))
+
+    get = functools.partialmethod(open, 'GET')
+    post = functools.partialmethod(open, 'POST')
+    put = functools.partialmethod(open, 'PUT')
+    delete = functools.partialmethod(open, 'DELETE')
+    head = functools.partialmethod(open, 'HEAD')
+    options = functools.partialmethod(open, 'OPTIONS')
+
+    async def _request(self, method, url, data, headers):
+        parsed = urlsplit(url)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': parsed.path,
+            'raw_path': parsed.path.encode('latin-1'),
+            'query_string': parsed.query.encode('latin-1'),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+        }
+        request_messages = [{'type': 'http.request', 'body': data, 'more_body': False}]
+        response = {'headers': Headers(), 'body': bytearray()}
+
+        async def receive():
+            return request_messages.pop(0)
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                for name, value in message['headers']:
+                    response['headers'].add(name.decode('latin-1'), value.decode('latin-1'))
+            elif message['type'] == 'http.response.body':
+                response['body'] += message.get('body', b'')
+
+        await self._app(scope, receive, send)
+        return AsgiTestResponse(response['status'], response['headers'], bytes(response['body']))
+
+    def close(self):
+        from bookmarks._async_db import dispose_async_engines
+        self.loop.run_until_complete(dispose_async_engines())
+        self.loop.close()
+
+
+@pytest.fixture(name='asgi_api')
+def _asgi_api(db_path):
+    pytest.importorskip('aiosqlite')
+    from bookmarks.asgi import create_app
+
+    client = AsgiTestClient(create_app())
+    yield client
+    client.close()
+
+    db_path.unlink()
+
+
+@pytest.fixture(name='api', params=['wsgi', 'asgi'])
+def _api(request):
+    """Every scenario runs against both the Flask app and the ASGI app."""
+    return request.getfixturevalue(f'{request.param}_api')
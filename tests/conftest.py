@@ -1,3 +1,5 @@
 pytest_plugins = [
    "flask_fixture",
+   "http_fixture",
+   "asgi_fixture",
 ]
@@ -22,8 +22,8 @@ def _db_path():
     yield pathlib.Path(db_path)
 
 
-@pytest.fixture(name='api')
-def _api(db_path):
+@pytest.fixture(name='wsgi_api')
+def _wsgi_api(db_path):
     from bookmarks._db_init import create_database
     from bookmarks.api import app
     app.config['TESTING'] = True
@@ -36,6 +36,14 @@ def _api(db_path):
     db_path.unlink()
 
 
+@pytest.fixture(name='database')
+def _database(db_path):
+    from bookmarks._db_init import create_database
+    create_database()
+    yield db_path
+    db_path.unlink()
+
+
 @pytest.fixture(name='api_route')
 def _api_route():
     return config.api_route
@@ -0,0 +1,76 @@
+import http.server
+import ipaddress
+import threading
+
+import pytest
+
+import bookmarks.config as config
+
+
+# The fetchers only connect to public addresses; the stand-in server is exempted for the whole session,
+# since the enricher and the archiver are process-wide singletons.
+LOCAL_NETWORKS = (ipaddress.ip_network('127.0.0.1/32'),)
+
+
+@pytest.fixture(name='allow_local_fetches', autouse=True, scope='session')
+def _allow_local_fetches():
+    config.FETCH_ALLOWED_NETWORKS = LOCAL_NETWORKS
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the pages registered in server.pages: path -> (status, headers, body).
+    A None body means the path answers 405 to HEAD requests.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, send_body: bool) -> None:
+        self.server.requests.append((self.command, self.path))
+        page = self.server.pages.get(self.path)
+        if page is None:
+            status, headers, body = 404, {}, b'not found'
+        else:
+            status, headers, body = page
+        if body is None:
+            if not send_body:
+                status, headers = 405, {}
+            body = b''
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(name='http_server')
+def _http_server():
+    """
+    A local stand-in HTTP server. Register pages with
+    http_server.pages[path] = (status, headers, body), build URLs with http_server.url(path).
+    Served requests are recorded in http_server.requests as (method, path).
+    """
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.daemon_threads = True
+    server.pages = {}
+    server.requests = []
+    server.url = lambda path: f'http://127.0.0.1:{server.server_port}{path}'
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from http import HTTPStatus
+
+from bookmarks.admission import ConcurrencyLimiter
+
+
+class TestConcurrencyLimiter:
+    def test_limit(self):
+        limiter = ConcurrencyLimiter('test', limit=2, max_queue=0, queue_timeout=1.0)
+        assert limiter.acquire()
+        assert limiter.acquire()
+        assert not limiter.acquire()
+
+        limiter.release()
+        assert limiter.acquire()
+
+        stats = limiter.stats()
+        assert stats['active'] == 2
+        assert stats['admitted'] == 3
+        assert stats['rejected_queue_full'] == 1
+
+    def test_queue_timeout(self):
+        limiter = ConcurrencyLimiter('test', limit=1, max_queue=1, queue_timeout=0.05)
+        assert limiter.acquire()
+
+        start = time.monotonic()
+        assert not limiter.acquire()
+        assert time.monotonic() - start >= 0.05
+        assert limiter.stats()['rejected_timeout'] == 1
+
+    def test_queued_request_admitted_on_release(self):
+        limiter = ConcurrencyLimiter('test', limit=1, max_queue=1, queue_timeout=5.0)
+        assert limiter.acquire()
+
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+        waiter.start()
+        while limiter.stats()['waiting'] == 0:
+            time.sleep(0.001)
+
+        # The queue is full now.
+        assert not limiter.acquire()
+
+        limiter.release()
+        waiter.join()
+        assert results == [True]
+        assert limiter.stats()['queued'] == 1
+
+    def test_fifo_order(self):
+        limiter = ConcurrencyLimiter('test', limit=1, max_queue=3, queue_timeout=5.0)
+        assert limiter.acquire()
+
+        order = []
+
+        def request(i):
+            assert limiter.acquire()
+            order.append(i)
+            limiter.release()
+
+        waiters = []
+        for i in range(3):
+            waiters.append(threading.Thread(target=request, args=(i,)))
+            waiters[-1].start()
+            while limiter.stats()['waiting'] <= i:
+                time.sleep(0.001)
+
+        limiter.release()
+        for waiter in waiters:
+            waiter.join()
+        assert order == [0, 1, 2]
+        assert limiter.stats()['active'] == 0
+
+    def test_newcomer_does_not_take_handed_over_slot(self):
+        limiter = ConcurrencyLimiter('test', limit=1, max_queue=1, queue_timeout=5.0)
+        assert limiter.acquire()
+
+        admitted = threading.Event()
+        done = threading.Event()
+
+        def queued_request():
+            if limiter.acquire():
+                admitted.set()
+                done.wait()
+                limiter.release()
+
+        waiter = threading.Thread(target=queued_request)
+        waiter.start()
+        while limiter.stats()['waiting'] == 0:
+            time.sleep(0.001)
+
+        # Released before the queued request gets to run: the slot is already its own.
+        limiter.release()
+        limiter.queue_timeout = 0.05  # For the newcomer only: the queued request is already waiting.
+        assert not limiter.acquire()
+        assert admitted.wait(5.0)
+
+        done.set()
+        waiter.join()
+        stats = limiter.stats()
+        assert (stats['admitted'], stats['queued'], stats['rejected_timeout']) == (2, 2, 1)
+        assert stats['active'] == 0
+
+
+class TestApiAdmission:
+    def test_reads_shed(self, wsgi_api, api_route, monkeypatch):
+        from bookmarks.api import get_admission
+        admission = get_admission()
+        monkeypatch.setattr(admission, 'reads', ConcurrencyLimiter('reads', limit=1, max_queue=0, queue_timeout=0))
+        assert admission.reads.acquire()  # Occupy the only read slot.
+
+        r = wsgi_api.get(api_route('/bookmarks'))
+        assert r.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+        assert r.headers['Retry-After'] == str(admission.retry_after)
+        resp = json.loads(r.data)
+        assert resp['status'] == 'error'
+
+        # Writes have their own budget.
+        r = wsgi_api.post(api_route('/bookmarks'), json={'url': 'nop', 'title': 'nop', 'comment': 'nop'})
+        assert r.status_code == HTTPStatus.CREATED
+
+        admission.reads.release()
+        r = wsgi_api.get(api_route('/bookmarks'))
+        assert r.status_code == HTTPStatus.OK
+
+        r = wsgi_api.get(api_route('/admission/stats'))
+        stats = json.loads(r.data)['data']
+        assert stats['reads']['rejected_queue_full'] == 1
+        assert stats['reads']['active'] == 0
+        assert stats['writes']['admitted'] >= 1
@@ -1,7 +1,6 @@
 import json
 from http import HTTPStatus
 
-
 from bookmarks.bookmark import Bookmark
 
 
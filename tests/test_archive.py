@@ -0,0 +1,146 @@
+import gzip
+import json
+import os
+import time
+from http import HTTPStatus
+
+import pytest
+
+import bookmarks.config as config
+from bookmarks._archive_store import BlobStore, open_decompressed, snapshot_job
+
+
+_PAGE = b'<html><head><title>Archived</title></head><body>' + b'content ' * 1000 + b'</body></html>'
+
+
+@pytest.fixture(name='archive_dir')
+def _archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'ARCHIVE_DIR', tmp_path)
+    monkeypatch.setattr(config, 'ARCHIVE_ENABLED', True)
+    yield tmp_path
+
+
+class TestBlobStore:
+    def test_deduplication(self, tmp_path):
+        store = BlobStore(tmp_path)
+        first = store.put(_PAGE, 'gzip')
+        second = store.put(_PAGE, 'gzip')
+        other = store.put(b'other page', 'gzip')
+
+        assert first == second
+        assert first != other
+        assert len(list(tmp_path.rglob('*.gz'))) == 2
+
+        path = store.path(first, 'gzip')
+        assert path.stat().st_size < len(_PAGE)
+        with open_decompressed(path, 'gzip') as f:
+            assert f.read() == _PAGE
+
+    def test_snapshot_job_size_limit(self, tmp_path, http_server):
+        http_server.pages['/page'] = (200, {'Content-Type': 'text/html'}, _PAGE)
+
+        blob = snapshot_job(http_server.url('/page'), tmp_path, 'gzip', len(_PAGE), 5.0, config.FETCH_ALLOWED_NETWORKS)
+        assert blob.size == len(_PAGE)
+        assert blob.content_type == 'text/html'
+        assert BlobStore(tmp_path).path(blob.blob_hash, 'gzip').exists()
+
+        assert snapshot_job(http_server.url('/page'), tmp_path, 'gzip', len(_PAGE) - 1, 5.0,
+                            config.FETCH_ALLOWED_NETWORKS) is None
+
+    def test_snapshot_job_public_only(self, tmp_path, http_server):
+        from bookmarks._http import ForbiddenDestination
+
+        http_server.pages['/page'] = (200, {'Content-Type': 'text/html'}, _PAGE)
+        http_server.pages['/internal'] = (302, {'Location': f'http://127.0.0.2:{http_server.server_port}/page'}, b'')
+
+        with pytest.raises(ForbiddenDestination):
+            snapshot_job(http_server.url('/page'), tmp_path, 'gzip', len(_PAGE), 5.0)
+        with pytest.raises(ForbiddenDestination):
+            snapshot_job('http://169.254.169.254/latest/meta-data/', tmp_path, 'gzip', len(_PAGE), 5.0)
+        # Every redirect hop is checked.
+        with pytest.raises(ForbiddenDestination):
+            snapshot_job(http_server.url('/internal'), tmp_path, 'gzip', len(_PAGE), 5.0, config.FETCH_ALLOWED_NETWORKS)
+        assert http_server.requests == [('GET', '/internal')]
+        assert list(BlobStore(tmp_path).blobs()) == []
+
+
+class TestSnapshotApi:
+    def test_archive_and_serve(self, wsgi_api, api_route, http_server, archive_dir):
+        from bookmarks.archive import get_archiver
+
+        http_server.pages['/page'] = (200, {'Content-Type': 'text/html'}, _PAGE)
+
+        r = wsgi_api.post(api_route('/bookmarks'), json={'url': http_server.url('/page'), 'title': 't', 'comment': ''})
+        assert r.status_code == HTTPStatus.CREATED
+        b_id = json.loads(r.data)['data']['id']
+
+        r = wsgi_api.post(api_route(f'/bookmarks/{b_id}/snapshot'))
+        assert r.status_code == HTTPStatus.ACCEPTED
+        assert get_archiver().wait_idle(timeout=30)
+
+        # Two snapshots of the same page share one blob.
+        assert len(list(archive_dir.rglob('*.gz'))) == 1
+
+        r = wsgi_api.get(api_route(f'/bookmarks/{b_id}/snapshot'), headers={'Accept-Encoding': 'gzip'})
+        assert r.status_code == HTTPStatus.OK
+        assert r.headers['Content-Encoding'] == 'gzip'
+        assert r.headers['Vary'] == 'Accept-Encoding'
+        assert r.mimetype == 'text/html'
+        assert gzip.decompress(r.data) == _PAGE
+        compressed_etag = r.headers['ETag']
+
+        r = wsgi_api.get(api_route(f'/bookmarks/{b_id}/snapshot'), headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9'})
+        assert r.status_code == HTTPStatus.PARTIAL_CONTENT
+        assert len(r.data) == 10
+
+        r = wsgi_api.get(api_route(f'/bookmarks/{b_id}/snapshot'))
+        assert r.status_code == HTTPStatus.OK
+        assert 'Content-Encoding' not in r.headers
+        assert r.headers['Vary'] == 'Accept-Encoding'
+        assert r.data == _PAGE
+        # Different bytes, different validators.
+        assert r.headers['ETag'] != compressed_etag
+
+    def test_snapshot_404(self, wsgi_api, api_route):
+        r = wsgi_api.get(api_route('/bookmarks/42/snapshot'))
+        assert r.status_code == HTTPStatus.NOT_FOUND
+        assert json.loads(r.data)['status'] == 'error'
+
+    def test_archiving_disabled(self, wsgi_api, api_route, add_bookmark):
+        from bookmarks.bookmark import Bookmark
+        add_bookmark(Bookmark(id=1, url='http://example.com', title='nop', comment='nop'))
+
+        r = wsgi_api.post(api_route('/bookmarks/1/snapshot'))
+        assert r.status_code == HTTPStatus.FORBIDDEN
+
+
+class TestCleanup:
+    def test_deleted_bookmark_not_indexed(self, database, archive_dir, db_session):
+        from bookmarks._archive_store import SnapshotBlob
+        from bookmarks.archive import Archiver
+        from bookmarks.schema import Snapshot
+
+        blob_hash = BlobStore(archive_dir).put(_PAGE, 'gzip')
+        Archiver._record(1, 42, SnapshotBlob(blob_hash, 'gzip', 'text/html', len(_PAGE)))
+        assert db_session.query(Snapshot).count() == 0
+
+    def test_sweep(self, database, archive_dir, add_bookmark):
+        from bookmarks._archive_store import SnapshotBlob
+        from bookmarks.archive import Archiver, sweep_blobs
+        from bookmarks.bookmark import Bookmark
+
+        add_bookmark(Bookmark(id=1, url='http://example.com', title='nop', comment='nop'))
+        store = BlobStore(archive_dir)
+        referenced = store.put(_PAGE, 'gzip')
+        Archiver._record(1, 1, SnapshotBlob(referenced, 'gzip', 'text/html', len(_PAGE)))
+        orphaned = store.put(b'page of a deleted bookmark', 'gzip')
+        recent = store.put(b'page not indexed yet', 'gzip')
+
+        an_hour_ago = time.time() - 3600
+        for blob_hash in (referenced, orphaned):
+            os.utime(store.path(blob_hash, 'gzip'), (an_hour_ago, an_hour_ago))
+
+        assert sweep_blobs(grace=60) == 1
+        assert store.path(referenced, 'gzip').exists()
+        assert not store.path(orphaned, 'gzip').exists()
+        assert store.path(recent, 'gzip').exists()
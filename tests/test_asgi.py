@@ -0,0 +1,112 @@
+import datetime
+import gzip
+from http import HTTPStatus
+
+import pytest
+
+import bookmarks.config as config
+from bookmarks.bookmark import Bookmark
+
+
+@pytest.fixture(name='flask_client')
+def _flask_client(asgi_api):
+    from bookmarks.api import app
+    with app.test_client() as client:
+        yield client
+
+
+class TestSameResponses:
+    @pytest.mark.parametrize('method, route, body', [
+        ('GET', '/bookmarks', None),
+        ('GET', '/bookmarks/1', None),
+        ('GET', '/bookmarks/42', None),
+        ('GET', '/bookmarks/abc', None),
+        ('PUT', '/bookmarks/1', {'url': 'http://example.com/новый', 'title': 'Заголовок', 'comment': ''}),
+        ('PUT', '/bookmarks/42', {'url': 'nop', 'title': 'nop', 'comment': 'nop'}),
+        ('POST', '/bookmarks', {'url': 'nop', 'comment': 'nop'}),
+        ('HEAD', '/bookmarks/1', None),
+        ('HEAD', '/bookmarks/42', None),
+        ('OPTIONS', '/bookmarks', None),
+        ('OPTIONS', '/bookmarks/stats', None),
+        ('GET', '/unknown', None),
+        ('PATCH', '/bookmarks', None),
+        ('POST', '/bookmarks/stats', None),
+        # Falls through to '/bookmarks/<id>', which rejects the id.
+        ('PUT', '/bookmarks/stats', {'url': 'nop', 'title': 'nop', 'comment': 'nop'}),
+    ])
+    def test_byte_identical(self, asgi_api, flask_client, api_route, add_bookmark, method, route, body):
+        add_bookmark(Bookmark(id=1, url='http://example.com', title='Пример', comment='Комментарий'))
+
+        # Both apps see the same DB; PUT is idempotent, so the second request gets the same answer.
+        r_wsgi = flask_client.open(api_route(route), method=method, json=body)
+        r_asgi = asgi_api.open(method, api_route(route), json=body)
+
+        assert r_asgi.status_code == r_wsgi.status_code
+        assert r_asgi.data == r_wsgi.data
+        for header in ('Content-Type', 'Content-Length', 'Access-Control-Allow-Origin'):
+            assert r_asgi.headers.get(header) == r_wsgi.headers.get(header)
+        # Werkzeug lists the allowed methods in no particular order.
+        assert set(r_asgi.headers.get('Allow', '').split(', ')) == set(r_wsgi.headers.get('Allow', '').split(', '))
+
+
+_PAGE = b'<html>archived</html>' * 100
+
+
+@pytest.fixture(name='snapshot')
+def _snapshot(add_bookmark, tmp_path, monkeypatch):
+    from bookmarks._archive_store import BlobStore
+    from bookmarks.schema import ScopedSession, Snapshot
+
+    monkeypatch.setattr(config, 'ARCHIVE_DIR', tmp_path)
+    blob_hash = BlobStore(tmp_path).put(_PAGE, 'gzip')
+    add_bookmark(Bookmark(id=1, url='http://example.com', title='nop', comment='nop'))
+    with ScopedSession() as session:
+        session.add(Snapshot(bookmark_id=1, blob_hash=blob_hash, encoding='gzip', content_type='text/html',
+                             size=len(_PAGE), created_at=datetime.datetime.utcnow()))
+
+
+class TestAsgiSnapshot:
+    def test_serve(self, asgi_api, api_route, snapshot):
+        r = asgi_api.get(api_route('/bookmarks/1/snapshot'), headers={'Accept-Encoding': 'gzip, br'})
+        assert r.status_code == HTTPStatus.OK
+        assert r.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(r.data) == _PAGE
+
+        r = asgi_api.get(api_route('/bookmarks/1/snapshot'), headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in r.headers
+        assert r.data == _PAGE
+
+    @pytest.mark.parametrize('method, headers, status', [
+        ('GET', {'Accept-Encoding': 'gzip', 'Range': 'bytes=10-19'}, HTTPStatus.PARTIAL_CONTENT),
+        ('GET', {'Accept-Encoding': 'gzip', 'Range': 'bytes=-5'}, HTTPStatus.PARTIAL_CONTENT),
+        ('GET', {'Accept-Encoding': 'gzip', 'Range': 'bytes=100000-'}, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE),
+        ('GET', {'Accept-Encoding': 'gzip', 'Range': 'bytes=0-1,5-6'}, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE),
+        ('GET', {'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9', 'If-Range': '"other"'}, HTTPStatus.OK),
+        # The decompressed page has no known length, so ranges are ignored.
+        ('GET', {'Range': 'bytes=0-9'}, HTTPStatus.OK),
+        ('HEAD', {'Accept-Encoding': 'gzip'}, HTTPStatus.OK),
+    ])
+    def test_same_as_flask(self, asgi_api, flask_client, api_route, snapshot, method, headers, status):
+        route = api_route('/bookmarks/1/snapshot')
+        r_wsgi = flask_client.open(route, method=method, headers=headers)
+        r_asgi = asgi_api.open(method, route, headers=headers)
+
+        assert r_wsgi.status_code == status
+        assert r_asgi.status_code == r_wsgi.status_code
+        assert r_asgi.data == r_wsgi.data
+        for header in ('Content-Encoding', 'Content-Range', 'Content-Length', 'ETag', 'Vary'):
+            assert r_asgi.headers.get(header) == r_wsgi.headers.get(header)
+
+    @pytest.mark.parametrize('accept_encoding', ['gzip', 'identity'])
+    def test_not_modified(self, asgi_api, flask_client, api_route, snapshot, accept_encoding):
+        route = api_route('/bookmarks/1/snapshot')
+        etag = asgi_api.get(route, headers={'Accept-Encoding': accept_encoding}).headers['ETag']
+        headers = {'Accept-Encoding': accept_encoding, 'If-None-Match': etag}
+        for r in (flask_client.get(route, headers=headers), asgi_api.get(route, headers=headers)):
+            assert r.status_code == HTTPStatus.NOT_MODIFIED
+            assert r.data == b''
+            assert r.headers['ETag'] == etag
+
+    def test_unknown_route(self, asgi_api, api_route):
+        assert asgi_api.get(api_route('/unknown')).status_code == HTTPStatus.NOT_FOUND
+        assert asgi_api.open('PATCH', api_route('/bookmarks')).status_code == HTTPStatus.METHOD_NOT_ALLOWED
@@ -0,0 +1,161 @@
+import json
+from http import HTTPStatus
+
+import pytest
+
+import bookmarks.config as config
+
+
+@pytest.fixture(name='multi_user')
+def _multi_user(monkeypatch):
+    monkeypatch.setattr(config, 'MULTI_USER', True)
+
+
+@pytest.fixture(name='tokens')
+def _tokens(api, multi_user):
+    from bookmarks.auth import create_user
+    return {name: create_user(name) for name in ('alice', 'bob')}
+
+
+def _auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+class TestAuthentication:
+    def test_no_token(self, api, api_route, tokens):
+        r = api.get(api_route('/bookmarks'))
+        assert r.status_code == HTTPStatus.UNAUTHORIZED
+        assert r.headers['WWW-Authenticate'] == 'Bearer'
+        assert json.loads(r.data)['status'] == 'error'
+
+    def test_invalid_token(self, api, api_route, tokens):
+        r = api.get(api_route('/bookmarks'), headers=_auth('not-a-token'))
+        assert r.status_code == HTTPStatus.UNAUTHORIZED
+
+    def test_single_user_needs_no_token(self, api, api_route):
+        r = api.get(api_route('/bookmarks'))
+        assert r.status_code == HTTPStatus.OK
+
+    def test_tokens_are_stored_hashed(self, api, tokens, db_session):
+        from bookmarks.user import User
+        stored = {user.token_hash for user in db_session.query(User)}
+        assert not stored & set(tokens.values())
+        assert stored == {User.hash_token(token) for token in tokens.values()}
+
+
+class TestIsolation:
+    def _post(self, api, api_route, token, url):
+        r = api.post(api_route('/bookmarks'), json={'url': url, 'title': url, 'comment': ''}, headers=_auth(token))
+        assert r.status_code == HTTPStatus.CREATED
+        return json.loads(r.data)['data']['id']
+
+    def test_list_shows_own_bookmarks(self, api, api_route, tokens):
+        self._post(api, api_route, tokens['alice'], 'http://alice.example.com')
+        self._post(api, api_route, tokens['bob'], 'http://bob.example.com')
+
+        for name, token in tokens.items():
+            r = api.get(api_route('/bookmarks'), headers=_auth(token))
+            urls = [b['url'] for b in json.loads(r.data)['data']]
+            assert urls == [f'http://{name}.example.com']
+
+    def test_foreign_bookmark_is_hidden(self, api, api_route, tokens):
+        bookmark_id = self._post(api, api_route, tokens['alice'], 'http://alice.example.com')
+        route = api_route(f'/bookmarks/{bookmark_id}')
+
+        assert api.get(route, headers=_auth(tokens['bob'])).status_code == HTTPStatus.NOT_FOUND
+        r = api.put(route, json={'url': 'http://bob.example.com', 'title': '', 'comment': ''},
+                    headers=_auth(tokens['bob']))
+        assert r.status_code == HTTPStatus.FORBIDDEN
+        assert api.delete(route, headers=_auth(tokens['bob'])).status_code == HTTPStatus.OK
+
+        r = api.get(route, headers=_auth(tokens['alice']))
+        assert r.status_code == HTTPStatus.OK
+        assert json.loads(r.data)['data']['url'] == 'http://alice.example.com'
+
+
+@pytest.fixture(name='shards')
+def _shards(wsgi_api, multi_user, tmp_path, monkeypatch):
+    """Two SQLite shard files next to the main DB, with engines created anew for them."""
+    import bookmarks._db as db
+    from bookmarks._db_init import create_database
+
+    shard_paths = [tmp_path / f'shard{i}.sqlite3' for i in range(2)]
+    monkeypatch.setattr(config, 'DB_SHARD_CONNECT_STRINGS', [f'sqlite:///{path}' for path in shard_paths])
+    for name in ('_engine', '_session', '_shard_engines', '_shard_sessions'):
+        monkeypatch.setattr(db, name, getattr(db, name))
+    db._engine = None
+    create_database()
+    yield shard_paths
+    for e in db.get_shard_engines():
+        e.dispose()
+
+
+class TestSharding:
+    def test_owners_in_separate_shards(self, wsgi_api, api_route, shards):
+        from sqlalchemy import create_engine, inspect, text
+        from bookmarks.auth import create_user
+        from bookmarks.schema import shard_for_owner
+
+        # Users get ids 1, 2, ... until two of them are in different shards.
+        users = []
+        while len({shard_for_owner(owner_id) for owner_id, _ in users}) < 2:
+            users.append((len(users) + 1, create_user(f'user{len(users)}')))
+        owners = [users[0], users[-1]]
+
+        for owner_id, token in owners:
+            r = wsgi_api.post(api_route('/bookmarks'), json={'url': token, 'title': '', 'comment': ''},
+                              headers=_auth(token))
+            assert r.status_code == HTTPStatus.CREATED
+            # Each shard numbers its bookmarks on its own.
+            assert json.loads(r.data)['data']['id'] == 1
+
+        for owner_id, token in owners:
+            e = create_engine(f'sqlite:///{shards[shard_for_owner(owner_id)]}')
+            with e.connect() as connection:
+                rows = connection.execute(text('SELECT owner_id, url FROM bookmarks')).all()
+            # Users and favicons stay in the main DB.
+            assert not {'users', 'favicons'} & set(inspect(e).get_table_names())
+            e.dispose()
+            assert [tuple(row) for row in rows] == [(owner_id, token)]
+
+            r = wsgi_api.get(api_route('/bookmarks/1'), headers=_auth(token))
+            assert json.loads(r.data)['data']['url'] == token
+            r = wsgi_api.get(api_route('/bookmarks'), headers=_auth(token))
+            assert [b['url'] for b in json.loads(r.data)['data']] == [token]
+
+    def test_shard_is_stable(self, monkeypatch):
+        import bookmarks._db as db
+        monkeypatch.setattr(db, 'shard_count', lambda: 4)
+        shards = [db.shard_for_owner(owner_id) for owner_id in range(1, 100)]
+        assert shards == [db.shard_for_owner(owner_id) for owner_id in range(1, 100)]
+        assert set(shards) == {0, 1, 2, 3}
+
+
+class TestAdminEndpoints:
+    @pytest.fixture(name='route', params=['/admission/stats', '/cache/stats'])
+    def _route(self, request, api_route, monkeypatch):
+        monkeypatch.setattr(config, 'CACHE_BACKEND', 'none')
+        return api_route(request.param)
+
+    @staticmethod
+    def _served(r):
+        # /cache/stats answers 404 while the cache is disabled, but only once the caller is let through.
+        return r.status_code in (HTTPStatus.OK, HTTPStatus.NOT_FOUND)
+
+    def test_single_user(self, wsgi_api, route):
+        assert self._served(wsgi_api.get(route))
+
+    def test_multi_user_without_admin_token(self, wsgi_api, route, multi_user):
+        from bookmarks.auth import create_user
+        token = create_user('alice')
+        assert wsgi_api.get(route).status_code == HTTPStatus.FORBIDDEN
+        assert wsgi_api.get(route, headers=_auth(token)).status_code == HTTPStatus.FORBIDDEN
+
+    def test_admin_token(self, wsgi_api, route, multi_user, monkeypatch):
+        from bookmarks.auth import create_user
+        monkeypatch.setattr(config, 'ADMIN_TOKEN', 'admin-secret')
+        user_token = create_user('alice')
+
+        assert wsgi_api.get(route).status_code == HTTPStatus.UNAUTHORIZED
+        assert wsgi_api.get(route, headers=_auth(user_token)).status_code == HTTPStatus.UNAUTHORIZED
+        assert self._served(wsgi_api.get(route, headers=_auth('admin-secret')))
@@ -0,0 +1,140 @@
+import json
+import time
+from http import HTTPStatus
+
+from bookmarks.bookmark import Bookmark
+
+
+_PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="windows-1251">
+    <title>
+        Пример   страницы
+    </title>
+    <meta name="description" content="Page description">
+    <meta property="og:title" content="OG title">
+    <link rel="shortcut icon" href="/static/icon.png">
+</head>
+<body>
+    <title>Not a title</title>
+</body>
+</html>
+'''.encode('windows-1251')
+
+_ICON = b'\x89PNG fake icon'
+
+
+class TestMetadataParser:
+    def test_incremental(self):
+        from bookmarks.enrichment import _PageReader
+        reader = _PageReader()
+        for i in range(0, len(_PAGE), 7):
+            if not reader({}, _PAGE[i:i + 7]):
+                break
+        reader.close()
+
+        assert reader.parser.done
+        assert reader.parser.title == 'Пример страницы'
+        assert reader.parser.description == 'Page description'
+        assert reader.parser.icon_href == '/static/icon.png'
+
+    def test_og_fallback(self):
+        from bookmarks.enrichment import MetadataParser
+        parser = MetadataParser()
+        parser.feed('<head><meta property="og:title" content="OG title">'
+                    '<meta property="og:description" content="OG description"></head>')
+
+        assert parser.title == 'OG title'
+        assert parser.description == 'OG description'
+
+
+class TestTtlCache:
+    def test_expiry_and_eviction(self):
+        from bookmarks.enrichment import TtlCache
+        now = [0.0]
+        cache = TtlCache(ttl=10, max_size=2, clock=lambda: now[0])
+
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)  # evicts the least recently used 'b'
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+
+        now[0] = 10
+        assert cache.get('a') is None
+        assert len(cache) == 1
+
+    def test_entry_ttl(self):
+        from bookmarks.enrichment import TtlCache
+        now = [0.0]
+        cache = TtlCache(ttl=10, max_size=2, clock=lambda: now[0])
+
+        cache.put('a', 1, ttl=1)
+        now[0] = 1
+        assert cache.get('a') is None
+
+
+class TestEnrichment:
+    def test_post_empty_title(self, wsgi_api, api_route, http_server, get_all_bookmarks):
+        from bookmarks.enrichment import get_enricher
+        from bookmarks.favicon import Favicon
+        from bookmarks.schema import ScopedSession
+
+        http_server.pages['/page'] = (200, {'Content-Type': 'text/html'}, _PAGE)
+        http_server.pages['/static/icon.png'] = (200, {'Content-Type': 'image/png'}, _ICON)
+
+        url = http_server.url('/page')
+        created = []
+        for _ in range(3):
+            r = wsgi_api.post(api_route('/bookmarks'), json={'url': url, 'title': '', 'comment': ''})
+            assert r.status_code == HTTPStatus.CREATED
+            created.append(json.loads(r.data)['data'])
+        # The response is not held back by the enrichment.
+        assert all(b['title'] == '' for b in created)
+
+        wsgi_api.post(api_route('/bookmarks'), json={'url': url, 'title': 'Own title', 'comment': ''})
+
+        get_enricher().wait_idle(timeout=10)
+
+        bookmarks = sorted(get_all_bookmarks(), key=lambda b: b.id)
+        for b in bookmarks[:3]:
+            assert b.title == 'Пример страницы'
+            assert b.description == 'Page description'
+            assert b.favicon_hash is not None
+        assert bookmarks[3].title == 'Own title'
+
+        # The page and the icon are fetched once and the icon is stored once.
+        assert http_server.requests.count(('GET', '/page')) == 1
+        assert http_server.requests.count(('GET', '/static/icon.png')) == 1
+        with ScopedSession() as session:
+            favicons = session.query(Favicon).all()
+            assert len(favicons) == 1
+            assert favicons[0].data == _ICON
+            assert favicons[0].content_type == 'image/png'
+
+    def test_missing_favicon_cached(self, wsgi_api, api_route, http_server):
+        from bookmarks.enrichment import get_enricher
+
+        for path in ('/a', '/b'):
+            http_server.pages[path] = (200, {'Content-Type': 'text/html'}, b'<head><title>No icon</title></head>')
+            wsgi_api.post(api_route('/bookmarks'), json={'url': http_server.url(path), 'title': '', 'comment': ''})
+            get_enricher().wait_idle(timeout=10)
+
+        # The second page of the site does not ask for the missing icon again.
+        assert http_server.requests.count(('GET', '/favicon.ico')) == 1
+
+    def test_error_page_cached_as_failure(self, database, http_server):
+        from bookmarks.enrichment import Enricher
+
+        http_server.pages['/page'] = (503, {'Content-Type': 'text/html'}, b'<title>Service Unavailable</title>')
+        enricher = Enricher(cache_ttl=3600, negative_cache_ttl=0.05)
+        enricher.submit(1, 1, http_server.url('/page'))
+        enricher.wait_idle(timeout=10)
+
+        time.sleep(0.1)
+        http_server.pages['/page'] = (200, {'Content-Type': 'text/html'}, _PAGE)
+        enricher.submit(1, 1, http_server.url('/page'))
+        enricher.wait_idle(timeout=10)
+        assert http_server.requests.count(('GET', '/page')) == 2
@@ -0,0 +1,180 @@
+import asyncio
+import ipaddress
+from urllib.parse import urlsplit
+
+import pytest
+
+import bookmarks.config as config
+from bookmarks._http import ForbiddenDestination, HttpClient, _host_header, _host_key, is_allowed_address
+
+
+class _KeepAliveServer:
+    """Answers every request with 200 on a keep-alive connection and counts the open connections."""
+
+    def __init__(self):
+        self.open_connections = 0
+        self.server = None
+
+    async def start(self) -> '_KeepAliveServer':
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return self
+
+    def url(self, path: str = '/') -> str:
+        return f'http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}{path}'
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.open_connections += 1
+        try:
+            while True:
+                await reader.readuntil(b'\r\n\r\n')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
+
+
+def _client(**kwargs) -> HttpClient:
+    return HttpClient(timeout=2.0, allowed_networks=config.FETCH_ALLOWED_NETWORKS, **kwargs)
+
+
+async def _servers(count: int):
+    return [await _KeepAliveServer().start() for _ in range(count)]
+
+
+async def _settle():
+    # Let the servers notice the closed connections.
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+
+
+class TestIdlePool:
+    def test_many_hosts(self):
+        async def run():
+            # Every port is a distinct host to the client.
+            servers = await _servers(40)
+            async with _client(max_connections=8, max_idle=5) as client:
+                for server in servers:
+                    assert (await client.request('GET', server.url(), max_body=1024)).status == 200
+                assert client.idle_connections() == 5
+                await _settle()
+                assert sum(server.open_connections for server in servers) == 5
+
+                # The most recently used hosts are the ones kept.
+                assert all(server.open_connections == 1 for server in servers[-5:])
+                await client.request('GET', servers[-1].url(), max_body=1024)
+                assert client.idle_connections() == 5
+            await _settle()
+            assert sum(server.open_connections for server in servers) == 0
+
+        asyncio.run(run())
+
+    def test_per_host_limit(self):
+        async def run():
+            server, = await _servers(1)
+            async with _client(max_per_host=4, max_idle_per_host=2) as client:
+                requests = (client.request('GET', server.url(), max_body=1024) for _ in range(4))
+                responses = await asyncio.gather(*requests)
+                assert [r.status for r in responses] == [200] * 4
+                assert client.idle_connections() == 2
+
+        asyncio.run(run())
+
+    def test_keep_alive_timeout(self):
+        async def run():
+            server, = await _servers(1)
+            async with _client(keep_alive_timeout=0.05) as client:
+                await client.request('GET', server.url(), max_body=1024)
+                assert client.idle_connections() == 1
+                # Closed while the client is not used at all.
+                await asyncio.sleep(0.2)
+                assert client.idle_connections() == 0
+                await _settle()
+                assert server.open_connections == 0
+
+        asyncio.run(run())
+
+
+class TestUrls:
+    def test_non_ascii(self, http_server):
+        # The stand-in server sees the request target as sent, i.e. percent-encoded.
+        http_server.pages['/%D0%BF%D1%80%D0%B8%D0%B2%D0%B5%D1%82/caf%C3%A9%20bar?q=%D0%BC%D0%B8%D1%80+1'] = \
+            (200, {}, b'ok')
+
+        async def run():
+            async with _client() as client:
+                return await client.request('GET', http_server.url('/привет/café bar?q=мир+1'), max_body=1024)
+
+        response = asyncio.run(run())
+        assert response.status == 200
+        assert response.body == b'ok'
+
+    def test_already_encoded(self, http_server):
+        http_server.pages['/a%20b?x=%2F'] = (200, {}, b'ok')
+
+        async def run():
+            async with _client() as client:
+                return await client.request('HEAD', http_server.url('/a%20b?x=%2F'))
+
+        assert asyncio.run(run()).status == 200
+
+    @pytest.mark.parametrize('url, key, host_header', [
+        ('http://Пример.РФ/', ('http', 'xn--e1afmkfd.xn--p1ai', 80), 'xn--e1afmkfd.xn--p1ai'),
+        ('https://example.com:8443/', ('https', 'example.com', 8443), 'example.com:8443'),
+        ('http://user@[::1]:8080/', ('http', '::1', 8080), '[::1]:8080'),
+    ])
+    def test_host(self, url, key, host_header):
+        assert _host_key(urlsplit(url)) == key
+        assert _host_header(key) == host_header
+
+
+class TestDestinations:
+    @pytest.mark.parametrize('address, allowed', [
+        ('93.184.216.34', True),
+        ('2606:2800:220:1:248:1893:25c8:1946', True),
+        ('127.0.0.1', False),
+        ('10.1.2.3', False),
+        ('192.168.0.1', False),
+        ('169.254.169.254', False),
+        ('100.64.0.1', False),
+        ('0.0.0.0', False),
+        ('224.0.0.1', False),
+        ('::1', False),
+        ('::ffff:127.0.0.1', False),
+        ('fe80::1%eth0', False),
+        ('fd00::1', False),
+    ])
+    def test_public_only(self, address, allowed):
+        assert is_allowed_address(address) is allowed
+
+    def test_allowed_networks(self):
+        assert is_allowed_address('10.1.2.3', [ipaddress.ip_network('10.0.0.0/8')])
+        assert not is_allowed_address('10.1.2.3', [ipaddress.ip_network('10.0.0.0/16')])
+
+    @pytest.mark.parametrize('url', [
+        'http://169.254.169.254/latest/meta-data/',
+        'http://localhost:1/',
+        'http://[::1]:1/',
+    ])
+    def test_refused(self, url):
+        async def run():
+            async with HttpClient(timeout=2.0) as client:
+                await client.request('GET', url)
+
+        with pytest.raises(ForbiddenDestination):
+            asyncio.run(run())
+
+    def test_redirect_checked(self, http_server):
+        http_server.pages['/ok'] = (200, {}, b'ok')
+        # 127.0.0.2 is on the loopback interface too, but not allowed.
+        http_server.pages['/internal'] = (302, {'Location': f'http://127.0.0.2:{http_server.server_port}/ok'}, b'')
+
+        async def run():
+            async with _client() as client:
+                await client.request('GET', http_server.url('/internal'))
+
+        with pytest.raises(ForbiddenDestination):
+            asyncio.run(run())
+        assert http_server.requests == [('GET', '/internal')]
@@ -0,0 +1,82 @@
+import os
+import pathlib
+import subprocess
+import sys
+from typing import Dict
+
+import bookmarks
+
+
+# `python -X importtime` budget for `import bookmarks.api` on top of Flask and SQLAlchemy, in microseconds.
+# Those two take ~330 ms by themselves and are imported first, so that only the package is measured:
+# 30-45 ms on a development machine, so the budget leaves more than 3x headroom for slow CI runners.
+IMPORT_TIME_TARGET_US = 150_000
+_FRAMEWORKS = 'import flask, sqlalchemy.orm'
+
+# Needed by the background jobs only, so imported by the handlers that start them.
+_DEFERRED_MODULES = ('bookmarks.archive', 'bookmarks._archive_store', 'bookmarks.enrichment', 'bookmarks._db_init',
+                     'multiprocessing', 'concurrent.futures.process', 'html.parser')
+
+_REQUIRED_SETTINGS = ('DB_CONNECT_STRING', 'WORKING_DIR', 'LOGS_DIR', 'SECRET_KEY', 'TIMEZONE')
+
+
+def _python(tmp_path: pathlib.Path, code: str, *options: str, **settings: str) -> subprocess.CompletedProcess:
+    env = {name: value for name, value in os.environ.items() if name not in _REQUIRED_SETTINGS}
+    env.update(settings)
+    env['PYTHONPATH'] = os.pathsep.join([str(pathlib.Path(bookmarks.__file__).parents[1]), env.get('PYTHONPATH', '')])
+    return subprocess.run([sys.executable, *options, '-c', code], cwd=tmp_path, env=env,
+                          capture_output=True, text=True, timeout=60)
+
+
+def _import_times(importtime_output: str) -> Dict[str, int]:
+    """Cumulative import time of every module, in microseconds."""
+    times = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[module.strip()] = int(cumulative)
+    return times
+
+
+class TestImport:
+    def test_no_side_effects(self, tmp_path):
+        r = _python(tmp_path, '\n'.join([
+            'import logging',
+            'root_handlers = list(logging.root.handlers)',
+            'import bookmarks.api, bookmarks.asgi, bookmarks.link_checker, bookmarks.__main__',
+            'import bookmarks._async_db, bookmarks._db, bookmarks.config',
+            'assert bookmarks._db._engine is None',
+            'assert bookmarks._async_db._async_engine is None',
+            'assert bookmarks.api._app is None',
+            'assert logging.root.handlers == root_handlers',
+            # Not even API_PREFIX: reading a setting looks for a .env file.
+            'read = [name for name in bookmarks.config._SETTINGS if name in vars(bookmarks.config)]',
+            'assert not read, read',
+        ]), WORKING_DIR=str(tmp_path / 'work'), LOGS_DIR='logs')
+
+        assert r.returncode == 0, r.stderr
+        assert not (tmp_path / 'work').exists()
+
+    def test_missing_setting_fails_on_use(self, tmp_path):
+        r = _python(tmp_path, 'import bookmarks.config as config; config.load()')
+        assert r.returncode != 0
+        assert 'DB_CONNECT_STRING' in r.stderr
+
+    def test_background_jobs_not_imported(self, tmp_path):
+        r = _python(tmp_path, '\n'.join([
+            'import sys',
+            'import bookmarks.api, bookmarks.asgi',
+            f'imported = [name for name in {_DEFERRED_MODULES!r} if name in sys.modules]',
+            'assert not imported, imported',
+        ]))
+        assert r.returncode == 0, r.stderr
+
+    def test_import_time(self, tmp_path):
+        r = _python(tmp_path, f'{_FRAMEWORKS}; import bookmarks.api', '-X', 'importtime')
+        assert r.returncode == 0, r.stderr
+
+        times = _import_times(r.stderr)
+        slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]
+        assert times['bookmarks.api'] < IMPORT_TIME_TARGET_US, f'Slowest imports (us): {slowest}'
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import errno
+
+from bookmarks.bookmark import Bookmark
+from bookmarks.link_checker import LinkChecker, UNREACHABLE_STATUS, _HostQueues
+
+
+def _run_checker(**kwargs):
+    return asyncio.run(LinkChecker(concurrency=4, per_host=2, timeout=2.0, batch_size=2, **kwargs).run())
+
+
+class TestLinkChecker:
+    def test_statuses(self, database, http_server, add_bookmark, get_all_bookmarks):
+        http_server.pages['/ok'] = (200, {}, b'ok')
+        http_server.pages['/moved'] = (302, {'Location': '/ok'}, b'')
+        http_server.pages['/no-head'] = (200, {}, None)
+
+        urls = {
+            1: http_server.url('/ok'),
+            2: http_server.url('/missing'),
+            3: http_server.url('/moved'),
+            4: http_server.url('/no-head'),
+            5: 'http://127.0.0.1:1/unreachable',
+            6: 'not a url',
+        }
+        for b_id, url in urls.items():
+            add_bookmark(Bookmark(id=b_id, url=url, title='nop', comment='nop'))
+
+        stats = _run_checker()
+        assert stats.checked == len(urls)
+        assert stats.alive == 3
+        assert stats.broken == 1
+        assert stats.unreachable == 1
+        assert stats.skipped == 1
+
+        bookmarks = {b.id: b for b in get_all_bookmarks()}
+        assert bookmarks[1].link_status == 200
+        assert bookmarks[2].link_status == 404
+        assert bookmarks[3].link_status == 200
+        assert bookmarks[3].final_url == http_server.url('/ok')
+        assert bookmarks[4].link_status == 200
+        assert bookmarks[5].link_status == UNREACHABLE_STATUS
+        assert bookmarks[6].link_status is None
+        assert all(b.last_checked is not None for b in bookmarks.values())
+
+    def test_recently_checked_skipped(self, database, http_server, add_bookmark):
+        http_server.pages['/ok'] = (200, {}, b'ok')
+        add_bookmark(Bookmark(id=1, url=http_server.url('/ok'), title='nop', comment='nop'))
+
+        assert _run_checker().checked == 1
+        assert _run_checker().checked == 0
+        assert _run_checker(recheck_after=datetime.timedelta(0)).checked == 1
+
+    def test_local_errors_not_stored(self, database, http_server, add_bookmark, get_all_bookmarks, monkeypatch):
+        from bookmarks._http import HttpClient
+
+        async def out_of_file_descriptors(self, method, url, **kwargs):
+            raise OSError(errno.EMFILE, 'Too many open files')
+
+        http_server.pages['/ok'] = (200, {}, b'ok')
+        add_bookmark(Bookmark(id=1, url=http_server.url('/ok'), title='nop', comment='nop'))
+        with monkeypatch.context() as m:
+            m.setattr(HttpClient, 'request', out_of_file_descriptors)
+            stats = _run_checker()
+        assert (stats.checked, stats.unreachable, stats.failed_locally) == (0, 0, 1)
+        bookmark, = get_all_bookmarks()
+        assert bookmark.link_status is None
+        assert bookmark.last_checked is None
+
+        assert _run_checker().alive == 1
+
+
+class TestHostQueues:
+    def test_busy_host_does_not_block_others(self):
+        async def run():
+            queues = _HostQueues(per_host=2, max_pending=100)
+            for i in range(10):
+                await queues.put('busy.example.com', f'busy {i}')
+            await queues.put('other.example.com', 'other')
+            await queues.close()
+
+            # Two for the busy host, then its slots are taken and the other host goes next.
+            handed_out = [await queues.get() for _ in range(3)]
+            assert [item for _, item in handed_out] == ['busy 0', 'other', 'busy 1']
+            get = asyncio.create_task(queues.get())
+            await asyncio.sleep(0.01)
+            assert not get.done()
+
+            await queues.task_done('busy.example.com')
+            assert await get == ('busy.example.com', 'busy 2')
+            for _ in range(2):
+                await queues.task_done('busy.example.com')
+
+            items = []
+            while (entry := await queues.get()) is not None:
+                items.append(entry[1])
+                await queues.task_done(entry[0])
+            assert items == [f'busy {i}' for i in range(3, 10)]
+
+        asyncio.run(run())
+
+    def test_bounded(self):
+        async def run():
+            queues = _HostQueues(per_host=1, max_pending=2)
+            await queues.put('a', 1)
+            await queues.put('b', 2)
+            put = asyncio.create_task(queues.put('c', 3))
+            await asyncio.sleep(0.01)
+            assert not put.done()
+            await queues.get()
+            await put
+
+        asyncio.run(run())
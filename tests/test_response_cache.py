@@ -0,0 +1,182 @@
+import json
+import os
+import sqlite3
+import time
+from http import HTTPStatus
+
+import pytest
+
+import bookmarks.config as config
+from bookmarks.bookmark import Bookmark
+from bookmarks.response_cache import RedisCacheBackend, ResponseCache, SqliteCacheBackend
+
+
+@pytest.fixture(name='response_cache')
+def _response_cache(tmp_path, monkeypatch):
+    import bookmarks.response_cache
+    cache = ResponseCache(SqliteCacheBackend(tmp_path / 'cache.sqlite3', max_bytes=1024*1024))
+    monkeypatch.setattr(config, 'CACHE_BACKEND', 'sqlite')
+    monkeypatch.setattr(bookmarks.response_cache, '_response_cache', cache)
+    yield cache
+
+
+@pytest.fixture(name='backend', params=['sqlite', 'redis'])
+def _backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SqliteCacheBackend(tmp_path / 'cache.sqlite3', max_bytes=1000)
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisCacheBackend(client=fakeredis.FakeRedis())
+
+
+class TestBackend:
+    def test_entries(self, backend):
+        assert backend.get('a') is None
+        backend.put('a', b'body a')
+        backend.put('a', b'new body a')
+        assert backend.get('a') == b'new body a'
+
+    def test_versions(self, backend):
+        assert backend.version('owner:1') == 0
+        backend.bump_version('owner:1')
+        backend.bump_version('owner:1')
+        assert backend.version('owner:1') == 2
+        assert backend.version('owner:2') == 0
+
+
+class TestSqliteBackend:
+    def test_size_bound(self, tmp_path):
+        backend = SqliteCacheBackend(tmp_path / 'cache.sqlite3', max_bytes=1000, touch_interval=0)
+        evicted = 0
+        for i in range(20):
+            evicted += backend.put(f'key {i}', bytes(100))
+            # Read after every store, so it stays the most recently used.
+            assert backend.get('key 0') == bytes(100)
+
+        stats = backend.stats()
+        assert stats['bytes'] <= 1000
+        assert stats['entries'] == 20 - evicted
+        # The least recently used entries go first.
+        assert backend.get('key 0') == bytes(100)
+        assert backend.get('key 1') is None
+        assert backend.get('key 19') == bytes(100)
+
+    def test_hit_during_write(self, tmp_path):
+        path = tmp_path / 'cache.sqlite3'
+        backend = SqliteCacheBackend(path, max_bytes=1000, touch_interval=0)
+        backend.put('key', b'body')
+
+        writer = sqlite3.connect(path, isolation_level=None)
+        writer.execute('BEGIN IMMEDIATE')
+        try:
+            started = time.monotonic()
+            assert backend.get('key') == b'body'
+            # Neither waits for the lock nor fails on it.
+            assert time.monotonic() - started < 1.0
+        finally:
+            writer.execute('ROLLBACK')
+            writer.close()
+
+    def test_old_file(self, tmp_path):
+        path = tmp_path / 'cache.sqlite3'
+        with sqlite3.connect(path) as connection:
+            connection.executescript('''
+                CREATE TABLE entries (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, body BLOB NOT NULL);
+                CREATE TABLE total_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+                INSERT INTO entries (key, body) VALUES ('key', 'body');
+                INSERT INTO total_size VALUES (0, 4);
+            ''')
+        connection.close()
+
+        backend = SqliteCacheBackend(path, max_bytes=1000)
+        assert backend.get('key') is None
+        assert backend.stats()['bytes'] == 0
+        backend.put('key', b'body')
+        assert backend.get('key') == b'body'
+
+    def test_too_large(self, tmp_path):
+        backend = SqliteCacheBackend(tmp_path / 'cache.sqlite3', max_bytes=10)
+        backend.put('key', bytes(11))
+        assert backend.get('key') is None
+
+    def test_shared_between_processes(self, tmp_path):
+        path = tmp_path / 'cache.sqlite3'
+        SqliteCacheBackend(path, max_bytes=1000).put('key', b'body')
+        # Another worker opens the same file.
+        other = SqliteCacheBackend(path, max_bytes=1000)
+        assert other.get('key') == b'body'
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+    def test_forked_child(self, tmp_path):
+        backend = SqliteCacheBackend(tmp_path / 'cache.sqlite3', max_bytes=1000)
+        backend.put('key', b'body')
+        pid = os.fork()
+        if pid == 0:
+            backend.bump_version('owner:1')
+            os._exit(0 if backend.get('key') == b'body' else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert backend.version('owner:1') == 1
+
+
+class TestRedisBackend:
+    def test_entries_expire(self):
+        fakeredis = pytest.importorskip('fakeredis')
+        client = fakeredis.FakeRedis()
+        backend = RedisCacheBackend(client=client, ttl=60)
+        backend.put('key', b'body')
+        backend.bump_version('owner:1')
+        assert 0 < client.pttl('bookmarks:cache:entry:key') <= 60_000
+        assert client.ttl('bookmarks:cache:version:owner:1') == -1
+
+
+class TestApiCache:
+    def test_hit(self, api, api_route, add_bookmark, response_cache):
+        add_bookmark(Bookmark(id=1, url='http://example.com', title='Пример', comment=''))
+
+        for route in ('/bookmarks', '/bookmarks/1'):
+            r_miss = api.get(api_route(route))
+            r_hit = api.get(api_route(route))
+            assert r_hit.status_code == r_miss.status_code == HTTPStatus.OK
+            assert r_hit.data == r_miss.data
+            assert r_hit.headers == r_miss.headers
+
+        stats = response_cache.stats()
+        assert (stats['hits'], stats['misses'], stats['hit_rate']) == (2, 2, 0.5)
+
+    def test_shared_by_both_apps(self, asgi_api, api_route, add_bookmark, response_cache):
+        from bookmarks.api import app
+        add_bookmark(Bookmark(id=1, url='http://example.com', title='Пример', comment=''))
+
+        with app.test_client() as client:
+            r_wsgi = client.get(api_route('/bookmarks/1'))
+        r_asgi = asgi_api.get(api_route('/bookmarks/1'))
+        assert r_asgi.data == r_wsgi.data
+        assert r_asgi.headers['Content-Length'] == r_wsgi.headers['Content-Length']
+        assert (response_cache.stats()['hits'], response_cache.stats()['stores']) == (1, 1)
+
+    def test_errors_not_cached(self, api, api_route, response_cache):
+        assert api.get(api_route('/bookmarks/42')).status_code == HTTPStatus.NOT_FOUND
+        assert response_cache.stats()['stores'] == 0
+
+    def test_writes_invalidate(self, api, api_route, response_cache):
+        def titles():
+            return [b['title'] for b in json.loads(api.get(api_route('/bookmarks')).data)['data']]
+
+        assert titles() == []
+        r = api.post(api_route('/bookmarks'), json={'url': 'http://example.com', 'title': 'old', 'comment': ''})
+        bookmark_id = json.loads(r.data)['data']['id']
+        assert titles() == ['old']
+
+        api.put(api_route(f'/bookmarks/{bookmark_id}'), json={'url': 'http://example.com', 'title': 'new', 'comment': ''})
+        assert titles() == ['new']
+
+        api.delete(api_route(f'/bookmarks/{bookmark_id}'))
+        assert titles() == []
+        assert response_cache.stats()['invalidations'] == 3
+
+    def test_stats(self, wsgi_api, api_route, response_cache):
+        wsgi_api.get(api_route('/bookmarks'))
+        stats = json.loads(wsgi_api.get(api_route('/cache/stats')).data)['data']
+        assert stats['backend'] == 'sqlite'
+        assert stats['misses'] == 1
+        assert stats['entries'] == 1
@@ -0,0 +1,122 @@
+import logging
+import os
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
+
+import pytest
+
+import bookmarks.config as config
+import bookmarks.log as log
+
+
+class TestCreateApp:
+    def test_creates_schema(self, db_path):
+        from sqlalchemy import inspect
+        from bookmarks.api import create_app
+        from bookmarks.schema import get_engine
+
+        create_app()
+        assert 'bookmarks' in inspect(get_engine()).get_table_names()
+
+        db_path.unlink()
+
+    def test_upgrades_existing_tables(self, db_path):
+        from sqlalchemy import inspect, text
+        from bookmarks.api import app, create_app
+        from bookmarks.schema import get_engine
+
+        # The bookmarks table as created by the first version.
+        with get_engine().begin() as connection:
+            connection.execute(text('CREATE TABLE bookmarks (id INTEGER NOT NULL PRIMARY KEY, url VARCHAR NOT NULL, '
+                                    'title VARCHAR NOT NULL, comment VARCHAR NOT NULL)'))
+            connection.execute(text("INSERT INTO bookmarks VALUES (1, 'http://example.com', 'Example', '')"))
+
+        create_app()
+        inspector = inspect(get_engine())
+        columns = {column['name'] for column in inspector.get_columns('bookmarks')}
+        assert {'owner_id', 'link_status', 'final_url', 'last_checked', 'description', 'favicon_hash'} <= columns
+        assert 'ix_bookmarks_owner_id_id' in {index['name'] for index in inspector.get_indexes('bookmarks')}
+
+        with app.test_client() as client:
+            r = client.get('/api/v1/bookmarks/1')
+        assert r.status_code == 200
+        assert r.json['data']['title'] == 'Example'
+
+        db_path.unlink()
+
+
+@pytest.fixture
+def fresh_logging(tmp_path, monkeypatch):
+    """Log files not opened yet, in tmp_path."""
+    monkeypatch.setattr(config, 'LOGS_DIR', tmp_path, raising=False)
+    monkeypatch.setattr(log, '_loggers', {})
+    monkeypatch.setattr(log, '_file_options', {})
+    monkeypatch.setattr(log, '_files_opened', False)
+    monkeypatch.setattr(log, '_rotate', True)
+    monkeypatch.setattr(logging.root, 'handlers', list(logging.root.handlers))
+    monkeypatch.setattr(logging.root, 'level', logging.root.level)
+    return tmp_path
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+class TestFork:
+    def test_child_gets_own_pool(self):
+        from bookmarks.schema import get_engine
+
+        engine = get_engine()
+        parent_pool = engine.pool
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, b'1' if engine.pool is not parent_pool else b'0')
+            os._exit(0)
+
+        os.close(write_fd)
+        result = os.read(read_fd, 1)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        assert result == b'1'
+
+    def test_child_stops_rotating_log_files(self, fresh_logging):
+        logger = log.get_logger('fork_test', logging.INFO)
+        log.setup_logging()
+        assert any(isinstance(h, RotatingFileHandler) for h in logger.handlers)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            file_handlers = [h for h in logger.handlers if isinstance(h, logging.FileHandler)]
+            ok = len(file_handlers) == 1 and type(file_handlers[0]) is WatchedFileHandler
+            logger.info('from the child')
+            os.write(write_fd, b'1' if ok else b'0')
+            os._exit(0)
+
+        os.close(write_fd)
+        result = os.read(read_fd, 1)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        assert result == b'1'
+        # The parent keeps its own handler.
+        assert any(isinstance(h, RotatingFileHandler) for h in logger.handlers)
+        assert 'from the child' in (fresh_logging / 'fork_test.log').read_text()
+        for handler in logger.handlers:
+            handler.close()
+
+
+class TestServeCommand:
+    def test_log_files_not_rotated(self, fresh_logging, monkeypatch):
+        import bookmarks.server
+        from bookmarks.__main__ import main
+
+        monkeypatch.setattr(config, 'load', lambda: None)
+        served = []
+        monkeypatch.setattr(bookmarks.server, 'serve', lambda *args: served.append(args))
+
+        main(['serve', '--workers', '2'])
+        assert served == [(None, 2, None, False)]
+        logger = log.get_logger('serve_test', logging.INFO)
+        file_handlers = [h for h in logger.handlers if isinstance(h, logging.FileHandler)]
+        assert [type(h) for h in file_handlers] == [WatchedFileHandler]
+        for handler in file_handlers:
+            handler.close()
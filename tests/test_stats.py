@@ -0,0 +1,111 @@
+import json
+from http import HTTPStatus
+
+from bookmarks.bookmark import Bookmark
+
+
+def _stats(api, api_route):
+    r = api.get(api_route('/bookmarks/stats'))
+    assert r.status_code == HTTPStatus.OK
+    return json.loads(r.data)['data']
+
+
+def _post(api, api_route, url):
+    r = api.post(api_route('/bookmarks'), json={'url': url, 'title': 'nop', 'comment': 'nop'})
+    return json.loads(r.data)['data']['id']
+
+
+class TestStats:
+    def test_empty(self, api, api_route):
+        stats = _stats(api, api_route)
+        assert stats['total'] == 0
+        assert stats['domains'] == []
+        assert stats['activity']['30d'] == {'created': 0, 'updated': 0, 'deleted': 0}
+
+    def test_writes_update_stats(self, api, api_route):
+        first = _post(api, api_route, 'http://example.com/a')
+        _post(api, api_route, 'http://Example.com/b')
+        other = _post(api, api_route, 'https://other.org/')
+
+        stats = _stats(api, api_route)
+        assert stats['total'] == 3
+        assert stats['domains'] == [{'domain': 'example.com', 'count': 2}, {'domain': 'other.org', 'count': 1}]
+
+        api.put(api_route(f'/bookmarks/{first}'), json={'url': 'https://other.org/x', 'title': '', 'comment': ''})
+        api.delete(api_route(f'/bookmarks/{other}'))
+        api.delete(api_route(f'/bookmarks/{other}'))  # Already gone: not counted again.
+
+        stats = _stats(api, api_route)
+        assert stats['total'] == 2
+        assert stats['domains'] == [{'domain': 'example.com', 'count': 1}, {'domain': 'other.org', 'count': 1}]
+        for window in ('1d', '7d', '30d'):
+            assert stats['activity'][window] == {'created': 3, 'updated': 1, 'deleted': 1}
+
+    def test_dialect_without_upsert(self, api, api_route, monkeypatch):
+        import bookmarks.collection_stats
+        monkeypatch.setattr(bookmarks.collection_stats, '_upsert_insert', lambda dialect: None)
+
+        first = _post(api, api_route, 'http://example.com/a')
+        _post(api, api_route, 'http://example.com/b')
+        api.put(api_route(f'/bookmarks/{first}'), json={'url': 'https://other.org/', 'title': '', 'comment': ''})
+
+        stats = _stats(api, api_route)
+        assert stats['total'] == 2
+        assert stats['domains'] == [{'domain': 'example.com', 'count': 1}, {'domain': 'other.org', 'count': 1}]
+        assert stats['activity']['1d'] == {'created': 2, 'updated': 1, 'deleted': 0}
+
+    def test_not_a_url(self, api, api_route):
+        _post(api, api_route, 'not a url')
+        assert _stats(api, api_route)['domains'] == [{'domain': '', 'count': 1}]
+
+
+class TestReconcile:
+    def test_fixes_drift(self, api, api_route, add_bookmark):
+        from bookmarks.stats_reconciler import reconcile_stats
+
+        _post(api, api_route, 'http://example.com/a')
+        # Written past the API, so the summary tables miss it.
+        add_bookmark(Bookmark(url='http://example.com/b', title='nop', comment='nop'))
+        assert _stats(api, api_route)['total'] == 1
+
+        result = reconcile_stats()
+        assert (result.owners, result.corrected) == (1, 1)
+        stats = _stats(api, api_route)
+        assert stats['total'] == 2
+        assert stats['domains'] == [{'domain': 'example.com', 'count': 2}]
+        # Recent activity is a log of writes, not derived from the bookmarks.
+        assert stats['activity']['1d']['created'] == 1
+
+        assert reconcile_stats().corrected == 0
+
+    def test_writes_during_reconcile(self, api, api_route, add_bookmark, monkeypatch):
+        import bookmarks.stats_reconciler as stats_reconciler
+        from bookmarks.collection_stats import OwnerStats
+        from bookmarks.schema import ScopedSession
+
+        _post(api, api_route, 'http://example.com/a')
+        # Other owners, written past the API.
+        for owner_id in (2, 3):
+            add_bookmark(Bookmark(owner_id=owner_id, url='http://other.org/', title='nop', comment='nop'))
+
+        # The API writes between the batches: they must neither wait for the reconciler nor be overwritten by it.
+        monkeypatch.setattr(stats_reconciler, '_OWNER_BATCH_SIZE', 1)
+        reconcile_owners = stats_reconciler._reconcile_owners
+        batches = []
+
+        def reconcile_and_write(shard, owner_ids, stats):
+            reconcile_owners(shard, owner_ids, stats)
+            batches.append(owner_ids)
+            _post(api, api_route, f'http://example.com/{len(batches)}')
+
+        monkeypatch.setattr(stats_reconciler, '_reconcile_owners', reconcile_and_write)
+        result = stats_reconciler.reconcile_stats()
+
+        assert batches == [[1], [2], [3]]
+        assert (result.owners, result.corrected) == (3, 2)
+        stats = _stats(api, api_route)
+        assert stats['total'] == 4
+        assert stats['domains'] == [{'domain': 'example.com', 'count': 4}]
+        for owner_id in (2, 3):
+            with ScopedSession(owner_id) as session:
+                assert session.query(OwnerStats.bookmarks).filter(OwnerStats.owner_id == owner_id).scalar() == 1